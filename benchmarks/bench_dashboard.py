@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+PiKVM Dashboard Service Benchmark
+Runs the service against a temporary data directory and a fake kvmd, drives
+realistic request mixes and compares the results with a stored baseline
+
+Usage:
+  python benchmarks/bench_dashboard.py                  # run and compare with baseline.json
+  python benchmarks/bench_dashboard.py --save-baseline  # run and store the results as the new baseline
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List
+
+import requests
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from fake_kvmd import FakeKvmd  # noqa: E402
+
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+
+
+# ============ SERVICE UNDER TEST ============
+
+class RemountCounter:
+    """Replacement for /usr/bin/rw and /usr/bin/ro that counts calls"""
+    
+    def __init__(self, cost: float):
+        self.cost = cost
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total_time = 0.0
+    
+    def __call__(self):
+        start = time.perf_counter()
+        if self.cost:
+            time.sleep(self.cost)
+        with self.lock:
+            self.count += 1
+            self.total_time += time.perf_counter() - start
+
+
+def start_service(data_dir: str, kvmd_url: str, remount_cost: float, storage: str = "json"):
+    """Import the service against a temp data dir and serve it on a free port"""
+    os.environ["PIKVM_DASHBOARD_DATA_DIR"] = data_dir
+    os.environ["PIKVM_DASHBOARD_STORAGE"] = storage
+    os.environ["PIKVM_DASHBOARD_UPLOAD_DIR"] = os.path.join(data_dir, "dashboard-images")
+    os.environ["PIKVM_API_BASE"] = kvmd_url
+    
+    import pikvm_dashboard_service as service
+    from werkzeug.serving import make_server
+    
+    remounts = RemountCounter(remount_cost)
+    service.writable_window.remount_rw = remounts
+    service.writable_window.remount_ro = remounts
+    
+    service.start_background_threads()
+    
+    server = make_server('127.0.0.1', 0, service.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return service, server, remounts
+
+
+# ============ LOAD GENERATION ============
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(base_url: str, clients: int, iterations: int,
+                 step: Callable[[requests.Session, str, int], List[requests.Response]]) -> dict:
+    """Run `step` iterations times on each of `clients` concurrent sessions"""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    
+    def client(client_id: int):
+        nonlocal errors
+        session = requests.Session()
+        local_latencies = []
+        local_errors = 0
+        for i in range(iterations):
+            for start, response in step(session, base_url, client_id * iterations + i):
+                local_latencies.append(time.perf_counter() - start)
+                if response is None or response.status_code >= 400:
+                    local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - started
+    
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    }
+
+
+def timed(method: Callable, *args, **kwargs):
+    """Issue one request, returns (start_time, response or None)"""
+    start = time.perf_counter()
+    try:
+        return start, method(*args, timeout=30, **kwargs)
+    except requests.RequestException:
+        return start, None
+
+
+def conditional_get(session, url: str, **kwargs):
+    """GET that revalidates with the last ETag this client saw, like the dashboard does"""
+    if not hasattr(session, 'etags'):
+        session.etags = {}
+    key = (url, tuple(sorted(kwargs.get('params', {}).items())))
+    headers = {'If-None-Match': session.etags[key]} if key in session.etags else {}
+    start, response = timed(session.get, url, headers=headers, **kwargs)
+    if response is not None and 'ETag' in response.headers:
+        session.etags[key] = response.headers['ETag']
+    return start, response
+
+
+def append_action(session, base, i):
+    return [timed(session.post, f"{base}/api/dashboard/actions",
+                  json={"pcName": f"PC {i % 20 + 1}", "action": "Power On", "method": "manual"})]
+
+
+def write_preferences(session, base, i):
+    return [timed(session.post, f"{base}/api/dashboard/preferences",
+                  json={"soundEnabled": i % 2 == 0, "theme": "dark" if i % 3 else "light"})]
+
+
+def schedule_crud(session, base, i):
+    far_future = int((time.time() + 30 * 86400) * 1000)
+    start, response = timed(session.post, f"{base}/api/dashboard/schedules",
+                            json={"port": i % 20, "action": "on", "time": far_future + i, "pcName": f"PC {i % 20 + 1}"})
+    results = [(start, response)]
+    if response is not None and response.ok:
+        schedule_id = response.json()["schedule"]["id"]
+        results.append(timed(session.delete, f"{base}/api/dashboard/schedules/{schedule_id}"))
+    return results
+
+
+def read_uptime(session, base, i):
+    return [timed(session.get, f"{base}/api/dashboard/uptime")]
+
+
+def dashboard_poll(session, base, i):
+    # What an open dashboard requests on its refresh timers
+    return [
+        conditional_get(session, f"{base}/api/dashboard/schedules"),
+        conditional_get(session, f"{base}/api/dashboard/actions", params={"after": 0, "limit": 20}),
+        conditional_get(session, f"{base}/api/dashboard/uptime")
+    ]
+
+
+SCENARIOS = [
+    # name, clients, iterations per client, step
+    ("action_log_append", 8, 50, append_action),
+    ("preference_write", 4, 50, write_preferences),
+    ("schedule_crud", 4, 25, schedule_crud),
+    ("uptime_read", 8, 100, read_uptime),
+    ("polling_clients", 40, 25, dashboard_poll),
+]
+
+
+def current_rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        return 0.0
+
+
+# ============ BASELINE COMPARISON ============
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return human-readable regressions of results against baseline"""
+    regressions = []
+    for name, base in baseline.get("scenarios", {}).items():
+        current = results["scenarios"].get(name)
+        if current is None:
+            continue
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors (baseline {base['errors']})")
+        if base["p99_ms"] and current["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {current['p99_ms']}ms (baseline {base['p99_ms']}ms)")
+        if base["throughput_rps"] and current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {current['throughput_rps']} req/s (baseline {base['throughput_rps']} req/s)")
+        if current["remounts"] > base["remounts"] * (1 + tolerance) + 2:
+            regressions.append(f"{name}: {current['remounts']} remounts (baseline {base['remounts']})")
+    return regressions
+
+
+def print_report(results: dict, out):
+    print(f"{'scenario':<20} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'remounts':>8}", file=out)
+    for name, r in results["scenarios"].items():
+        print(f"{name:<20} {r['requests']:>8} {r['errors']:>6} {r['p50_ms']:>8} {r['p99_ms']:>8} "
+              f"{r['throughput_rps']:>8} {r['remounts']:>8}", file=out)
+    process = results["process"]
+    print(f"RSS {process['rss_mb']} MB (peak {process['max_rss_mb']} MB), "
+          f"{results['kvmd_requests']} kvmd requests, "
+          f"{results['remount_seconds']}s spent remounting", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PiKVM dashboard service")
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help="Baseline results file")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="Allowed relative regression before failing (default 0.5 = 50%%)")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiply the iterations of every scenario")
+    parser.add_argument('--kvmd-latency', type=float, default=0.005, help="Seconds the fake kvmd takes per request")
+    parser.add_argument('--remount-cost', type=float, default=0.0, help="Seconds a simulated rw/ro remount takes")
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json', help="Storage backend to run against")
+    parser.add_argument('--no-event-stream', action='store_true',
+                        help="Have the fake kvmd refuse its websocket so the service polls /api/switch")
+    parser.add_argument('--verbose', action='store_true', help="Show the service's own output")
+    args = parser.parse_args()
+    
+    out = sys.stdout
+    if not args.verbose:
+        # The service logs with print() and werkzeug logs every request; keep the report readable
+        sys.stdout = open(os.devnull, 'w')
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    
+    data_dir = tempfile.mkdtemp(prefix="pikvm-dashboard-bench-")
+    kvmd = FakeKvmd(latency=args.kvmd_latency, websocket=not args.no_event_stream).start()
+    service, server, remounts = start_service(data_dir, kvmd.url, args.remount_cost, args.storage)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    
+    # Warm up every endpoint once
+    for step in (append_action, write_preferences, read_uptime, dashboard_poll):
+        step(requests.Session(), base_url, 0)
+    
+    results = {"scenarios": {}}
+    for name, clients, iterations, step in SCENARIOS:
+        # Start every scenario with nothing pending and the filesystem read-only
+        service.state_store.flush()
+        service.writable_window.close()
+        remounts_before = remounts.count
+        result = run_scenario(base_url, clients, max(1, int(iterations * args.scale)), step)
+        # Include the write-behind flush the scenario caused and closing its window
+        service.state_store.flush()
+        service.writable_window.close()
+        result["remounts"] = remounts.count - remounts_before
+        results["scenarios"][name] = result
+    
+    results["process"] = {
+        "rss_mb": current_rss_mb(),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+    results["kvmd_requests"] = kvmd.request_count()
+    results["remount_seconds"] = round(remounts.total_time, 3)
+    
+    server.shutdown()
+    kvmd.stop()
+    sys.stdout = out
+    
+    print_report(results, out)
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}", file=out)
+        return 0
+    
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one", file=out)
+        return 0
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("REGRESSIONS against baseline:", file=out)
+        for regression in regressions:
+            print(f"  {regression}", file=out)
+        return 1
+    print("No regressions against baseline", file=out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Stand-in kvmd for benchmarks and local development
+Emulates the parts of the PiKVM API the dashboard service uses
+"""
+
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def read_frame(rfile) -> Optional[Tuple[int, bytes]]:
+    """Read one (masked) client websocket frame, returns (opcode, payload) or None on EOF"""
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None
+    opcode, length = header[0] & 0x0F, header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', rfile.read(8))[0]
+    mask = rfile.read(4) if header[1] & 0x80 else b'\0\0\0\0'
+    payload = rfile.read(length)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def frame(opcode: int, payload: bytes = b'') -> bytes:
+    """Encode an unmasked server websocket frame"""
+    length = len(payload)
+    if length < 126:
+        return struct.pack('!BB', 0x80 | opcode, length) + payload
+    if length < 65536:
+        return struct.pack('!BBH', 0x80 | opcode, 126, length) + payload
+    return struct.pack('!BBQ', 0x80 | opcode, 127, length) + payload
+
+
+class FakeKvmd:
+    """In-process fake of kvmd's /api/switch, /api/atx/*, /api/hid/* and /api/ws endpoints.
+    
+    Power state follows the ATX commands it receives and the HDD LEDs of
+    powered-on ports flicker randomly (on every GET /api/switch and every
+    `flicker_interval` seconds), so the service sees realistic changes.
+    Websocket clients of /api/ws get the full switch state on connect and
+    a partial switch_state event per change. `latency` (seconds) is added
+    to every HTTP response; `websocket=False` answers /api/ws with a 404
+    to exercise the service's polling fallback.
+    """
+    
+    def __init__(self, port_count: int = 20, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0,
+                 websocket: bool = True, flicker_interval: float = 0.5):
+        self.port_count = port_count
+        self.latency = latency
+        self.websocket = websocket
+        self.flicker_interval = flicker_interval
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.version = 0
+        self.power = [i % 2 == 0 for i in range(port_count)]
+        self.hdd = [False] * port_count
+        self.active_port = 0
+        self.requests = {}
+        self._stopped = threading.Event()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        if self.flicker_interval:
+            threading.Thread(target=self._flicker, daemon=True).start()
+        return self
+    
+    def stop(self):
+        self._stopped.set()
+        with self.lock:
+            self.changed.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def _bump(self):
+        """Record a state change, lock must be held"""
+        self.version += 1
+        self.changed.notify_all()
+    
+    def _randomize_hdd(self):
+        """Flicker the HDD LEDs of powered-on ports, lock must be held"""
+        hdd = [on and random.random() < 0.3 for on in self.power]
+        if hdd != self.hdd:
+            self.hdd = hdd
+            self._bump()
+    
+    def _flicker(self):
+        while not self._stopped.wait(self.flicker_interval):
+            with self.lock:
+                self._randomize_hdd()
+    
+    def request_count(self, path: Optional[str] = None) -> int:
+        with self.lock:
+            if path is None:
+                return sum(self.requests.values())
+            return self.requests.get(path, 0)
+    
+    def _state(self) -> dict:
+        """Full switch state, lock must be held"""
+        return {
+            "model": {"ports": [{"name": f"PC {i + 1}"} for i in range(self.port_count)]},
+            "state": {"summary": {"active_port": self.active_port}},
+            "atx": {"leds": {"power": list(self.power), "hdd": list(self.hdd)}}
+        }
+    
+    def switch_state(self) -> dict:
+        """Body of GET /api/switch"""
+        with self.lock:
+            self._randomize_hdd()
+            return {"ok": True, "result": self._state()}
+    
+    def switch_event(self, full: bool = False) -> Tuple[int, dict]:
+        """Current version and a switch_state event; like kvmd, only the changing parts unless `full`"""
+        with self.lock:
+            state = self._state()
+            if not full:
+                del state["model"]
+            return self.version, {"event_type": "switch_state", "event": state}
+    
+    def handle_command(self, path: str, params: dict) -> dict:
+        """Apply a POST command, returns the response body"""
+        port = int(params.get('port', ['0'])[0])
+        with self.lock:
+            if not 0 <= port < self.port_count:
+                return {"ok": False, "result": {"error": "Invalid port"}}
+            if path.endswith('/atx/power'):
+                action = params.get('action', [''])[0]
+                if action == 'on':
+                    self.power[port] = True
+                elif action in ('off', 'off_hard'):
+                    self.power[port] = False
+            elif path.endswith('/atx/click'):
+                button = params.get('button', [''])[0]
+                if button in ('power', 'power_long'):
+                    self.power[port] = not self.power[port]
+            elif path == '/api/switch/set_active':
+                self.active_port = port
+            self._bump()
+        return {"ok": True, "result": {}}
+    
+    def _make_handler(self):
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def _respond(self, status: int, body: dict):
+                if fake.latency:
+                    threading.Event().wait(fake.latency)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def _count(self, path: str):
+                with fake.lock:
+                    fake.requests[path] = fake.requests.get(path, 0) + 1
+            
+            def _serve_websocket(self):
+                """Push switch_state events until the client goes away"""
+                accept = base64.b64encode(hashlib.sha1(
+                    (self.headers.get('Sec-WebSocket-Key', '') + WEBSOCKET_GUID).encode()).digest()).decode()
+                self.send_response(101)
+                self.send_header('Upgrade', 'websocket')
+                self.send_header('Connection', 'Upgrade')
+                self.send_header('Sec-WebSocket-Accept', accept)
+                self.end_headers()
+                self.close_connection = True
+                
+                send_lock = threading.Lock()
+                closed = threading.Event()
+                
+                def send(opcode: int, payload: bytes = b''):
+                    with send_lock:
+                        self.wfile.write(frame(opcode, payload))
+                        self.wfile.flush()
+                
+                def receive():
+                    # Answer pings and notice the client leaving
+                    try:
+                        while True:
+                            message = read_frame(self.rfile)
+                            if message is None or message[0] == 0x8:
+                                break
+                            if message[0] == 0x9:
+                                send(0xA, message[1])
+                    except OSError:
+                        pass
+                    closed.set()
+                    with fake.lock:
+                        fake.changed.notify_all()
+                
+                threading.Thread(target=receive, daemon=True).start()
+                try:
+                    version, event = fake.switch_event(full=True)
+                    send(0x1, json.dumps(event).encode())
+                    send(0x1, json.dumps({"event_type": "loop", "event": {}}).encode())
+                    while not closed.is_set() and not fake._stopped.is_set():
+                        with fake.lock:
+                            fake.changed.wait_for(lambda: fake.version != version or closed.is_set()
+                                                  or fake._stopped.is_set())
+                        if fake.version != version:
+                            version, event = fake.switch_event()
+                            send(0x1, json.dumps(event).encode())
+                    send(0x8)
+                except OSError:
+                    pass
+            
+            def do_GET(self):
+                url = urlparse(self.path)
+                self._count(url.path)
+                if url.path == '/api/switch':
+                    self._respond(200, fake.switch_state())
+                elif (url.path == '/api/ws' and fake.websocket
+                      and self.headers.get('Upgrade', '').lower() == 'websocket'):
+                    self._serve_websocket()
+                else:
+                    self._respond(404, {"ok": False, "result": {"error": "Not found"}})
+            
+            def do_POST(self):
+                url = urlparse(self.path)
+                self._count(url.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                if url.path in ('/api/atx/power', '/api/atx/click', '/api/switch/atx/power',
+                                '/api/switch/atx/click', '/api/switch/set_active',
+                                '/api/hid/print', '/api/hid/events/send_shortcut'):
+                    self._respond(200, fake.handle_command(url.path, parse_qs(url.query)))
+                else:
+                    self._respond(404, {"ok": False, "result": {"error": "Not found"}})
+        
+        return Handler
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    
+    parser = argparse.ArgumentParser(description="Run a stand-in kvmd")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--ports', type=int, default=20, help="Number of switch ports to emulate")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--no-websocket', action='store_true', help="Answer /api/ws with 404 (polling only)")
+    args = parser.parse_args()
+    
+    fake = FakeKvmd(port_count=args.ports, latency=args.latency, host='0.0.0.0', port=args.port,
+                    websocket=not args.no_websocket).start()
+    print(f"Fake kvmd listening on {fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
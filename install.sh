@@ -26,9 +26,11 @@ BASE_URL="https://raw.githubusercontent.com/${GITHUB_USER}/${GITHUB_REPO}/${GITH
 DASHBOARD_HTML_URL="${BASE_URL}/pikvm-dashboard.html"
 BACKEND_SCRIPT_URL="${BASE_URL}/pikvm_dashboard_service.py"
 SYSTEMD_SERVICE_URL="${BASE_URL}/pikvm-dashboard.service"
+BUILD_SCRIPT_URL="${BASE_URL}/tools/build_dashboard.py"
 
 # File paths
 DASHBOARD_PATH="/usr/share/kvmd/web/pikvm-dashboard.html"
+ASSETS_PATH="/usr/share/kvmd/web/dashboard-assets"
 BACKEND_PATH="/usr/local/bin/pikvm_dashboard_service.py"
 SERVICE_PATH="/etc/systemd/system/pikvm-dashboard.service"
 VENV_PATH="/var/lib/pikvm-dashboard/venv"
@@ -129,7 +131,8 @@ uninstall_dashboard() {
     print_step "Removing files..."
     rm -f "$SERVICE_PATH"
     rm -f "$BACKEND_PATH"
-    rm -f "$DASHBOARD_PATH"
+    rm -f "$DASHBOARD_PATH" "$DASHBOARD_PATH.gz"
+    rm -rf "$ASSETS_PATH"
     
     # Restore original nginx config if backup exists
     if [ -f /etc/kvmd/nginx/kvmd.ctx-server.conf.original ]; then
@@ -170,7 +173,7 @@ backup_existing_data() {
         local backup_file="$BACKUP_PATH/backup-$(date +%Y%m%d-%H%M%S).tar.gz"
         
         tar -czf "$backup_file" -C "$DATA_PATH" \
-            action_log.json preferences.json schedules.json uptime.json config.json .credentials 2>/dev/null || true
+            action_log.json action_log.jsonl preferences.json schedules.json followups.json uptime.json config.json icons.json dashboard.db .credentials 2>/dev/null || true
         
         if [ -f "$backup_file" ]; then
             print_success "Backup created: $backup_file"
@@ -314,9 +317,9 @@ rw || true  # Don't fail if already writable
 
 # Step 2: Install Python dependencies
 echo -e "${BLUE}[2/9] Installing Python dependencies...${NC}"
-if ! pacman -Q python-requests python-flask python-flask-cors &>/dev/null; then
+if ! pacman -Q python-requests python-flask python-flask-cors python-gunicorn &>/dev/null; then
     echo "Installing packages via pacman..."
-    pacman -Sy --noconfirm python-requests python-flask python-flask-cors
+    pacman -Sy --noconfirm python-requests python-flask python-flask-cors python-gunicorn
 else
     echo "Python packages already installed, skipping..."
 fi
@@ -326,13 +329,16 @@ echo -e "${BLUE}[3/9] Creating Python virtual environment...${NC}"
 if [ ! -d "$VENV_PATH" ]; then
     python3 -m venv "$VENV_PATH"
     source "$VENV_PATH/bin/activate"
-    pip install --quiet requests flask flask-cors
+    pip install --quiet requests flask flask-cors gunicorn
+    # Optional: resizes and transcodes uploaded icons
+    pip install --quiet pillow || echo "Pillow not available, custom icons will be stored as uploaded"
     deactivate
     echo "Virtual environment created successfully"
 else
     echo "Virtual environment already exists, updating packages..."
     source "$VENV_PATH/bin/activate"
-    pip install --quiet --upgrade requests flask flask-cors
+    pip install --quiet --upgrade requests flask flask-cors gunicorn
+    pip install --quiet --upgrade pillow || echo "Pillow not available, custom icons will be stored as uploaded"
     deactivate
 fi
 
@@ -371,8 +377,29 @@ else
     fi
 fi
 
+# Split the HTML into minified, cacheable assets. Rarely used features
+# (setup wizard, calendar, bulk edit, follow-ups) are loaded on first use.
+# The unbuilt HTML works on its own, so a failed build is not fatal.
+BUILD_SCRIPT="tools/build_dashboard.py"
+if [ ! -f "$BUILD_SCRIPT" ]; then
+    BUILD_SCRIPT=/tmp/build_dashboard.py
+    curl -fsSL "$BUILD_SCRIPT_URL" -o "$BUILD_SCRIPT" || rm -f "$BUILD_SCRIPT"
+fi
+if [ -f "$BUILD_SCRIPT" ] && python3 "$BUILD_SCRIPT" "$DASHBOARD_PATH" --assets-dir "$ASSETS_PATH"; then
+    chmod 755 "$ASSETS_PATH"
+    chmod 644 "$ASSETS_PATH"/*
+    echo -e "${GREEN}✓ Dashboard assets built in $ASSETS_PATH${NC}"
+else
+    echo -e "${YELLOW}⚠ Could not build dashboard assets, serving the single-file HTML${NC}"
+    rm -rf "$ASSETS_PATH"
+fi
+rm -f /tmp/build_dashboard.py
+
 # Fix permissions so nginx can read the file
 chmod 644 "$DASHBOARD_PATH"
+# Precompressed copy for nginx gzip_static
+gzip -9 -k -f "$DASHBOARD_PATH"
+chmod 644 "$DASHBOARD_PATH.gz"
 echo -e "${GREEN}✓ Dashboard HTML installed${NC}"
 
 # Step 5.5: Install dashboard images (logo and icons)
@@ -447,7 +474,7 @@ After=network.target kvmd.service
 Type=simple
 User=root
 WorkingDirectory=/usr/local/bin
-ExecStart=/var/lib/pikvm-dashboard/venv/bin/python /usr/local/bin/pikvm_dashboard_service.py
+ExecStart=/var/lib/pikvm-dashboard/venv/bin/python /usr/local/bin/pikvm_dashboard_service.py --production
 Restart=always
 RestartSec=10
 
@@ -471,38 +498,74 @@ if [ ! -f /etc/kvmd/nginx/kvmd.ctx-server.conf.original ]; then
     cp /etc/kvmd/nginx/kvmd.ctx-server.conf /etc/kvmd/nginx/kvmd.ctx-server.conf.original
 fi
 
-# Check if our config is already there
-if grep -q "# Dashboard - pikvm-dashboard installer" /etc/kvmd/nginx/kvmd.ctx-server.conf; then
-    echo "Dashboard nginx config already present, skipping..."
-else
-    # Create temp file with dashboard config inserted before "location /" block
-    awk '
-    /^location \/ \{/ && !inserted {
-        print "# Dashboard - pikvm-dashboard installer"
-        print "location = /pikvm-dashboard.html {"
-        print "\troot /usr/share/kvmd/web;"
-        print "\tinclude /etc/kvmd/nginx/loc-nocache.conf;"
-        print "\tauth_request off;"
-        print "}"
-        print ""
-        print "location /api/dashboard/ {"
-        print "\tproxy_pass http://127.0.0.1:5000/api/dashboard/;"
-        print "\tproxy_set_header Host $host;"
-        print "\tproxy_set_header X-Real-IP $remote_addr;"
-        print "\tproxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;"
-        print "\tproxy_set_header X-Forwarded-Proto $scheme;"
-        print "\tauth_request off;"
-        print "}"
-        print ""
-        inserted=1
+# Remove the block a previous install added, so updates pick up config changes.
+# Older installs did not write the end marker; their block ended with the
+# /api/dashboard/ location.
+NGINX_CONF=/etc/kvmd/nginx/kvmd.ctx-server.conf
+HAS_END_MARKER=0
+grep -q "# End dashboard - pikvm-dashboard installer" "$NGINX_CONF" && HAS_END_MARKER=1
+awk -v has_end="$HAS_END_MARKER" '
+/^# Dashboard - pikvm-dashboard installer/ { skipping=1; next }
+skipping {
+    if (has_end) {
+        if (/^# End dashboard - pikvm-dashboard installer/) { skipping=0; dropblank=1 }
+        next
     }
-    {print}
-    ' /etc/kvmd/nginx/kvmd.ctx-server.conf > /tmp/kvmd.ctx-server.conf.new
-    
-    # Replace the file
-    mv /tmp/kvmd.ctx-server.conf.new /etc/kvmd/nginx/kvmd.ctx-server.conf
-    echo -e "${GREEN}✓ Nginx config updated${NC}"
-fi
+    if (/^location \/api\/dashboard\//) in_api=1
+    if (in_api && /^}/) { skipping=0; in_api=0; dropblank=1 }
+    next
+}
+dropblank && /^$/ { dropblank=0; next }
+{ dropblank=0; print }
+' "$NGINX_CONF" > /tmp/kvmd.ctx-server.conf.stripped
+
+# Insert the dashboard config before the "location /" block.
+# The HTML is revalidated on every load (ETag, 304 when unchanged) and served
+# from a precompressed copy; uploaded icons are named after their content
+# hash, and so are the built JS/CSS assets, so they can be cached forever.
+awk '
+/^location \/ \{/ && !inserted {
+    print "# Dashboard - pikvm-dashboard installer"
+    print "location = /pikvm-dashboard.html {"
+    print "\troot /usr/share/kvmd/web;"
+    print "\tgzip_static on;"
+    print "\tetag on;"
+    print "\tadd_header Cache-Control \"no-cache\";"
+    print "\tauth_request off;"
+    print "}"
+    print ""
+    print "location ~ \"^/dashboard-images/[0-9a-f]{16}\\.(webp|png|jpg|jpeg|gif|svg)$\" {"
+    print "\troot /usr/share/kvmd/web;"
+    print "\tgzip_static on;"
+    print "\tadd_header Cache-Control \"public, max-age=31536000, immutable\";"
+    print "}"
+    print ""
+    print "location ~ \"^/dashboard-assets/[a-z0-9-]+\\.[0-9a-f]{12}\\.(js|css)$\" {"
+    print "\troot /usr/share/kvmd/web;"
+    print "\tgzip_static on;"
+    print "\tadd_header Cache-Control \"public, max-age=31536000, immutable\";"
+    print "\tauth_request off;"
+    print "}"
+    print ""
+    print "location /api/dashboard/ {"
+    print "\tproxy_pass http://127.0.0.1:5000/api/dashboard/;"
+    print "\tproxy_set_header Host $host;"
+    print "\tproxy_set_header X-Real-IP $remote_addr;"
+    print "\tproxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;"
+    print "\tproxy_set_header X-Forwarded-Proto $scheme;"
+    print "\tauth_request off;"
+    print "}"
+    print "# End dashboard - pikvm-dashboard installer"
+    print ""
+    inserted=1
+}
+{print}
+' /tmp/kvmd.ctx-server.conf.stripped > /tmp/kvmd.ctx-server.conf.new
+rm -f /tmp/kvmd.ctx-server.conf.stripped
+
+# Replace the file
+mv /tmp/kvmd.ctx-server.conf.new "$NGINX_CONF"
+echo -e "${GREEN}✓ Nginx config updated${NC}"
 
 # Restart nginx to apply changes
 systemctl restart kvmd-nginx
@@ -551,7 +614,8 @@ echo
 echo -e "${YELLOW}Next Steps:${NC}"
 echo "1. Navigate to the dashboard URL in your browser"
 echo "2. Log in with your PiKVM credentials"
-echo "3. Customize PC names if needed (edit $DASHBOARD_PATH)"
+echo "3. Rename PCs and change other options under Settings in the dashboard"
+echo "   (do not edit $DASHBOARD_PATH by hand: it is served precompressed, re-run this installer instead)"
 echo
 echo -e "${BLUE}Useful Commands:${NC}"
 echo "  Check service status:  systemctl status pikvm-dashboard.service"
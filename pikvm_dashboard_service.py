@@ -4,29 +4,127 @@ PiKVM Dashboard Backend Service
 Handles uptime tracking, action logs, user preferences, and scheduled actions
 """
 
+import asyncio
+import atexit
+import base64
+import bisect
+import copy
+import functools
+import gzip
+import io
+import hashlib
+import heapq
 import json
+import queue
+import random
+import re
+import signal
+import socket
+import sqlite3
+import ssl
+import struct
+import sys
 import time
+import tempfile
 import threading
 import subprocess
 import os
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
 from werkzeug.utils import secure_filename
 import requests
-from flask import Flask, jsonify, request
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 
-# Configuration
-DATA_DIR = Path("/var/lib/pikvm-dashboard")
-ACTION_LOG_FILE = DATA_DIR / "action_log.json"
+# Configuration (the environment overrides are used by the benchmark harness)
+DATA_DIR = Path(os.environ.get("PIKVM_DASHBOARD_DATA_DIR", "/var/lib/pikvm-dashboard"))
+ACTION_LOG_FILE = DATA_DIR / "action_log.json"  # Legacy format, migrated on first load
+ACTION_LOG_SEGMENT_FILE = DATA_DIR / "action_log.jsonl"
 PREFERENCES_FILE = DATA_DIR / "preferences.json"
 SCHEDULES_FILE = DATA_DIR / "schedules.json"
 UPTIME_FILE = DATA_DIR / "uptime.json"
 CONFIG_FILE = DATA_DIR / "config.json"
+FOLLOWUPS_FILE = DATA_DIR / "followups.json"  # Pending follow-up steps, survives restarts
+ICON_INDEX_FILE = DATA_DIR / "icons.json"  # Reference counts of uploaded icons
+
+# Storage backend: "json" (one file per document, the default) or "sqlite"
+STORAGE_BACKEND = os.environ.get("PIKVM_DASHBOARD_STORAGE", "json")
+DATABASE_FILE = DATA_DIR / "dashboard.db"  # Used by the sqlite backend
+
+# Production server (see run_production_server)
+SERVER_BIND = os.environ.get("PIKVM_DASHBOARD_BIND", "0.0.0.0:5000")
+SERVER_THREADS = int(os.environ.get("PIKVM_DASHBOARD_THREADS", "16"))
+# Each open event stream holds a server thread; the rest stay free for API requests
+SSE_MAX_STREAMS = max(1, SERVER_THREADS // 2)
+SSE_RETRY_AFTER = 30  # seconds a dashboard turned away from the event stream waits before retrying
+
+# Write-behind persistence: dirty documents are flushed together after this delay
+STATE_FLUSH_INTERVAL = 2.0  # seconds
+
+# The root filesystem is read-only on PiKVM; it stays writable this long after the last write
+REMOUNT_GRACE_PERIOD = 5.0  # seconds
+REMOUNT_RW_COMMAND = ['/usr/bin/rw']
+REMOUNT_RO_COMMAND = ['/usr/bin/ro']
+
+# Concurrent action fan-out (bulk actions and schedules due together)
+ACTION_MAX_CONCURRENCY = 8  # kvmd commands in flight at once
+ACTION_RATE_LIMIT = 10.0  # kvmd commands started per second
+SWITCH_CONFIRM_TIMEOUT = 5.0  # seconds for the switch to report a newly selected port active
+SWITCH_CONFIRM_POLL_INTERVAL = 0.1  # seconds between /api/switch checks while the event stream is down
+HID_BATCH_WINDOW = 0.05  # seconds to collect keyboard commands queued together before sending a batch
+HID_COMMAND_TIMEOUT = 60  # seconds a caller waits for a queued keyboard command, ports ahead of it included
+
+# Responses: JSON bodies larger than this are gzipped for clients that accept it
+GZIP_MIN_SIZE = 1024  # bytes
+GZIP_LEVEL = 6
+
+# Schedule occurrences
+OCCURRENCE_MAX_RANGE_DAYS = 400  # Longest range /schedules/occurrences will expand
+OCCURRENCE_CACHE_SIZE = 24  # Ranges (e.g. calendar months) kept in the occurrence index
+
+# Metrics (GET /metrics, Prometheus text format)
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+METRICS_LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # seconds
+METRICS_FLUSH_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12)  # documents per flush
+
+# Live status stream
+STATUS_SUBSCRIBER_QUEUE_SIZE = 100  # Pending events per dashboard before it is resynced
+SSE_KEEPALIVE_INTERVAL = 15  # seconds between keep-alive comments on idle streams
+STATUS_POLL_MAX_INTERVAL = 5.0  # seconds; polling backs off to this while nothing changes
+
+# kvmd event stream (websocket), /api/switch is only polled while it is down
+KVMD_EVENT_STREAM = os.environ.get("PIKVM_DASHBOARD_EVENT_STREAM", "1") != "0"
+KVMD_EVENT_STREAM_PATH = "/api/ws?stream=0"  # stream=0: no video streamer events
+KVMD_EVENT_STREAM_RETRY = (1, 60)  # seconds, first and longest delay between connection attempts
+KVMD_EVENT_STREAM_PING_INTERVAL = 15  # seconds of silence before pinging kvmd
+KVMD_EVENT_STREAM_MAX_MESSAGE = 1024 * 1024  # bytes
+
+# Uptime tracking
+UPTIME_CHECKPOINT_INTERVAL = 300  # seconds between saves while no port changes state
+UPTIME_MAX_SAMPLE_GAP = 300  # seconds; longer gaps between samples are not counted as uptime
+UPTIME_DAILY_HISTORY = 35  # days of per-day aggregates kept
+UPTIME_WEEKLY_HISTORY = 26  # weeks of per-week aggregates kept
+
+# Idle shutdown
+MAX_PORTS = 20  # Largest PiKVM Switch chain supported
+
+# Worker threads executing follow-up steps once their delay has elapsed
+FOLLOWUP_WORKERS = 4
+
+# Longest the scheduler sleeps without re-checking the clock (covers NTP jumps at boot)
+SCHEDULER_MAX_SLEEP = 60.0  # seconds
 
 # Default settings
 DEFAULT_ACTION_LOG_LIMIT = 100
+ACTION_LOG_COMPACT_FACTOR = 2  # Compact the segment once it holds this many times the limit
 DEFAULT_PREFERENCES = {
     "soundEnabled": True,
     "theme": "dark",
@@ -81,7 +179,28 @@ DEFAULT_CONFIG = {
 }
 
 # PiKVM API configuration
-PIKVM_API_BASE = "http://localhost"
+PIKVM_API_BASE = os.environ.get("PIKVM_API_BASE", "http://localhost")
+PIKVM_POOL_SIZE = 10  # Keep-alive connections to kvmd
+PIKVM_TIMEOUTS = {  # seconds, per endpoint group
+    "status": 3,
+    "atx": 5,
+    "switch": 5,
+    "hid": 10
+}
+PIKVM_READ_RETRIES = 2  # Extra attempts for idempotent reads
+PIKVM_RETRY_BACKOFF = 0.25  # seconds, doubled per attempt and jittered
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures before failing fast
+CIRCUIT_RESET_TIMEOUT = 30  # seconds before a trial request is let through
+
+# Keyboard shortcuts to PiKVM key codes (W3C KeyboardEvent.code values)
+KEYBOARD_SHORTCUTS = {
+    'ctrl-alt-del': 'ControlLeft,AltLeft,Delete',
+    'ctrl-alt-esc': 'ControlLeft,AltLeft,Escape',
+    'alt-f4': 'AltLeft,F4',
+    'win': 'MetaLeft',
+    'win-r': 'MetaLeft,KeyR',
+    'win-l': 'MetaLeft,KeyL'
+}
 
 app = Flask(__name__)
 CORS(app)
@@ -90,58 +209,1364 @@ CORS(app)
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-# ============ HELPER FUNCTIONS ============
-
-def load_json_file(filepath: Path, default: dict) -> dict:
-    """Load JSON file with fallback to default"""
+# ============ METRICS ============
+
+def _label_string(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with one series per combination of label values"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+    
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_label_string(self.labels, key)} {value}" for key, value in values]
+
+
+class Gauge:
+    """Value read from a callback when the metrics are scraped"""
+    
+    kind = 'gauge'
+    
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+    
+    def samples(self) -> List[str]:
+        return [f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    """Bucketed distribution with one series per combination of label values.
+    
+    observe() is a bisect and a few increments under a lock, cheap enough
+    to stay on every request and kvmd call.
+    """
+    
+    kind = 'histogram'
+    
+    def __init__(self, name: str, help_text: str, labels: tuple = (),
+                 buckets: tuple = METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # Per series: one count per bucket, then the +Inf count, then the sum
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+    
+    def timed(self, *label_values):
+        """Decorator observing how long each call of the wrapped function takes"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *label_values)
+            return wrapper
+        return decorator
+    
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                bucket_labels = _label_string(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _label_string(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {values[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """The service's metrics, rendered in the Prometheus text format.
+    
+    Values are per process; the default deployment runs a single worker.
+    """
+    
+    def __init__(self):
+        self._metrics = []
+    
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+request_duration = metrics.register(Histogram(
+    'pikvm_dashboard_request_duration_seconds', 'Time to handle API requests, per route',
+    ('method', 'route')))
+kvmd_request_duration = metrics.register(Histogram(
+    'pikvm_dashboard_kvmd_request_duration_seconds', 'Latency of kvmd API calls, per endpoint',
+    ('endpoint',)))
+kvmd_errors = metrics.register(Counter(
+    'pikvm_dashboard_kvmd_errors_total', 'Failed kvmd API calls (including fast failures of the open circuit)',
+    ('endpoint',)))
+remount_duration = metrics.register(Histogram(
+    'pikvm_dashboard_remount_duration_seconds', 'Time spent remounting the root filesystem',
+    ('mode',)))
+state_flush_documents = metrics.register(Histogram(
+    'pikvm_dashboard_state_flush_documents', 'Documents written per state store flush',
+    buckets=METRICS_FLUSH_SIZE_BUCKETS))
+state_flush_duration = metrics.register(Histogram(
+    'pikvm_dashboard_state_flush_duration_seconds', 'Time to write a state store flush batch'))
+scheduler_lag = metrics.register(Histogram(
+    'pikvm_dashboard_scheduler_lag_seconds', 'Time between when a schedule or follow-up step was due and when it fired',
+    ('kind',), buckets=METRICS_LAG_BUCKETS))
+execution_duration = metrics.register(Histogram(
+    'pikvm_dashboard_execution_duration_seconds', 'Time to execute due schedules and follow-up steps',
+    ('kind',)))
+
+
+@app.before_request
+def start_request_timer():
+    request.environ['pikvm_dashboard.start'] = time.perf_counter()
+
+
+@app.after_request
+def observe_request_duration(response: Response) -> Response:
+    # Registered before the other after_request hooks, so it runs after them
+    start = request.environ.get('pikvm_dashboard.start')
+    if start is not None:
+        rule = request.url_rule
+        request_duration.observe(time.perf_counter() - start, request.method,
+                                 rule.rule if rule is not None else 'unmatched')
+    return response
+
+
+# ============ WRITABLE FILESYSTEM WINDOW ============
+
+def _run_remount_command(command: List[str]):
+    """Run a remount command, logging instead of raising on failure"""
+    try:
+        subprocess.run(command, check=False)
+    except Exception as e:
+        print(f"Error running {' '.join(command)}: {e}")
+
+
+class WritableWindow:
+    """Reference-counted read-write remount of the PiKVM root filesystem.
+    
+    Concurrent writers share a single `rw` remount. When the last writer
+    leaves, the filesystem stays writable for `grace_period` seconds so that
+    bursts of writes reuse the open window, then `ro` is run once it has
+    gone idle. The remount callables are pluggable so the service can run
+    without the real /usr/bin/rw and /usr/bin/ro.
+    """
+    
+    def __init__(self, remount_rw: Optional[Callable[[], None]] = None,
+                 remount_ro: Optional[Callable[[], None]] = None,
+                 grace_period: float = REMOUNT_GRACE_PERIOD):
+        self.remount_rw = remount_duration.timed('rw')(remount_rw or (lambda: _run_remount_command(REMOUNT_RW_COMMAND)))
+        self.remount_ro = remount_duration.timed('ro')(remount_ro or (lambda: _run_remount_command(REMOUNT_RO_COMMAND)))
+        self.grace_period = grace_period
+        self._lock = threading.Lock()
+        self._writers = 0
+        self._writable = False
+        self._close_timer = None
+    
+    def acquire(self):
+        """Enter the window, remounting read-write if it is not open yet"""
+        with self._lock:
+            self._writers += 1
+            if self._close_timer is not None:
+                self._close_timer.cancel()
+                self._close_timer = None
+            if not self._writable:
+                # Remount while holding the lock so concurrent writers wait for it
+                self.remount_rw()
+                self._writable = True
+    
+    def release(self):
+        """Leave the window, scheduling the read-only remount once it is idle"""
+        with self._lock:
+            self._writers -= 1
+            if self._writers == 0 and self._writable:
+                self._close_timer = threading.Timer(self.grace_period, self._close_if_idle)
+                self._close_timer.daemon = True
+                self._close_timer.start()
+    
+    @contextmanager
+    def open(self):
+        """Context manager keeping the filesystem writable for its body"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+    
+    def close(self):
+        """Remount read-only now if nobody is writing (used at shutdown)"""
+        with self._lock:
+            if self._close_timer is not None:
+                self._close_timer.cancel()
+                self._close_timer = None
+            if self._writers == 0 and self._writable:
+                self.remount_ro()
+                self._writable = False
+    
+    def _close_if_idle(self):
+        with self._lock:
+            # A newer timer replaced this one, or a writer came back
+            if self._close_timer is not threading.current_thread():
+                return
+            self._close_timer = None
+            if self._writers == 0 and self._writable:
+                self.remount_ro()
+                self._writable = False
+
+
+writable_window = WritableWindow()
+atexit.register(writable_window.close)
+
+
+# ============ STORAGE BACKENDS ============
+
+def _read_json_file(filepath: Path, default: dict) -> dict:
+    """Read JSON file from disk with fallback to default"""
     if filepath.exists():
         try:
             with open(filepath, 'r') as f:
                 return json.load(f)
         except (json.JSONDecodeError, IOError):
-            return default.copy()
-    return default.copy()
+            return copy.deepcopy(default)
+    return copy.deepcopy(default)
 
 
-def save_json_file(filepath: Path, data: dict) -> bool:
-    """Save data to JSON file"""
-    import subprocess
+def _write_json_file_atomic(filepath: Path, data: dict):
+    """Write a temp file next to the document and rename it over the old one,
+    so a crash or power loss never leaves a truncated document behind"""
+    fd, temp_path = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.", suffix='.tmp')
     try:
-        # Make filesystem writable
-        subprocess.run(['/usr/bin/rw'], check=False)
-        
-        with open(filepath, 'w') as f:
+        with os.fdopen(fd, 'w') as f:
             json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _write_json_files(documents: Dict[Path, dict]) -> List[Path]:
+    """Write a batch of documents to disk, returns the paths that failed"""
+    failed = []
+    with writable_window.open():
+        for filepath, data in documents.items():
+            try:
+                _write_json_file_atomic(filepath, data)
+            except Exception as e:
+                print(f"Error saving JSON file {filepath}: {e}")
+                failed.append(filepath)
+    
+    return failed
+
+
+class JsonStorage:
+    """Default backend: one JSON file per document, actions in a JSONL segment.
+    
+    New action log entries are appended to the segment; once it grows past
+    ACTION_LOG_COMPACT_FACTOR times the log limit it is rewritten from the
+    in-memory ring.
+    """
+    
+    def __init__(self, segment_file: Path, legacy_file: Path):
+        self.segment_file = segment_file
+        self.legacy_file = legacy_file
+        self._segment_lines = 0
+    
+    def read_document(self, filepath: Path, default: dict) -> dict:
+        return _read_json_file(filepath, default)
+    
+    def write_documents(self, documents: Dict[Path, dict]) -> List[Path]:
+        return _write_json_files(documents)
+    
+    def load_actions(self, limit: int) -> tuple:
+        """All stored action log entries oldest first, and whether they need rewriting"""
+        entries = []
+        if self.segment_file.exists():
+            try:
+                with open(self.segment_file, 'r') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            entries.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue
+            except IOError as e:
+                print(f"Error reading action log: {e}")
+            self._segment_lines = len(entries)
+            return entries, False
+        
+        if self.legacy_file.exists():
+            # Old action_log.json stored newest first and without ids
+            legacy = _read_json_file(self.legacy_file, {"actions": []})
+            for entry_id, entry in enumerate(reversed(legacy.get("actions", [])), start=1):
+                entry['id'] = entry_id
+                entries.append(entry)
+            return entries, True
+        
+        return entries, False
+    
+    def save_actions(self, new_entries: List[dict], ring: List[dict], limit: int, rewrite: bool):
+        """Persist new entries, raises on failure"""
+        compact = rewrite or self._segment_lines + len(new_entries) > ACTION_LOG_COMPACT_FACTOR * limit
+        if not new_entries and not compact:
+            return
+        
+        lines = [json.dumps(entry) + '\n' for entry in (ring if compact else new_entries)]
+        with writable_window.open():
+            if compact:
+                temp_file = self.segment_file.with_suffix('.jsonl.tmp')
+                with open(temp_file, 'w') as f:
+                    f.writelines(lines)
+                os.replace(temp_file, self.segment_file)
+                if self.legacy_file.exists():
+                    self.legacy_file.unlink()
+            else:
+                with open(self.segment_file, 'a') as f:
+                    f.writelines(lines)
+        
+        if compact:
+            self._segment_lines = len(lines)
+        else:
+            self._segment_lines += len(lines)
+
+
+class SqliteStorage:
+    """SQLite backend, enabled with PIKVM_DASHBOARD_STORAGE=sqlite.
+    
+    Schedules, uptime counters and per-day/per-week uptime history, and
+    action log entries are stored as indexed rows. Everything else is a
+    JSON document row. A save is diffed against what was last written, so
+    a flush only upserts and deletes the rows that changed. The connection
+    only lives for one batch inside the writable window, because an open
+    database would keep the read-only remount from succeeding. Closing it
+    checkpoints the WAL. Reads open the database read-only and do not
+    remount. The existing JSON files are imported the first time the
+    database is opened (see import_json).
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, body TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY, position INTEGER NOT NULL, time INTEGER, body TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS schedules_time ON schedules (time);
+        CREATE TABLE IF NOT EXISTS uptime_ports (
+            port TEXT PRIMARY KEY, total_uptime REAL, boot_time REAL, last_check REAL);
+        CREATE TABLE IF NOT EXISTS uptime_history (
+            port TEXT, period TEXT, bucket TEXT, seconds REAL,
+            PRIMARY KEY (port, period, bucket)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS actions (
+            id INTEGER PRIMARY KEY, timestamp TEXT, pc_name TEXT, action TEXT, method TEXT);
+        -- The action log is filtered in memory (it holds every stored entry), no index pays for itself
+        DROP INDEX IF EXISTS actions_pc_name;
+        DROP INDEX IF EXISTS actions_method;
+    """
+    
+    # Key columns of each row table, the remaining columns follow them
+    TABLE_KEYS = {
+        'documents': ('name',),
+        'schedules': ('id',),
+        'uptime_ports': ('port',),
+        'uptime_history': ('port', 'period', 'bucket'),
+    }
+    TABLE_COLUMNS = {
+        'documents': ('name', 'body'),
+        'schedules': ('id', 'position', 'time', 'body'),
+        'uptime_ports': ('port', 'total_uptime', 'boot_time', 'last_check'),
+        'uptime_history': ('port', 'period', 'bucket', 'seconds'),
+    }
+    
+    def __init__(self, db_file: Path, json_storage: JsonStorage):
+        self.db_file = db_file
+        self.json_storage = json_storage
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._written: Dict[Path, Dict[str, dict]] = {}  # path -> table -> key -> row
+    
+    @contextmanager
+    def _connect(self, readonly: bool = False):
+        """Connection for one batch, committed on success.
+        
+        With readonly, the database is opened immutable outside the writable
+        window: every connection of this process is serialized by _lock and
+        closing one checkpoints the WAL, so the file is complete. A leftover
+        WAL (after a crash) or a database not set up yet takes the writable
+        path once to recover.
+        """
+        with self._lock:
+            wal_file = self.db_file.with_name(self.db_file.name + '-wal')
+            if readonly and self._initialized and not (wal_file.exists() and wal_file.stat().st_size):
+                conn = sqlite3.connect(f"{self.db_file.as_uri()}?mode=ro&immutable=1", uri=True)
+                try:
+                    yield conn
+                finally:
+                    conn.close()
+                return
+            
+            with writable_window.open():
+                conn = sqlite3.connect(self.db_file)
+                try:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    if not self._initialized:
+                        conn.executescript(self.SCHEMA)
+                        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone() is None:
+                            self.import_json(conn)
+                        self._initialized = True
+                    with conn:
+                        yield conn
+                finally:
+                    conn.close()
+    
+    # Mapping between documents and rows
+    
+    def _rows(self, filepath: Path, data: dict) -> Dict[str, dict]:
+        """Rows representing a document, table -> key -> row tuple"""
+        if filepath == SCHEDULES_FILE:
+            return {'schedules': {
+                (schedule['id'],): (schedule['id'], position, schedule.get('time'), json.dumps(schedule))
+                for position, schedule in enumerate(data.get('schedules', []))
+            }}
+        if filepath == UPTIME_FILE:
+            ports, history = {}, {}
+            for port, port_data in data.items():
+                ports[(port,)] = (port, port_data.get('totalUptime', 0),
+                                  port_data.get('bootTime'), port_data.get('lastCheck'))
+                for period in ('daily', 'weekly'):
+                    for bucket, seconds in port_data.get(period, {}).items():
+                        history[(port, period, bucket)] = (port, period, bucket, seconds)
+            return {'uptime_ports': ports, 'uptime_history': history}
+        return {'documents': {(filepath.name,): (filepath.name, json.dumps(data))}}
+    
+    def _read(self, conn: sqlite3.Connection, filepath: Path) -> Optional[dict]:
+        """Assemble a document from its rows, None if it was never saved"""
+        if filepath == SCHEDULES_FILE:
+            rows = conn.execute("SELECT body FROM schedules ORDER BY position").fetchall()
+            has_doc = conn.execute("SELECT 1 FROM meta WHERE key = 'schedules_saved'").fetchone()
+            if not rows and not has_doc:
+                return None
+            return {"schedules": [json.loads(body) for body, in rows]}
+        if filepath == UPTIME_FILE:
+            ports = {}
+            for port, total, boot_time, last_check in conn.execute("SELECT * FROM uptime_ports"):
+                ports[port] = {"totalUptime": total, "bootTime": boot_time, "lastCheck": last_check,
+                               "daily": {}, "weekly": {}}
+            if not ports:
+                return None
+            for port, period, bucket, seconds in conn.execute(
+                    "SELECT * FROM uptime_history ORDER BY port, period, bucket"):
+                if port in ports:
+                    ports[port][period][bucket] = seconds
+            return ports
+        row = conn.execute("SELECT body FROM documents WHERE name = ?", (filepath.name,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def _write(self, conn: sqlite3.Connection, filepath: Path, data: dict):
+        """Upsert the changed rows of a document and delete the removed ones"""
+        if filepath not in self._written:
+            stored = self._read(conn, filepath)
+            self._written[filepath] = self._rows(filepath, stored) if stored is not None else {}
+        previous = self._written[filepath]
+        rows = self._rows(filepath, data)
+        
+        for table, table_rows in rows.items():
+            old_rows = previous.get(table, {})
+            keys = self.TABLE_KEYS[table]
+            columns = self.TABLE_COLUMNS[table]
+            removed = [key for key in old_rows if key not in table_rows]
+            changed = [row for key, row in table_rows.items() if old_rows.get(key) != row]
+            if removed:
+                conn.executemany(
+                    f"DELETE FROM {table} WHERE " + " AND ".join(f"{key} = ?" for key in keys), removed)
+            if changed:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * len(columns))})", changed)
+        if filepath == SCHEDULES_FILE:
+            # An emptied schedule list is still a saved document
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('schedules_saved', '1')")
+        self._written[filepath] = rows
+    
+    # Storage interface
+    
+    def read_document(self, filepath: Path, default: dict) -> dict:
+        try:
+            with self._connect(readonly=True) as conn:
+                data = self._read(conn, filepath)
+                self._written[filepath] = self._rows(filepath, data) if data is not None else {}
+        except sqlite3.Error as e:
+            print(f"Error reading {filepath.name} from database: {e}")
+            return copy.deepcopy(default)
+        return data if data is not None else copy.deepcopy(default)
+    
+    def write_documents(self, documents: Dict[Path, dict]) -> List[Path]:
+        try:
+            with self._connect() as conn:
+                for filepath, data in documents.items():
+                    self._write(conn, filepath, data)
+        except sqlite3.Error as e:
+            print(f"Error saving to database: {e}")
+            # The transaction was rolled back, diff against the database next time
+            for filepath in documents:
+                self._written.pop(filepath, None)
+            return list(documents)
+        return []
+    
+    def load_actions(self, limit: int) -> tuple:
+        with self._connect(readonly=True) as conn:
+            rows = conn.execute(
+                "SELECT id, timestamp, pc_name, action, method FROM actions ORDER BY id DESC LIMIT ?",
+                (limit,)).fetchall()
+        entries = [{"id": entry_id, "pcName": pc_name, "action": action, "method": method, "timestamp": timestamp}
+                   for entry_id, timestamp, pc_name, action, method in reversed(rows)]
+        return entries, False
+    
+    def save_actions(self, new_entries: List[dict], ring: List[dict], limit: int, rewrite: bool):
+        if not new_entries and not rewrite:
+            return
+        with self._connect() as conn:
+            self._insert_actions(conn, ring if rewrite else new_entries)
+            # Entries that fell out of the ring
+            if ring:
+                conn.execute("DELETE FROM actions WHERE id < ?", (ring[0]['id'],))
+            else:
+                conn.execute("DELETE FROM actions")
+    
+    @staticmethod
+    def _insert_actions(conn: sqlite3.Connection, entries: List[dict]):
+        conn.executemany(
+            "INSERT OR REPLACE INTO actions (id, timestamp, pc_name, action, method) VALUES (?, ?, ?, ?, ?)",
+            [(entry['id'], entry.get('timestamp'), entry.get('pcName'), entry.get('action'), entry.get('method'))
+             for entry in entries])
+    
+    def import_json(self, conn: sqlite3.Connection):
+        """One-shot import of the JSON files into the database"""
+        imported = []
+        for filepath in (PREFERENCES_FILE, CONFIG_FILE, SCHEDULES_FILE, UPTIME_FILE, FOLLOWUPS_FILE):
+            if filepath.exists():
+                self._write(conn, filepath, _read_json_file(filepath, {}))
+                imported.append(filepath.name)
         
-        # Make filesystem read-only again
-        subprocess.run(['/usr/bin/ro'], check=False)
+        entries, _ = self.json_storage.load_actions(0)
+        self._insert_actions(conn, [entry for entry in entries if 'id' in entry])
         
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('json_imported', ?)", (datetime.now().isoformat(),))
+        print(f"[Storage] Imported {', '.join(imported) or 'no documents'} and {len(entries)} action(s) "
+              f"into {self.db_file.name}", flush=True)
+
+
+json_storage = JsonStorage(ACTION_LOG_SEGMENT_FILE, ACTION_LOG_FILE)
+if STORAGE_BACKEND == 'sqlite':
+    storage = SqliteStorage(DATABASE_FILE, json_storage)
+else:
+    storage = json_storage
+
+
+# ============ STATE STORE ============
+
+class VersionConflict(Exception):
+    """A write expected a version of the document that is no longer current"""
+    
+    def __init__(self, filepath: Path, expected: int, current: int):
+        super().__init__(f"{filepath.name} is at version {current}, not {expected}")
+        self.filepath = filepath
+        self.expected = expected
+        self.current = current
+
+
+class StateStore:
+    """Process-wide in-memory copy of the dashboard JSON documents.
+    
+    Each file is read from disk once, on first access. Reads are served from
+    memory and writes only mark the document dirty; a background thread
+    flushes all dirty documents in one batch every STATE_FLUSH_INTERVAL
+    seconds, and once more at shutdown. Other write-behind stores (such as
+    the action log) can join the same flush cycle with add_flush_callback().
+    
+    Read-modify-write cycles go through edit(), which holds a lock per
+    document, so edits of one document are serialized while unrelated
+    documents are edited in parallel.
+    
+    Every change also bumps a global revision, recorded per resource (the
+    document's file stem, or a name passed to touch()), so clients can ask
+    what changed since the revision they last saw.
+    """
+    
+    def __init__(self, flush_interval: float = STATE_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._documents: Dict[Path, dict] = {}
+        self._versions: Dict[Path, int] = {}
+        self._document_locks: Dict[Path, threading.RLock] = {}
+        self._revision = 0
+        self._resource_revisions: Dict[str, int] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = threading.Event()
+        self._thread = None
+        self._flush_callbacks: List[Callable[[], None]] = []
+    
+    def add_flush_callback(self, callback: Callable[[], None]):
+        """Run callback on every flush, after the dirty documents are written"""
+        self._flush_callbacks.append(callback)
+    
+    def schedule_flush(self):
+        """Request a flush at the end of the current batching interval"""
+        self._ensure_started()
+        self._pending.set()
+    
+    def load(self, filepath: Path, default: dict) -> dict:
+        """Return a private copy of a document, reading it from disk only once"""
+        with self._lock:
+            if filepath not in self._documents:
+                self._documents[filepath] = storage.read_document(filepath, default)
+            return copy.deepcopy(self._documents[filepath])
+    
+    def save(self, filepath: Path, data: dict, expected_version: Optional[int] = None) -> bool:
+        """Replace a document in memory and schedule it for flushing
+        
+        With expected_version, raises VersionConflict unless the document
+        is still at that version.
+        """
+        snapshot = copy.deepcopy(data)
+        with self.lock(filepath):
+            with self._lock:
+                current = self._versions.get(filepath, 0)
+                if expected_version is not None and expected_version != current:
+                    raise VersionConflict(filepath, expected_version, current)
+                self._documents[filepath] = snapshot
+                self._versions[filepath] = current + 1
+                self._dirty.add(filepath)
+                self._revision += 1
+                self._resource_revisions[filepath.stem] = self._revision
+        self.schedule_flush()
         return True
-    except Exception as e:
-        print(f"Error saving JSON file: {e}")
-        # Try to restore read-only even if save failed
-        subprocess.run(['/usr/bin/ro'], check=False)
-        return False
+    
+    def lock(self, filepath: Path) -> threading.RLock:
+        """The lock serializing read-modify-write cycles of one document"""
+        with self._lock:
+            lock = self._document_locks.get(filepath)
+            if lock is None:
+                lock = self._document_locks[filepath] = threading.RLock()
+            return lock
+    
+    @contextmanager
+    def edit(self, filepath: Path, default: dict, expected_version: Optional[int] = None):
+        """Read-modify-write a document under its lock
+        
+        Yields a private copy to mutate; it is saved when the block exits
+        normally and has changed. If the block raises, nothing is saved.
+        With expected_version, raises VersionConflict (before running the
+        block) unless the document is still at that version.
+        """
+        with self.lock(filepath):
+            current = self.version(filepath)
+            if expected_version is not None and expected_version != current:
+                raise VersionConflict(filepath, expected_version, current)
+            data = self.load(filepath, default)
+            yield data
+            with self._lock:
+                unchanged = data == self._documents[filepath]
+            if not unchanged:
+                self.save(filepath, data)
+    
+    def version(self, filepath: Path) -> int:
+        """Counter bumped by every save of a document (for ETags)"""
+        with self._lock:
+            return self._versions.get(filepath, 0)
+    
+    def touch(self, resource: str) -> int:
+        """Record a change to a resource kept outside the store, returns the new revision"""
+        with self._lock:
+            self._revision += 1
+            self._resource_revisions[resource] = self._revision
+            return self._revision
+    
+    @property
+    def revision(self) -> int:
+        """Global revision, bumped by every save and touch()"""
+        with self._lock:
+            return self._revision
+    
+    def changed_since(self, revision: int) -> set:
+        """Resources changed after the given revision"""
+        with self._lock:
+            return {resource for resource, changed in self._resource_revisions.items() if changed > revision}
+    
+    def flush(self) -> int:
+        """Write all dirty documents to disk now, returns how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                # Stored snapshots are replaced, never mutated, so they can be
+                # serialized outside the lock
+                batch = {path: self._documents[path] for path in self._dirty}
+                self._dirty.clear()
+            
+            failed = []
+            if batch:
+                start = time.perf_counter()
+                failed = storage.write_documents(batch)
+                state_flush_duration.observe(time.perf_counter() - start)
+                state_flush_documents.observe(len(batch))
+            if failed:
+                # Keep failed documents dirty so the next flush retries them
+                with self._lock:
+                    self._dirty.update(failed)
+                self._pending.set()
+            
+            for callback in self._flush_callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Error in state store flush callback: {e}", flush=True)
+            
+            return len(batch) - len(failed)
+    
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+                self._thread.start()
+    
+    def _flush_loop(self):
+        while True:
+            self._pending.wait()
+            # Give further writes a chance to join this batch
+            time.sleep(self.flush_interval)
+            self._pending.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing state store: {e}", flush=True)
+
+
+state_store = StateStore()
+atexit.register(state_store.flush)
+
+
+# ============ HELPER FUNCTIONS ============
+
+def load_json_file(filepath: Path, default: dict) -> dict:
+    """Load JSON document (from the in-memory state store) with fallback to default"""
+    return state_store.load(filepath, default)
+
+
+def save_json_file(filepath: Path, data: dict) -> bool:
+    """Save JSON document (written to disk by the state store's next flush)"""
+    return state_store.save(filepath, data)
 
 
 def get_pikvm_status() -> Optional[dict]:
     """Get current status from PiKVM API"""
-    try:
-        response = requests.get(f"{PIKVM_API_BASE}/api/switch", timeout=5)
-        if response.status_code == 200:
-            return response.json()
+    return pikvm_client.get_switch_status()
+
+
+# ============ CONDITIONAL RESPONSES ============
+
+# Version counters restart with the process, so ETags carry a per-process prefix
+SERVER_EPOCH = uuid.uuid4().hex[:8]
+
+
+def versioned_json(tag: str, build: Callable[[], object]) -> Response:
+    """JSON response with an ETag derived from a version counter
+    
+    `tag` must change whenever the resource does. If the client already has
+    it (If-None-Match) the answer is an empty 304 and `build` is not called.
+    """
+    etag = f"{SERVER_EPOCH}-{tag}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    # Weak because the body may be gzipped on the way out
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def if_match_version(name: str) -> Optional[int]:
+    """Document version a write's If-Match header expects, None without one
+    
+    `name` is the document's tag as used with versioned_json ("prefs",
+    "config", ...). Tags from another process or document expect a version
+    that never exists, so the write fails with 412 instead of clobbering.
+    """
+    if not request.if_match or request.if_match.star_tag:
         return None
-    except requests.RequestException:
+    prefix = f"{SERVER_EPOCH}-{name}-"
+    for etag in request.if_match.as_set(include_weak=True):
+        if etag.startswith(prefix) and etag[len(prefix):].isdigit():
+            return int(etag[len(prefix):])
+    return -1
+
+
+def precondition_failed(name: str, filepath: Path) -> tuple:
+    """412 answer to a write whose If-Match is out of date, with the current ETag"""
+    response = jsonify({"error": "Changed by another client, reload and try again"})
+    response.set_etag(f"{SERVER_EPOCH}-{name}-{state_store.version(filepath)}", weak=True)
+    return response, 412
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """Gzip large JSON responses"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    
+    body = response.get_data()
+    if len(body) < GZIP_MIN_SIZE:
+        return response
+    
+    response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# ============ PIKVM API CLIENT ============
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling kvmd while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Fail fast while kvmd is down.
+    
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are rejected immediately. Once `reset_timeout` seconds have passed
+    a single trial call is allowed through; its outcome closes the circuit
+    or opens it again.
+    """
+    
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+    
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+    
+    def allow(self) -> bool:
+        """Whether a call may be attempted now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_in_flight or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_in_flight = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"[PiKVM] {self._failures} consecutive failures, failing fast for {self.reset_timeout}s", flush=True)
+                self._opened_at = time.monotonic()
+
+
+class PiKVMClient:
+    """Shared client for the kvmd HTTP API.
+    
+    Uses one keep-alive connection pool for all callers, per-endpoint
+    timeouts, jittered retries for idempotent reads and a circuit breaker
+    so callers fail fast while kvmd is unreachable.
+    """
+    
+    def __init__(self, base_url: str = PIKVM_API_BASE, pool_size: int = PIKVM_POOL_SIZE):
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breaker = CircuitBreaker()
+    
+    def _request(self, method: str, path: str, endpoint: str,
+                 params: Optional[dict] = None, retries: int = 0) -> requests.Response:
+        """Send a request to kvmd, raising requests.RequestException on failure (including 4xx)"""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                kvmd_errors.inc(path)
+                raise CircuitOpenError(f"kvmd unavailable, not calling {path}")
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", params=params,
+                                                timeout=PIKVM_TIMEOUTS[endpoint])
+                kvmd_request_duration.observe(time.perf_counter() - start, path)
+                if response.status_code >= 500:
+                    raise requests.HTTPError(f"kvmd returned HTTP {response.status_code} for {path}",
+                                             response=response)
+                self.breaker.record_success()
+                break
+            except requests.RequestException as e:
+                if e.response is None:
+                    # Timeouts and connection errors, responses were observed above
+                    kvmd_request_duration.observe(time.perf_counter() - start, path)
+                kvmd_errors.inc(path)
+                self.breaker.record_failure()
+                if attempt >= retries:
+                    raise
+                time.sleep(PIKVM_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+                attempt += 1
+        
+        if response.status_code >= 400:
+            # kvmd is up but refused the request (bad port, expired credentials):
+            # not a breaker failure and not worth retrying
+            kvmd_errors.inc(path)
+            raise requests.HTTPError(f"kvmd returned HTTP {response.status_code} for {path}",
+                                     response=response)
+        return response
+    
+    # ---- Reads (idempotent, retried) ----
+    
+    def get_switch_status(self) -> Optional[dict]:
+        """GET /api/switch, returns the parsed response or None on failure"""
+        try:
+            response = self._request('GET', '/api/switch', 'status', retries=PIKVM_READ_RETRIES)
+            if response.status_code == 200:
+                return response.json()
+            return None
+        except (requests.RequestException, ValueError):
+            return None
+    
+    # ---- Commands (never retried) ----
+    
+    def atx_power(self, action: str, port: Optional[int] = None) -> requests.Response:
+        """Set ATX power state ('on', 'off', 'off_hard', 'reset_hard')"""
+        if port is None:
+            return self._request('POST', '/api/atx/power', 'atx', {'action': action})
+        return self._request('POST', '/api/switch/atx/power', 'atx', {'port': port, 'action': action})
+    
+    def atx_click(self, button: str, port: Optional[int] = None) -> requests.Response:
+        """Click an ATX button ('power', 'power_long', 'reset')"""
+        if port is None:
+            return self._request('POST', '/api/atx/click', 'atx', {'button': button})
+        return self._request('POST', '/api/switch/atx/click', 'atx', {'port': port, 'button': button})
+    
+    def set_active_port(self, port: int) -> requests.Response:
+        """Select the switch port that receives video and HID input"""
+        return self._request('POST', '/api/switch/set_active', 'switch', {'port': port})
+    
+    def send_shortcut(self, keys: str) -> requests.Response:
+        """Press and release a comma-separated key combination"""
+        return self._request('POST', '/api/hid/events/send_shortcut', 'hid', {'keys': keys})
+    
+    def power_action(self, action: str, port: int, has_switch: bool) -> Optional[requests.Response]:
+        """Execute a dashboard power action ('on', 'off' or 'reset')"""
+        target = port if has_switch else None
+        if action == 'on':
+            return self.atx_power('on', target)
+        elif action == 'off':
+            return self.atx_click('power', target)
+        elif action == 'reset':
+            return self.atx_click('reset', target)
         return None
 
 
+pikvm_client = PiKVMClient()
+
+
+# ============ ACTION DISPATCHER ============
+
+class ActionDispatcher:
+    """Sends PiKVM actions for many ports concurrently.
+    
+    Runs an asyncio event loop in its own thread. Each action is a dict
+    with `port`, `pcName`, `action` ('on', 'off', 'reset' or 'keyboard')
+    and optionally `keyboardShortcut`. Actions run concurrently up to
+    ACTION_MAX_CONCURRENCY and are started no faster than
+    ACTION_RATE_LIMIT per second. Keyboard actions go through the HID
+    command queue, which groups them by switch port. The blocking PiKVM
+    client calls run in a dedicated thread pool.
+    """
+    
+    def __init__(self, max_concurrency: int = ACTION_MAX_CONCURRENCY,
+                 rate_limit: float = ACTION_RATE_LIMIT):
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self._start_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='action')
+        self._semaphore = None
+        self._next_slot = 0.0
+    
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._init_primitives(), loop).result()
+                self._loop = loop
+            return self._loop
+    
+    async def _init_primitives(self):
+        # Created on the loop they are used from
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+    
+    def dispatch(self, actions: List[dict], has_switch: bool) -> List[dict]:
+        """Run actions concurrently, returns one result per action in the same order"""
+        if not actions:
+            return []
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._run_all(actions, has_switch), loop).result()
+    
+    async def _run_all(self, actions: List[dict], has_switch: bool) -> List[dict]:
+        return await asyncio.gather(*(self._run_one(action, has_switch) for action in actions))
+    
+    async def _wait_for_rate_limit(self):
+        """Token bucket: space command starts 1/rate_limit seconds apart"""
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1 / self.rate_limit
+        if slot > now:
+            await asyncio.sleep(slot - now)
+    
+    async def _call(self, func: Callable, *args):
+        await self._wait_for_rate_limit()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    async def _run_one(self, item: dict, has_switch: bool) -> dict:
+        port = item.get('port', 0)
+        action = item.get('action')
+        result = {"port": port, "pcName": item.get('pcName'), "action": action, "success": True}
+        
+        try:
+            if action == 'keyboard':
+                key_sequence = KEYBOARD_SHORTCUTS.get(item.get('keyboardShortcut'),
+                                                      KEYBOARD_SHORTCUTS['ctrl-alt-del'])
+                # HID input goes to the active port; the queue selects it
+                future = hid_queue.submit(key_sequence, port if has_switch else None)
+                try:
+                    # Timing out cancels the command if the queue has not started it
+                    await asyncio.wait_for(asyncio.wrap_future(future), HID_COMMAND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"Keyboard command not sent within {HID_COMMAND_TIMEOUT}s")
+            elif action in ('on', 'off', 'reset'):
+                async with self._semaphore:
+                    await self._call(pikvm_client.power_action, action, port, has_switch)
+            else:
+                raise ValueError(f"Unknown action: {action}")
+        except Exception as e:
+            result["success"] = False
+            result["error"] = str(e)
+        
+        return result
+
+
+action_dispatcher = ActionDispatcher()
+
+
+# ============ EVENT BUS ============
+
+class EventBus:
+    """In-process publish/subscribe for dashboard events.
+    
+    Handlers run synchronously in the publishing thread, in the order they
+    subscribed, so publishing costs a function call per handler. A failing
+    handler is logged and does not stop the others.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = {}
+    
+    def subscribe(self, topic: str, handler: Callable[[dict], None]):
+        """Call handler(event) for every event published on topic"""
+        with self._lock:
+            self._handlers.setdefault(topic, []).append(handler)
+    
+    def publish(self, topic: str, event: dict) -> dict:
+        """Hand event to every handler of topic, returns the event"""
+        with self._lock:
+            handlers = list(self._handlers.get(topic, []))
+        for handler in handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"Error in {topic} event handler: {e}", flush=True)
+        return event
+
+
+event_bus = EventBus()
+
+
+def record_action(pc_name: str, action: str, method: str = 'unknown') -> dict:
+    """Publish an action event, returns it with the id assigned by the action log"""
+    return event_bus.publish('action', {
+        "pcName": pc_name,
+        "action": action,
+        "method": method,
+        "timestamp": datetime.now().isoformat()
+    })
+
+
+# ============ ACTION LOG STORE ============
+
+class ActionLog:
+    """Append-only action log.
+    
+    Entries live in an in-memory ring (a deque sized by actionLogLimit).
+    New entries are handed to the storage backend on the state store's
+    flush cycle. Every entry gets an increasing integer `id` that clients
+    use as a cursor, and is noted with the state store revision it was
+    added at for changes_since().
+    """
+    
+    def __init__(self, storage):
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._entries: Optional[deque] = None
+        self._next_id = 1
+        self._version = 0
+        self._pending: List[dict] = []
+        self._needs_rewrite = False
+        # (revision, id) per entry added by this process, and the revision of
+        # the last change that removed entries
+        self._entry_revisions: Optional[deque] = None
+        self._reset_revision = 0
+    
+    def _ensure_loaded(self):
+        """Load the ring from storage on first use (caller holds the lock)"""
+        if self._entries is not None:
+            return
+        
+        prefs = load_json_file(PREFERENCES_FILE, DEFAULT_PREFERENCES)
+        limit = prefs.get("actionLogLimit", DEFAULT_ACTION_LOG_LIMIT)
+        entries, self._needs_rewrite = self.storage.load_actions(limit)
+        self._entries = deque(entries, maxlen=limit)
+        self._entry_revisions = deque(maxlen=limit)
+        if entries:
+            self._next_id = max(entry.get('id', 0) for entry in entries) + 1
+        if self._needs_rewrite:
+            state_store.schedule_flush()
+    
+    def record(self, entry: dict) -> dict:
+        """Store an action event, assigning its id in place"""
+        with self._lock:
+            self._ensure_loaded()
+            entry['id'] = self._next_id
+            self._next_id += 1
+            self._version += 1
+            self._entries.append(entry)
+            self._entry_revisions.append((state_store.touch('actions'), entry['id']))
+            self._pending.append(entry)
+        state_store.schedule_flush()
+        return entry
+    
+    def query(self, limit: Optional[int] = None, before: Optional[int] = None,
+              after: Optional[int] = None, pc_name: Optional[str] = None,
+              method: Optional[str] = None) -> List[dict]:
+        """Return matching entries, newest first"""
+        with self._lock:
+            self._ensure_loaded()
+            entries = list(self._entries)
+        
+        result = []
+        for entry in reversed(entries):
+            entry_id = entry.get('id', 0)
+            if after is not None and entry_id <= after:
+                # Entries are ordered by id, nothing older can match
+                break
+            if before is not None and entry_id >= before:
+                continue
+            if pc_name is not None and entry.get('pcName') != pc_name:
+                continue
+            if method is not None and entry.get('method') != method:
+                continue
+            result.append(entry)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+    
+    def latest_id(self) -> int:
+        """Id of the newest entry (0 when the log is empty)"""
+        with self._lock:
+            self._ensure_loaded()
+            return self._entries[-1]['id'] if self._entries else 0
+    
+    def changes_since(self, revision: int) -> Optional[dict]:
+        """Entries added after a state store revision (newest first), None if there are none
+        
+        If entries were removed since (clear or a smaller limit), the whole
+        log is returned with "replace": true.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if self._reset_revision > revision:
+                actions = list(reversed(self._entries))
+            else:
+                new_ids = [entry_id for changed, entry_id in self._entry_revisions if changed > revision]
+                if not new_ids:
+                    return None
+                actions = [entry for entry in reversed(self._entries) if entry['id'] >= new_ids[0]]
+            return {
+                "actions": actions,
+                "latestId": self._entries[-1]['id'] if self._entries else 0,
+                "limit": self._entries.maxlen,
+                "replace": self._reset_revision > revision
+            }
+    
+    @property
+    def version(self) -> int:
+        """Counter bumped by every change to the log (for ETags)"""
+        return self._version
+    
+    @property
+    def limit(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return self._entries.maxlen
+    
+    def set_limit(self, limit: int):
+        """Resize the ring, dropping the oldest entries if it shrinks"""
+        try:
+            limit = max(1, int(limit))
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self._ensure_loaded()
+            if limit != self._entries.maxlen:
+                self._entries = deque(self._entries, maxlen=limit)
+                self._entry_revisions = deque(self._entry_revisions, maxlen=limit)
+                self._needs_rewrite = True
+                self._version += 1
+                self._reset_revision = state_store.touch('actions')
+        state_store.schedule_flush()
+    
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._ensure_loaded()
+            self._entries.clear()
+            self._entry_revisions.clear()
+            self._pending = []
+            self._needs_rewrite = True
+            self._version += 1
+            self._reset_revision = state_store.touch('actions')
+        state_store.schedule_flush()
+    
+    def flush(self):
+        """Hand pending entries to the storage backend"""
+        with self._lock:
+            if self._entries is None:
+                return
+            pending = self._pending
+            ring = list(self._entries)
+            limit = self._entries.maxlen
+            rewrite = self._needs_rewrite
+            self._pending = []
+            self._needs_rewrite = False
+        
+        try:
+            self.storage.save_actions(pending, ring, limit, rewrite)
+        except Exception as e:
+            print(f"Error writing action log: {e}")
+            with self._lock:
+                # Rewrite the whole ring next time rather than guessing what made it
+                self._needs_rewrite = True
+            state_store.schedule_flush()
+
+
+action_log = ActionLog(storage)
+state_store.add_flush_callback(action_log.flush)
+# Subscribed first so later handlers see the entry id
+event_bus.subscribe('action', action_log.record)
+
+
 # ============ ACTION LOG API ============
 
 @app.route('/api/dashboard/actions', methods=['GET'])
 def get_actions():
-    """Get action log history"""
-    actions = load_json_file(ACTION_LOG_FILE, {"actions": []})
-    return jsonify(actions)
+    """Get action log history (newest first)
+    
+    Optional query parameters: limit, before/after (entry id cursors),
+    pcName and method filters.
+    """
+    def build():
+        actions = action_log.query(
+            limit=request.args.get('limit', type=int),
+            before=request.args.get('before', type=int),
+            after=request.args.get('after', type=int),
+            pc_name=request.args.get('pcName'),
+            method=request.args.get('method')
+        )
+        return {
+            "actions": actions,
+            "latestId": action_log.latest_id(),
+            "limit": action_log.limit
+        }
+    
+    # Each query string is its own representation of the log
+    return versioned_json(f"actions-{action_log.version}-{zlib.crc32(request.query_string):x}", build)
 
 
 @app.route('/api/dashboard/actions', methods=['POST'])
@@ -152,31 +1577,7 @@ def add_action():
     if not data or 'pcName' not in data or 'action' not in data:
         return jsonify({"error": "Missing required fields"}), 400
     
-    # Load existing actions
-    action_data = load_json_file(ACTION_LOG_FILE, {"actions": []})
-    actions = action_data.get("actions", [])
-    
-    # Get action log limit from preferences
-    prefs = load_json_file(PREFERENCES_FILE, DEFAULT_PREFERENCES)
-    limit = prefs.get("actionLogLimit", DEFAULT_ACTION_LOG_LIMIT)
-    
-    # Add new action
-    new_action = {
-        "pcName": data['pcName'],
-        "action": data['action'],
-        "method": data.get('method', 'unknown'),
-        "timestamp": datetime.now().isoformat()
-    }
-    
-    actions.insert(0, new_action)  # Add to beginning
-    
-    # Trim to limit
-    if len(actions) > limit:
-        actions = actions[:limit]
-    
-    # Save
-    action_data["actions"] = actions
-    save_json_file(ACTION_LOG_FILE, action_data)
+    new_action = record_action(data['pcName'], data['action'], data.get('method', 'unknown'))
     
     return jsonify({"success": True, "action": new_action})
 
@@ -184,7 +1585,7 @@ def add_action():
 @app.route('/api/dashboard/actions', methods=['DELETE'])
 def clear_actions():
     """Clear all actions"""
-    save_json_file(ACTION_LOG_FILE, {"actions": []})
+    action_log.clear()
     return jsonify({"success": True})
 
 
@@ -193,8 +1594,8 @@ def clear_actions():
 @app.route('/api/dashboard/preferences', methods=['GET'])
 def get_preferences():
     """Get user preferences"""
-    prefs = load_json_file(PREFERENCES_FILE, DEFAULT_PREFERENCES)
-    return jsonify(prefs)
+    return versioned_json(f"prefs-{state_store.version(PREFERENCES_FILE)}",
+                          lambda: load_json_file(PREFERENCES_FILE, DEFAULT_PREFERENCES))
 
 
 @app.route('/api/dashboard/preferences', methods=['POST'])
@@ -205,17 +1606,183 @@ def update_preferences():
     if not data:
         return jsonify({"error": "No data provided"}), 400
     
-    # Load existing preferences
-    prefs = load_json_file(PREFERENCES_FILE, DEFAULT_PREFERENCES)
-    
-    # Update with new values
-    prefs.update(data)
-    
-    # Save
-    if save_json_file(PREFERENCES_FILE, prefs):
-        return jsonify({"success": True, "preferences": prefs})
-    else:
-        return jsonify({"error": "Failed to save preferences"}), 500
+    try:
+        with state_store.edit(PREFERENCES_FILE, DEFAULT_PREFERENCES, if_match_version('prefs')) as prefs:
+            # Update with new values
+            prefs.update(data)
+    except VersionConflict:
+        return precondition_failed('prefs', PREFERENCES_FILE)
+    
+    # Resize the action log ring if its limit changed
+    if 'actionLogLimit' in data:
+        action_log.set_limit(prefs.get("actionLogLimit", DEFAULT_ACTION_LOG_LIMIT))
+    
+    return jsonify({"success": True, "preferences": prefs})
+
+
+# ============ RECURRENCE RULES ============
+
+def _add_months(year: int, month: int, months: int) -> tuple:
+    """(year, month) shifted by a number of months"""
+    index = year * 12 + month - 1 + months
+    return index // 12, index % 12 + 1
+
+
+class RecurrenceRule:
+    """A schedule compiled once into something that can enumerate its runs.
+    
+    The time of day comes from the schedule's `time`. So does the anchor
+    used by the coarser frequencies: the day of month (monthly, quarterly,
+    annually), the month (quarterly phase, annually) and the ISO week
+    (biweekly parity). Months without the anchor day are skipped, the same
+    as the calendar shows them. `daysOfWeek` uses 0 = Monday. There are
+    no occurrences before the anchor, and one-time schedules have a single
+    occurrence.
+    """
+    
+    def __init__(self, schedule: dict):
+        anchor = datetime.fromtimestamp(schedule['time'] / 1000)
+        self.anchor = anchor
+        self.recurring = bool(schedule.get('isRecurring'))
+        self.frequency = schedule.get('frequency', 'daily')
+        self.hour = anchor.hour
+        self.minute = anchor.minute
+        # Earliest possible occurrence: the anchor at minute resolution, like every occurrence
+        self.first = anchor.replace(second=0, microsecond=0)
+        
+        days_of_week = schedule.get('daysOfWeek', [schedule.get('dayOfWeek', anchor.weekday())])
+        if not isinstance(days_of_week, list):
+            days_of_week = [days_of_week]
+        self.days_of_week = (frozenset(day for day in days_of_week if day in range(7))
+                             or frozenset([anchor.weekday()]))
+        # Monday of the anchor week, biweekly runs every other week from it
+        self._anchor_monday = anchor.date() - timedelta(days=anchor.weekday())
+    
+    def _at(self, day) -> datetime:
+        return datetime(day.year, day.month, day.day, self.hour, self.minute)
+    
+    def _candidates(self, start_day):
+        """Occurrence datetimes on or after start_day, in order"""
+        start_day = max(start_day, self.first.date())
+        if self.frequency in ('weekly', 'biweekly'):
+            day = start_day
+            while True:
+                if day.weekday() in self.days_of_week:
+                    weeks = (day - self._anchor_monday).days // 7
+                    if self.frequency == 'weekly' or weeks % 2 == 0:
+                        yield self._at(day)
+                day += timedelta(days=1)
+        
+        elif self.frequency in ('monthly', 'quarterly', 'annually'):
+            step = {'monthly': 1, 'quarterly': 3, 'annually': 12}[self.frequency]
+            # First month on or after start_day that is in phase with the anchor
+            months_since = (start_day.year - self.anchor.year) * 12 + start_day.month - self.anchor.month
+            year, month = _add_months(start_day.year, start_day.month, -months_since % step)
+            while True:
+                try:
+                    occurrence = datetime(year, month, self.anchor.day, self.hour, self.minute)
+                except ValueError:
+                    occurrence = None  # e.g. the 31st in a 30-day month
+                if occurrence is not None and occurrence.date() >= start_day:
+                    yield occurrence
+                year, month = _add_months(year, month, step)
+        
+        else:
+            # daily (and unknown frequencies, as before)
+            day = start_day
+            while True:
+                yield self._at(day)
+                day += timedelta(days=1)
+    
+    def occurrences(self, start: datetime, end: datetime) -> List[datetime]:
+        """Every occurrence with start <= occurrence < end"""
+        if not self.recurring:
+            return [self.anchor] if start <= self.anchor < end else []
+        
+        start = max(start, self.first)
+        result = []
+        for occurrence in self._candidates(start.date()):
+            if occurrence >= end:
+                break
+            if occurrence >= start:
+                result.append(occurrence)
+        return result
+    
+    def next_after(self, after: datetime) -> datetime:
+        """First occurrence strictly after the given time"""
+        if not self.recurring:
+            return self.anchor
+        for occurrence in self._candidates(max(after, self.first).date()):
+            if occurrence > after and occurrence >= self.first:
+                return occurrence
+
+
+def _rule_signature(schedule: dict) -> tuple:
+    """The schedule fields a compiled rule depends on"""
+    days_of_week = schedule.get('daysOfWeek', schedule.get('dayOfWeek'))
+    if isinstance(days_of_week, list):
+        days_of_week = tuple(days_of_week)
+    return (schedule.get('time'), bool(schedule.get('isRecurring')),
+            schedule.get('frequency'), days_of_week)
+
+
+class RecurrenceIndex:
+    """Compiled rules per schedule plus a cache of expanded occurrence ranges.
+    
+    Rules are recompiled only when a schedule's timing fields change, and
+    cached ranges are dropped whenever the set of rules changes.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules: Dict[int, tuple] = {}  # id -> (signature, rule)
+        self._ranges: Dict[tuple, List[dict]] = {}
+    
+    def rule(self, schedule: dict) -> RecurrenceRule:
+        """Compiled rule for a schedule"""
+        with self._lock:
+            return self._compile(schedule)
+    
+    def _compile(self, schedule: dict) -> RecurrenceRule:
+        """(caller holds the lock)"""
+        signature = _rule_signature(schedule)
+        cached = self._rules.get(schedule.get('id'))
+        if cached and cached[0] == signature:
+            return cached[1]
+        rule = RecurrenceRule(schedule)
+        if 'id' in schedule:
+            self._rules[schedule['id']] = (signature, rule)
+            self._ranges.clear()
+        return rule
+    
+    def occurrences(self, schedules: List[dict], start: datetime, end: datetime) -> List[dict]:
+        """All occurrences of all schedules in [start, end), ordered by time"""
+        with self._lock:
+            ids = set()
+            for schedule in schedules:
+                self._compile(schedule)
+                ids.add(schedule.get('id'))
+            if ids != set(self._rules):
+                # Forget deleted schedules
+                for schedule_id in set(self._rules) - ids:
+                    del self._rules[schedule_id]
+                self._ranges.clear()
+            
+            key = (start, end)
+            if key not in self._ranges:
+                result = []
+                for schedule_id, (_, rule) in self._rules.items():
+                    for occurrence in rule.occurrences(start, end):
+                        result.append({"scheduleId": schedule_id,
+                                       "time": int(occurrence.timestamp() * 1000)})
+                result.sort(key=lambda entry: entry['time'])
+                if len(self._ranges) >= OCCURRENCE_CACHE_SIZE:
+                    self._ranges.pop(next(iter(self._ranges)))
+                self._ranges[key] = result
+            return self._ranges[key]
+
+
+recurrence_index = RecurrenceIndex()
 
 
 # ============ SCHEDULED ACTIONS API ============
@@ -223,26 +1790,90 @@ def update_preferences():
 @app.route('/api/dashboard/schedules', methods=['GET'])
 def get_schedules():
     """Get scheduled actions"""
-    schedules = load_json_file(SCHEDULES_FILE, {"schedules": []})
-    return jsonify(schedules)
+    return versioned_json(f"schedules-{state_store.version(SCHEDULES_FILE)}",
+                          lambda: load_json_file(SCHEDULES_FILE, {"schedules": []}))
 
 
-@app.route('/api/dashboard/schedules', methods=['POST'])
-def add_schedule():
-    """Add new scheduled action (one-time or recurring) with optional secondary actions"""
-    data = request.get_json()
+SCHEDULE_OPERATIONS = {'create', 'update', 'delete', 'addFollowUp', 'deleteFollowUp', 'reorderFollowUps'}
+
+# Fields a batch "update" operation may change
+SCHEDULE_UPDATE_FIELDS = {
+    'port', 'action', 'time', 'pcName', 'isRecurring', 'frequency', 'daysOfWeek',
+    'keyboardShortcut', 'hasSecondaryAction', 'secondaryDelay', 'secondaryDelayUnit',
+    'secondaryAction', 'secondaryKeyboardShortcut'
+}
+
+
+class ScheduleOperationError(Exception):
+    """A schedule edit that cannot be applied (nothing is saved)"""
     
-    required_fields = ['port', 'action', 'time', 'pcName']
-    if not data or not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields"}), 400
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+SCHEDULE_ACTIONS = ('on', 'off', 'reset', 'keyboard')
+SCHEDULE_FREQUENCIES = ('daily', 'weekly', 'biweekly', 'monthly', 'quarterly', 'annually')
+FOLLOWUP_DELAY_UNITS = ('seconds', 'minutes', 'hours', 'days')
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_delay(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value < float('inf')
+
+
+def validate_followup_fields(fields: dict, prefix: str = ''):
+    """Reject follow-up values the dispatcher cannot run, raises ScheduleOperationError
+    
+    With prefix 'secondary', checks a schedule's legacy secondaryDelay,
+    secondaryDelayUnit, secondaryAction and secondaryKeyboardShortcut.
+    """
+    def field(name: str) -> str:
+        return prefix + name[0].upper() + name[1:] if prefix else name
     
-    # Load existing schedules
-    schedule_data = load_json_file(SCHEDULES_FILE, {"schedules": []})
-    schedules = schedule_data.get("schedules", [])
+    if field('delay') in fields and not _is_delay(fields[field('delay')]):
+        raise ScheduleOperationError(f"{field('delay')} must be a non-negative number")
+    if field('delayUnit') in fields and fields[field('delayUnit')] not in FOLLOWUP_DELAY_UNITS:
+        raise ScheduleOperationError(f"{field('delayUnit')} must be one of {', '.join(FOLLOWUP_DELAY_UNITS)}")
+    if field('action') in fields and fields[field('action')] not in SCHEDULE_ACTIONS:
+        raise ScheduleOperationError(f"{field('action')} must be one of {', '.join(SCHEDULE_ACTIONS)}")
+    if field('keyboardShortcut') in fields and fields[field('keyboardShortcut')] not in KEYBOARD_SHORTCUTS:
+        raise ScheduleOperationError(f"{field('keyboardShortcut')} must be one of {', '.join(KEYBOARD_SHORTCUTS)}")
+
+
+def validate_schedule_fields(fields: dict):
+    """Reject values the scheduler cannot run, raises ScheduleOperationError"""
+    if 'time' in fields and not (_is_int(fields['time']) and fields['time'] >= 0):
+        raise ScheduleOperationError("time must be a timestamp in milliseconds")
+    if 'port' in fields and not (_is_int(fields['port']) and 0 <= fields['port'] < MAX_PORTS):
+        raise ScheduleOperationError(f"port must be an integer from 0 to {MAX_PORTS - 1}")
+    if 'action' in fields and fields['action'] not in SCHEDULE_ACTIONS:
+        raise ScheduleOperationError(f"action must be one of {', '.join(SCHEDULE_ACTIONS)}")
+    if 'frequency' in fields and fields['frequency'] not in SCHEDULE_FREQUENCIES:
+        raise ScheduleOperationError(f"frequency must be one of {', '.join(SCHEDULE_FREQUENCIES)}")
+    if 'daysOfWeek' in fields:
+        days = fields['daysOfWeek']
+        if not isinstance(days, list) or not all(_is_int(day) and 0 <= day <= 6 for day in days):
+            raise ScheduleOperationError("daysOfWeek must be a list of integers from 0 to 6")
+    if 'isRecurring' in fields and not isinstance(fields['isRecurring'], bool):
+        raise ScheduleOperationError("isRecurring must be true or false")
+    if 'keyboardShortcut' in fields and fields['keyboardShortcut'] not in KEYBOARD_SHORTCUTS:
+        raise ScheduleOperationError(f"keyboardShortcut must be one of {', '.join(KEYBOARD_SHORTCUTS)}")
+    validate_followup_fields(fields, prefix='secondary')
+
+
+def build_schedule(data: dict, schedule_id: int) -> dict:
+    """Create a schedule from an API request body"""
+    required_fields = ['port', 'action', 'time', 'pcName']
+    if not isinstance(data, dict) or not all(field in data for field in required_fields):
+        raise ScheduleOperationError("Missing required fields")
+    validate_schedule_fields(data)
     
-    # Create new schedule
     new_schedule = {
-        "id": int(time.time() * 1000),  # Timestamp in ms as ID
+        "id": schedule_id,
         "port": data['port'],
         "action": data['action'],  # "on", "off", "reset", "keyboard"
         "time": data['time'],
@@ -275,64 +1906,202 @@ def add_schedule():
         if new_schedule['secondaryAction'] == 'keyboard':
             new_schedule['secondaryKeyboardShortcut'] = data.get('secondaryKeyboardShortcut', 'ctrl-alt-del')
     
-    schedules.append(new_schedule)
+    return new_schedule
+
+
+def build_followup(data: dict) -> dict:
+    """Create a follow-up action from an API request body"""
+    if not isinstance(data, dict) or 'delay' not in data or 'delayUnit' not in data or 'action' not in data:
+        raise ScheduleOperationError("Missing required fields")
+    validate_followup_fields(data)
+    
+    followup = {
+        "delay": data['delay'],
+        "delayUnit": data['delayUnit'],
+        "action": data['action']
+    }
     
-    # Save
-    schedule_data["schedules"] = schedules
-    save_json_file(SCHEDULES_FILE, schedule_data)
+    if data['action'] == 'keyboard':
+        followup['keyboardShortcut'] = data.get('keyboardShortcut', 'ctrl-alt-del')
+    
+    return followup
+
+
+def _find_schedule(schedules: List[dict], schedule_id) -> dict:
+    schedule = next((s for s in schedules if s.get('id') == schedule_id), None)
+    if not schedule:
+        raise ScheduleOperationError("Schedule not found", 404)
+    return schedule
+
+
+def _followup_index(schedule: dict, index) -> int:
+    followups = schedule.get('followUpActions', [])
+    if not isinstance(index, int) or not 0 <= index < len(followups):
+        raise ScheduleOperationError("Follow-up not found", 404)
+    return index
+
+
+def _apply_schedule_operation(schedules: List[dict], operation: dict):
+    """Apply one edit to the schedule list in place, returns its result"""
+    op = operation.get('op')
+    if op not in SCHEDULE_OPERATIONS:
+        raise ScheduleOperationError(f"Unknown operation: {op}")
+    
+    if op == 'create':
+        # Timestamp in ms as ID, bumped past existing IDs when creating several at once
+        schedule_id = max([int(time.time() * 1000)] + [s.get('id', 0) + 1 for s in schedules])
+        schedule = build_schedule(operation.get('schedule'), schedule_id)
+        schedules.append(schedule)
+        return schedule
+    
+    if op == 'delete':
+        # Deleting a schedule that is already gone is not an error
+        remaining = [s for s in schedules if s.get('id') != operation.get('id')]
+        deleted = len(remaining) != len(schedules)
+        schedules[:] = remaining
+        return {"deleted": deleted}
+    
+    schedule = _find_schedule(schedules, operation.get('id'))
+    
+    if op == 'update':
+        changes = operation.get('changes')
+        if not isinstance(changes, dict):
+            raise ScheduleOperationError("changes must be an object")
+        unknown = set(changes) - SCHEDULE_UPDATE_FIELDS
+        if unknown:
+            raise ScheduleOperationError(f"Cannot update {', '.join(sorted(unknown))}")
+        validate_schedule_fields(changes)
+        schedule.update(changes)
+        return schedule
+    
+    if op == 'addFollowUp':
+        followup = build_followup(operation.get('followUp'))
+        schedule.setdefault('followUpActions', []).append(followup)
+        return followup
+    
+    if op == 'deleteFollowUp':
+        index = _followup_index(schedule, operation.get('index'))
+        return schedule['followUpActions'].pop(index)
+    
+    # reorderFollowUps
+    from_index = _followup_index(schedule, operation.get('fromIndex'))
+    to_index = _followup_index(schedule, operation.get('toIndex'))
+    followups = schedule['followUpActions']
+    followups.insert(to_index, followups.pop(from_index))
+    return followups
+
+
+def apply_schedule_operations(operations: List[dict], expected_version: Optional[int] = None) -> List:
+    """Apply schedule edits atomically: all of them with a single save, or none.
+    
+    Raises ScheduleOperationError (with the failing operation's index in the
+    message when there are several) and leaves schedules.json untouched if
+    any operation is invalid. Raises VersionConflict if schedules.json is
+    no longer at expected_version.
+    """
+    with state_store.edit(SCHEDULES_FILE, {"schedules": []}, expected_version) as schedule_data:
+        schedules = schedule_data.setdefault("schedules", [])
+        results = []
+        for index, operation in enumerate(operations):
+            try:
+                results.append(_apply_schedule_operation(schedules, operation))
+            except ScheduleOperationError as e:
+                if len(operations) > 1:
+                    raise ScheduleOperationError(f"Operation {index}: {e}", e.status)
+                raise
+    schedule_engine.notify()
+    return results
+
+
+@app.route('/api/dashboard/schedules', methods=['POST'])
+def add_schedule():
+    """Add new scheduled action (one-time or recurring) with optional secondary actions"""
+    try:
+        new_schedule, = apply_schedule_operations([{"op": "create", "schedule": request.get_json()}],
+                                                  if_match_version('schedules'))
+    except ScheduleOperationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except VersionConflict:
+        return precondition_failed('schedules', SCHEDULES_FILE)
     
     return jsonify({"success": True, "schedule": new_schedule})
 
 
+@app.route('/api/dashboard/schedules/batch', methods=['POST'])
+def batch_schedules():
+    """Apply many schedule edits in one atomic operation
+    
+    Body: {"operations": [...]}, each one of
+      {"op": "create", "schedule": {...}}
+      {"op": "update", "id": ..., "changes": {...}}
+      {"op": "delete", "id": ...}
+      {"op": "addFollowUp", "id": ..., "followUp": {...}}
+      {"op": "deleteFollowUp", "id": ..., "index": ...}
+      {"op": "reorderFollowUps", "id": ..., "fromIndex": ..., "toIndex": ...}
+    Returns {"success": true, "results": [...]} with one result per
+    operation. If any operation fails, none are applied. With If-Match
+    (the ETag of GET /schedules) the batch fails with 412 if the schedules
+    changed since.
+    """
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return jsonify({"error": "operations must be a list of objects"}), 400
+    
+    try:
+        results = apply_schedule_operations(operations, if_match_version('schedules'))
+    except ScheduleOperationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except VersionConflict:
+        return precondition_failed('schedules', SCHEDULES_FILE)
+    
+    return jsonify({"success": True, "results": results})
+
+
 @app.route('/api/dashboard/schedules/<int:schedule_id>', methods=['DELETE'])
 def delete_schedule(schedule_id):
     """Delete a scheduled action"""
-    schedule_data = load_json_file(SCHEDULES_FILE, {"schedules": []})
-    schedules = schedule_data.get("schedules", [])
-    
-    # Filter out the schedule to delete
-    schedules = [s for s in schedules if s.get('id') != schedule_id]
+    try:
+        apply_schedule_operations([{"op": "delete", "id": schedule_id}], if_match_version('schedules'))
+    except VersionConflict:
+        return precondition_failed('schedules', SCHEDULES_FILE)
+    return jsonify({"success": True})
+
+
+@app.route('/api/dashboard/schedules/occurrences', methods=['GET'])
+def get_schedule_occurrences():
+    """Every run of every schedule in a time range
     
-    schedule_data["schedules"] = schedules
-    save_json_file(SCHEDULES_FILE, schedule_data)
+    Query parameters: start and end as ms timestamps (end exclusive).
+    Returns {"occurrences": [{"scheduleId": ..., "time": ms}, ...]}.
+    """
+    start = request.args.get('start', type=int)
+    end = request.args.get('end', type=int)
+    if start is None or end is None or end <= start:
+        return jsonify({"error": "start and end are required"}), 400
+    if end - start > OCCURRENCE_MAX_RANGE_DAYS * 86400000:
+        return jsonify({"error": f"Range is limited to {OCCURRENCE_MAX_RANGE_DAYS} days"}), 400
     
-    return jsonify({"success": True})
+    schedules = load_json_file(SCHEDULES_FILE, {"schedules": []}).get("schedules", [])
+    occurrences = recurrence_index.occurrences(
+        [schedule for schedule in schedules if 'id' in schedule and 'time' in schedule],
+        datetime.fromtimestamp(start / 1000),
+        datetime.fromtimestamp(end / 1000)
+    )
+    return jsonify({"occurrences": occurrences})
 
 
 @app.route('/api/dashboard/schedules/<int:schedule_id>/followup', methods=['POST'])
 def add_followup_action(schedule_id):
     """Add a follow-up action to a schedule"""
-    data = request.get_json()
-    
-    if not data or 'delay' not in data or 'delayUnit' not in data or 'action' not in data:
-        return jsonify({"error": "Missing required fields"}), 400
-    
-    schedule_data = load_json_file(SCHEDULES_FILE, {"schedules": []})
-    schedules = schedule_data.get("schedules", [])
-    
-    # Find the schedule
-    schedule = next((s for s in schedules if s['id'] == schedule_id), None)
-    if not schedule:
-        return jsonify({"error": "Schedule not found"}), 404
-    
-    # Initialize followUpActions if it doesn't exist
-    if 'followUpActions' not in schedule:
-        schedule['followUpActions'] = []
-    
-    # Create follow-up action
-    followup = {
-        "delay": data['delay'],
-        "delayUnit": data['delayUnit'],
-        "action": data['action']
-    }
-    
-    if data['action'] == 'keyboard':
-        followup['keyboardShortcut'] = data.get('keyboardShortcut', 'ctrl-alt-del')
-    
-    schedule['followUpActions'].append(followup)
-    
-    # Save
-    save_json_file(SCHEDULES_FILE, schedule_data)
+    try:
+        followup, = apply_schedule_operations([
+            {"op": "addFollowUp", "id": schedule_id, "followUp": request.get_json()}
+        ], if_match_version('schedules'))
+    except ScheduleOperationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except VersionConflict:
+        return precondition_failed('schedules', SCHEDULES_FILE)
     
     return jsonify({"success": True, "followup": followup})
 
@@ -340,24 +2109,53 @@ def add_followup_action(schedule_id):
 @app.route('/api/dashboard/schedules/<int:schedule_id>/followup/<int:followup_index>', methods=['DELETE'])
 def delete_followup_action(schedule_id, followup_index):
     """Delete a follow-up action from a schedule"""
-    schedule_data = load_json_file(SCHEDULES_FILE, {"schedules": []})
-    schedules = schedule_data.get("schedules", [])
+    try:
+        apply_schedule_operations([{"op": "deleteFollowUp", "id": schedule_id, "index": followup_index}],
+                                  if_match_version('schedules'))
+    except ScheduleOperationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except VersionConflict:
+        return precondition_failed('schedules', SCHEDULES_FILE)
     
-    # Find the schedule
-    schedule = next((s for s in schedules if s['id'] == schedule_id), None)
-    if not schedule:
-        return jsonify({"error": "Schedule not found"}), 404
+    return jsonify({"success": True})
+
+
+# ============ BULK ACTIONS API ============
+
+@app.route('/api/dashboard/bulk-actions', methods=['POST'])
+def bulk_actions():
+    """Run one action on many PCs at once
     
-    if 'followUpActions' not in schedule or followup_index >= len(schedule['followUpActions']):
-        return jsonify({"error": "Follow-up not found"}), 404
+    Body: {"action": "on"|"off"|"reset"|"keyboard", "ports": [0, 1, ...],
+    "keyboardShortcut": "ctrl-alt-del"}. Returns a result per port.
+    """
+    data = request.get_json()
     
-    # Remove the follow-up
-    schedule['followUpActions'].pop(followup_index)
+    if not data or 'action' not in data or not isinstance(data.get('ports'), list):
+        return jsonify({"error": "Missing required fields"}), 400
+    if data['action'] not in ('on', 'off', 'reset', 'keyboard'):
+        return jsonify({"error": f"Unknown action: {data['action']}"}), 400
     
-    # Save
-    save_json_file(SCHEDULES_FILE, schedule_data)
+    config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
+    has_switch = config.get('hardware', {}).get('hasSwitch', False)
+    names = {pc.get('port'): pc.get('name') for pc in config.get('pcs', [])}
     
-    return jsonify({"success": True})
+    results = action_dispatcher.dispatch([
+        {
+            "port": port,
+            "pcName": names.get(port, f"PC {port + 1}"),
+            "action": data['action'],
+            "keyboardShortcut": data.get('keyboardShortcut', 'ctrl-alt-del')
+        }
+        for port in data['ports'] if isinstance(port, int)
+    ], has_switch)
+    
+    action_desc = data.get('keyboardShortcut', 'ctrl-alt-del') if data['action'] == 'keyboard' else data['action']
+    for result in results:
+        if result['success']:
+            record_action(result['pcName'], f"Bulk {action_desc}", 'bulk')
+    
+    return jsonify({"success": all(r['success'] for r in results), "results": results})
 
 
 # ============ CONFIGURATION API ============
@@ -365,8 +2163,8 @@ def delete_followup_action(schedule_id, followup_index):
 @app.route('/api/dashboard/config', methods=['GET'])
 def get_config():
     """Get dashboard configuration"""
-    config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
-    return jsonify(config)
+    return versioned_json(f"config-{state_store.version(CONFIG_FILE)}",
+                          lambda: load_json_file(CONFIG_FILE, DEFAULT_CONFIG))
 
 
 @app.route('/api/dashboard/config', methods=['POST'])
@@ -380,10 +2178,6 @@ def save_config():
         
         print(f"Received config data: {data}")
         
-        # Load existing config
-        config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
-        print(f"Loaded existing config: {config}")
-        
         # Update with new values (deep merge for nested objects)
         def deep_merge(base, updates):
             for key, value in updates.items():
@@ -392,30 +2186,27 @@ def save_config():
                 else:
                     base[key] = value
         
-        deep_merge(config, data)
-        print(f"Merged config: {config}")
+        with state_store.edit(CONFIG_FILE, DEFAULT_CONFIG, if_match_version('config')) as config:
+            print(f"Loaded existing config: {config}")
+            deep_merge(config, data)
+            print(f"Merged config: {config}")
+            
+            # Mark as no longer first run if completing setup
+            if 'firstRun' in data:
+                config['firstRun'] = data['firstRun']
+        print("Config saved successfully")
         
-        # Mark as no longer first run if completing setup
-        if 'firstRun' in data:
-            config['firstRun'] = data['firstRun']
+        # Automatically cleanup unused icons
+        try:
+            cleanup_icons_internal(config)
+        except Exception as cleanup_error:
+            print(f"Warning: Icon cleanup failed: {cleanup_error}")
+            # Don't fail the save if cleanup fails
         
-        # Save
-        print(f"Attempting to save to: {CONFIG_FILE}")
-        if save_json_file(CONFIG_FILE, config):
-            print("Config saved successfully")
-            
-            # Automatically cleanup unused icons
-            try:
-                cleanup_icons_internal(config)
-            except Exception as cleanup_error:
-                print(f"Warning: Icon cleanup failed: {cleanup_error}")
-                # Don't fail the save if cleanup fails
-            
-            return jsonify({"success": True, "config": config})
-        else:
-            print("save_json_file returned False")
-            return jsonify({"error": "Failed to save configuration"}), 500
+        return jsonify({"success": True, "config": config})
     
+    except VersionConflict:
+        return precondition_failed('config', CONFIG_FILE)
     except Exception as e:
         print(f"ERROR in save_config: {type(e).__name__}: {str(e)}")
         import traceback
@@ -426,24 +2217,232 @@ def save_config():
 @app.route('/api/dashboard/config/reset', methods=['POST'])
 def reset_config():
     """Reset configuration to defaults"""
-    if save_json_file(CONFIG_FILE, DEFAULT_CONFIG):
-        return jsonify({"success": True, "config": DEFAULT_CONFIG})
-    else:
-        return jsonify({"error": "Failed to reset configuration"}), 500
+    try:
+        state_store.save(CONFIG_FILE, DEFAULT_CONFIG, if_match_version('config'))
+    except VersionConflict:
+        return precondition_failed('config', CONFIG_FILE)
+    return jsonify({"success": True, "config": DEFAULT_CONFIG})
 
 
 # ============ ICON UPLOAD API ============
 
-UPLOAD_FOLDER = Path('/usr/share/kvmd/web/dashboard-images')
+UPLOAD_FOLDER = Path(os.environ.get("PIKVM_DASHBOARD_UPLOAD_DIR", "/usr/share/kvmd/web/dashboard-images"))
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp'}
+ICON_MAX_SIZE = (160, 90)  # Twice the largest icon slot on the dashboard (80x45)
+ICON_MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+ICON_WEBP_QUALITY = 85
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Content-hashed icon names; nginx serves these with immutable cache headers
+FINGERPRINTED_ICON = re.compile(r'^[0-9a-f]{16}\.(webp|png|jpg|jpeg|gif|svg)$')
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+
+def spool_upload(file) -> Path:
+    """Stream an uploaded file to a temp file (not on the read-only root), returns its path"""
+    size = 0
+    with tempfile.NamedTemporaryFile(prefix='pikvm-icon-', delete=False) as temp:
+        try:
+            while True:
+                chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > ICON_MAX_UPLOAD_BYTES:
+                    raise ValueError(f"File is larger than {ICON_MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                temp.write(chunk)
+        except Exception:
+            os.unlink(temp.name)
+            raise
+    return Path(temp.name)
+
+
+def process_icon(source: Path, extension: str) -> tuple:
+    """Downscale a raster icon to ICON_MAX_SIZE and transcode it to WebP
+    
+    Returns (data, extension). SVGs are kept as they are, and so is
+    everything else when Pillow is not installed. Raises ValueError for
+    files Pillow cannot read.
+    """
+    if extension != 'svg':
+        try:
+            from PIL import Image, ImageOps, features
+        except ImportError:
+            Image = None
+        
+        if Image is not None:
+            try:
+                with Image.open(source) as image:
+                    # Phone photos carry their rotation in EXIF
+                    image = ImageOps.exif_transpose(image)
+                    image.thumbnail(ICON_MAX_SIZE, Image.LANCZOS)
+                    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P', 'PA') else 'RGB')
+                    
+                    output = io.BytesIO()
+                    if features.check('webp'):
+                        image.save(output, 'WEBP', quality=ICON_WEBP_QUALITY, method=6)
+                        extension = 'webp'
+                    else:
+                        image.save(output, 'PNG', optimize=True)
+                        extension = 'png'
+                    return output.getvalue(), extension
+            except (OSError, Image.DecompressionBombError) as e:
+                raise ValueError(f"Not a readable image: {e}")
+    
+    with open(source, 'rb') as f:
+        return f.read(), extension
+
+
+class IconIndex:
+    """Reference counts of the icons in UPLOAD_FOLDER.
+    
+    Icons are stored under a hash of their content, so identical uploads
+    share one file. The count of a file is the number of PCs in the config
+    using it; syncing with a saved config deletes the files that dropped to
+    zero, without listing the directory. The index is built by a single
+    directory scan the first time it is loaded.
+    """
+    
+    def __init__(self, index_file: Path):
+        self.index_file = index_file
+        self._lock = threading.Lock()
+        self._refs: Optional[Dict[str, int]] = None
+    
+    def _ensure_loaded(self):
+        """Load the index, or build it from the directory once (caller holds the lock)"""
+        if self._refs is not None:
+            return
+        index = load_json_file(self.index_file, {})
+        if 'icons' in index:
+            self._refs = index['icons']
+            return
+        
+        self._refs = {}
+        if UPLOAD_FOLDER.exists():
+            for f in UPLOAD_FOLDER.iterdir():
+                if f.is_file() and not f.name.endswith('.gz'):
+                    self._refs[f.name] = 0
+        self._refs.update(self._referenced(load_json_file(CONFIG_FILE, DEFAULT_CONFIG)))
+        self._save()
+    
+    def _save(self):
+        save_json_file(self.index_file, {"icons": self._refs})
+    
+    @staticmethod
+    def _referenced(config: dict) -> Dict[str, int]:
+        """How many PCs use each uploaded icon"""
+        refs = {}
+        for pc in config.get('pcs', []):
+            if pc.get('iconType') == 'image':
+                icon_path = pc.get('icon', '')
+                if icon_path.startswith('/dashboard-images/'):
+                    filename = icon_path.split('/')[-1]
+                    refs[filename] = refs.get(filename, 0) + 1
+        return refs
+    
+    def store(self, data: bytes, extension: str) -> str:
+        """Store icon content under its hash, returns the filename"""
+        filename = f"{hashlib.sha256(data).hexdigest()[:16]}.{extension}"
+        with self._lock:
+            self._ensure_loaded()
+            filepath = UPLOAD_FOLDER / filename
+            if filename in self._refs and filepath.exists():
+                # Same picture uploaded before
+                return filename
+            
+            with writable_window.open():
+                UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+                temp_file = filepath.with_suffix('.tmp')
+                with open(temp_file, 'wb') as f:
+                    f.write(data)
+                os.chmod(str(temp_file), 0o644)
+                os.replace(temp_file, filepath)
+                if extension == 'svg':
+                    # Precompressed copy for nginx gzip_static (raster formats are compressed already)
+                    gz_file = UPLOAD_FOLDER / f"{filename}.gz"
+                    with open(gz_file, 'wb') as f:
+                        f.write(gzip.compress(data, compresslevel=9))
+                    os.chmod(str(gz_file), 0o644)
+            
+            # Unreferenced until a config using it is saved
+            self._refs.setdefault(filename, 0)
+            self._save()
+        return filename
+    
+    def sync(self, config: dict) -> List[str]:
+        """Recount references from config and delete unreferenced icons, returns the deleted names"""
+        referenced = self._referenced(config)
+        with self._lock:
+            self._ensure_loaded()
+            refs = {filename: referenced.get(filename, 0) for filename in self._refs}
+            refs.update(referenced)
+            unused = [filename for filename, count in refs.items() if count == 0]
+            if refs == self._refs and not unused:
+                return []
+            
+            deleted = []
+            if unused:
+                with writable_window.open():
+                    for filename in unused:
+                        filepath = UPLOAD_FOLDER / filename
+                        if filepath.exists():
+                            filepath.unlink()
+                            deleted.append(filename)
+                            print(f"Deleted unused icon: {filename}")
+                        gz_file = UPLOAD_FOLDER / f"{filename}.gz"
+                        if gz_file.exists():
+                            gz_file.unlink()
+                        del refs[filename]
+            
+            self._refs = refs
+            self._save()
+            return deleted
+    
+    def fingerprint_legacy(self) -> int:
+        """Re-store icons the config uses under their content hash, returns how many
+        
+        Icons uploaded before content hashing keep their original name and
+        size and cannot be cached for long. They go through the upload
+        pipeline once and the config is pointed at the new names. Sync then
+        deletes the old files.
+        """
+        renames = {}
+        with state_store.edit(CONFIG_FILE, DEFAULT_CONFIG) as config:
+            self._fingerprint_pcs(config, renames)
+        
+        if renames:
+            self.sync(config)
+        return len(renames)
+    
+    def _fingerprint_pcs(self, config: dict, renames: Dict[str, str]):
+        """Point legacy icons in config at fingerprinted copies, recording old -> new names"""
+        for pc in config.get('pcs', []):
+            icon_path = pc.get('icon', '')
+            if pc.get('iconType') != 'image' or not icon_path.startswith('/dashboard-images/'):
+                continue
+            filename = icon_path.split('/')[-1]
+            source = UPLOAD_FOLDER / filename
+            if FINGERPRINTED_ICON.match(filename) or not source.is_file() or not allowed_file(filename):
+                continue
+            if filename not in renames:
+                try:
+                    data, extension = process_icon(source, filename.rsplit('.', 1)[1].lower())
+                except ValueError as e:
+                    print(f"Skipping icon {filename}: {e}")
+                    continue
+                renames[filename] = self.store(data, extension)
+                print(f"Icon {filename} is now {renames[filename]}")
+            pc['icon'] = f"/dashboard-images/{renames[filename]}"
+
+
+icon_index = IconIndex(ICON_INDEX_FILE)
+
+
 @app.route('/api/dashboard/upload-icon', methods=['POST'])
 def upload_icon():
-    """Upload a custom icon image"""
+    """Upload a custom icon image (resized, transcoded and stored under its content hash)"""
     try:
         # Check if file is in request
         if 'file' not in request.files:
@@ -459,37 +2458,28 @@ def upload_icon():
         if not allowed_file(file.filename):
             return jsonify({"success": False, "error": "Invalid file type. Use PNG, JPG, SVG, GIF, or WebP"}), 400
         
-        # Secure the filename
-        filename = secure_filename(file.filename)
-        
-        # Ensure upload directory exists
-        UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+        extension = secure_filename(file.filename).rsplit('.', 1)[-1].lower()
         
-        # Make filesystem writable
-        subprocess.run(['/usr/bin/rw'], check=False)
+        try:
+            source = spool_upload(file)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 413
         
         try:
-            # Save the file
-            filepath = UPLOAD_FOLDER / filename
-            file.save(str(filepath))
-            
-            # Set proper permissions
-            os.chmod(str(filepath), 0o644)
-            
-            # Make filesystem read-only again
-            subprocess.run(['/usr/bin/ro'], check=False)
-            
-            return jsonify({
-                "success": True,
-                "filename": filename,
-                "path": f"/dashboard-images/{filename}"
-            })
-            
-        except Exception as e:
-            # Ensure filesystem is read-only even on error
-            subprocess.run(['/usr/bin/ro'], check=False)
-            raise e
-            
+            data, extension = process_icon(source, extension)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        finally:
+            source.unlink()
+        
+        filename = icon_index.store(data, extension)
+        
+        return jsonify({
+            "success": True,
+            "filename": filename,
+            "path": f"/dashboard-images/{filename}"
+        })
+    
     except Exception as e:
         print(f"Error uploading icon: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
@@ -503,48 +2493,17 @@ def cleanup_unused_icons():
         result = cleanup_icons_internal(config)
         return jsonify(result)
     except Exception as e:
-        subprocess.run(['/usr/bin/ro'], check=False)
         print(f"Error cleaning up icons: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 def cleanup_icons_internal(config):
     """Internal function to cleanup unused icons (can be called from other endpoints)"""
-    # Get all icons currently in use
-    used_icons = set()
-    for pc in config.get('pcs', []):
-        if pc.get('iconType') == 'image':
-            icon_path = pc.get('icon', '')
-            if icon_path.startswith('/dashboard-images/'):
-                filename = icon_path.split('/')[-1]
-                used_icons.add(filename)
-    
-    # Get all files in upload folder
-    if not UPLOAD_FOLDER.exists():
-        return {"success": True, "deleted": [], "message": "Upload folder doesn't exist"}
+    deleted = icon_index.sync(config)
     
-    all_files = set(f.name for f in UPLOAD_FOLDER.iterdir() if f.is_file())
-    
-    # Determine unused files
-    unused = all_files - used_icons
-    
-    if not unused:
+    if not deleted:
         return {"success": True, "deleted": [], "message": "No unused icons found"}
     
-    # Delete unused files
-    subprocess.run(['/usr/bin/rw'], check=False)
-    
-    deleted = []
-    try:
-        for filename in unused:
-            filepath = UPLOAD_FOLDER / filename
-            if filepath.exists():
-                filepath.unlink()
-                deleted.append(filename)
-                print(f"Deleted unused icon: {filename}")
-    finally:
-        subprocess.run(['/usr/bin/ro'], check=False)
-    
     return {
         "success": True,
         "deleted": deleted,
@@ -552,275 +2511,1085 @@ def cleanup_icons_internal(config):
     }
 
 
-# ============ UPTIME TRACKING API ============
+# ============ KVMD EVENT STREAM ============
 
-@app.route('/api/dashboard/uptime', methods=['GET'])
-def get_uptime():
-    """Get uptime statistics for all configured PCs"""
-    # Load config to see how many PCs we have
-    config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
-    pc_count = config.get('hardware', {}).get('pcCount', 2)
+class WebSocketError(Exception):
+    """Raised when a websocket handshake fails or the connection breaks"""
+
+
+class WebSocketClient:
+    """Minimal RFC 6455 client: text messages, ping/pong and close.
     
-    # Initialize uptime data for all ports
-    uptime_data = load_json_file(UPTIME_FILE, {
-        str(i): {"totalUptime": 0, "bootTime": None, "lastCheck": None}
-        for i in range(pc_count)
-    })
+    Frames are parsed out of a receive buffer and only consumed once
+    complete, so a socket timeout never loses data and recv() can simply
+    be called again.
+    """
     
-    # Get current status
-    status = get_pikvm_status()
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
     
-    if status:
-        power_array = status.get('result', {}).get('atx', {}).get('leds', {}).get('power', [])
-        
-        for port in range(pc_count):
-            port_str = str(port)
-            is_on = power_array[port] if port < len(power_array) else False
-            
-            if port_str not in uptime_data:
-                uptime_data[port_str] = {"totalUptime": 0, "bootTime": None, "lastCheck": None}
-            
-            port_data = uptime_data[port_str]
-            
-            if is_on:
-                current_time = time.time()
-                
-                # If PC just booted (was off, now on)
-                if port_data.get('bootTime') is None:
-                    port_data['bootTime'] = current_time
-                
-                # Calculate current session uptime
-                boot_time = port_data.get('bootTime', current_time)
-                current_uptime = current_time - boot_time
-                
-                port_data['currentUptime'] = int(current_uptime)
-                port_data['lastCheck'] = current_time
-            else:
-                # PC is off
-                if port_data.get('bootTime') is not None:
-                    # PC was on, now off - add session to total
-                    last_check = port_data.get('lastCheck', time.time())
-                    boot_time = port_data.get('bootTime', last_check)
-                    session_uptime = last_check - boot_time
-                    
-                    port_data['totalUptime'] = port_data.get('totalUptime', 0) + session_uptime
-                    port_data['bootTime'] = None
-                
-                port_data['currentUptime'] = 0
-                port_data['lastCheck'] = time.time()
-        
-        save_json_file(UPTIME_FILE, uptime_data)
+    def __init__(self, url: str, timeout: float):
+        parts = urlsplit(url)
+        secure = parts.scheme == 'wss'
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        sock = socket.create_connection((parts.hostname, parts.port or (443 if secure else 80)), timeout=timeout)
+        try:
+            if secure:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+            self._sock = sock
+            self._buffer = b''
+            self._fragments: List[bytes] = []
+            self.awaiting_pong = False
+            self._send_lock = threading.Lock()
+            self._handshake(parts.netloc, path)
+        except Exception:
+            sock.close()
+            raise
+    
+    def _handshake(self, host: str, path: str):
+        key = base64.b64encode(os.urandom(16)).decode()
+        self._sock.sendall((f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+                            f"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        while b'\r\n\r\n' not in self._buffer:
+            if len(self._buffer) > 65536:
+                raise WebSocketError("handshake response too large")
+            self._receive()
+        head, self._buffer = self._buffer.split(b'\r\n\r\n', 1)
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        if status_line.split(' ')[1:2] != ['101']:
+            raise WebSocketError(f"handshake rejected: {status_line}")
+        headers = {name.strip().lower(): value.strip()
+                   for name, _, value in (line.partition(':') for line in header_lines)}
+        accept = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+        if headers.get('sec-websocket-accept') != accept:
+            raise WebSocketError("handshake returned a wrong Sec-WebSocket-Accept")
+    
+    def _receive(self):
+        chunk = self._sock.recv(65536)
+        if not chunk:
+            raise WebSocketError("connection closed")
+        self._buffer += chunk
+    
+    def _parse_frame(self):
+        """Take one complete frame off the buffer, returns (fin, opcode, payload) or None"""
+        buffer = self._buffer
+        if len(buffer) < 2:
+            return None
+        fin, opcode = buffer[0] & 0x80, buffer[0] & 0x0F
+        masked, length = buffer[1] & 0x80, buffer[1] & 0x7F
+        offset = 2
+        if length == 126:
+            if len(buffer) < 4:
+                return None
+            length, offset = struct.unpack('!H', buffer[2:4])[0], 4
+        elif length == 127:
+            if len(buffer) < 10:
+                return None
+            length, offset = struct.unpack('!Q', buffer[2:10])[0], 10
+        if length > KVMD_EVENT_STREAM_MAX_MESSAGE:
+            raise WebSocketError(f"{length} byte frame is too large")
+        mask = buffer[offset:offset + 4] if masked else None
+        offset += 4 if masked else 0
+        if len(buffer) < offset + length:
+            return None
+        payload = buffer[offset:offset + length]
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self._buffer = buffer[offset + length:]
+        return fin, opcode, payload
+    
+    def _send_frame(self, opcode: int, payload: bytes = b''):
+        # Client frames are always masked
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        with self._send_lock:
+            self._sock.sendall(header + mask + masked)
+    
+    def settimeout(self, timeout: float):
+        self._sock.settimeout(timeout)
     
-    return jsonify(uptime_data)
+    def recv(self) -> Optional[str]:
+        """Next text message, None once the server closes the connection.
+        
+        Raises socket.timeout when nothing arrives within the timeout.
+        """
+        while True:
+            frame = self._parse_frame()
+            if frame is None:
+                self._receive()
+                continue
+            fin, opcode, payload = frame
+            # Any frame, the pong included, shows the connection is alive
+            self.awaiting_pong = False
+            if opcode == 0x9:
+                self._send_frame(0xA, payload)
+            elif opcode == 0x8:
+                return None
+            elif opcode in (0x0, 0x1, 0x2):
+                self._fragments.append(payload)
+                if fin:
+                    message, self._fragments = b''.join(self._fragments), []
+                    return message.decode('utf-8', errors='replace')
+    
+    def send(self, text: str):
+        self._send_frame(0x1, text.encode())
+    
+    def ping(self):
+        self.awaiting_pong = True
+        self._send_frame(0x9)
+    
+    def close(self):
+        try:
+            self._send_frame(0x8)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def _merge_state(state: dict, update: dict) -> dict:
+    """Merge a (possibly partial) kvmd state update into state, returns a new dict"""
+    merged = dict(state)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_state(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class KvmdEventStream:
+    """Live switch state from kvmd's websocket event stream.
+    
+    Keeps one connection to kvmd's /api/ws open and merges its switch
+    state events, full or partial, into an in-memory model shaped like
+    the result of GET /api/switch. While the model is live the status
+    poller reads it instead of calling kvmd, and every change wakes the
+    poller so it reaches dashboards at once. Reconnects with backoff;
+    until then the poller falls back to polling /api/switch.
+    """
+    
+    EVENT_TYPES = ('switch_state', 'switch')  # kvmd renamed its events; accept both
+    
+    def __init__(self, base_url: str = PIKVM_API_BASE):
+        self.url = re.sub(r'^http', 'ws', base_url.rstrip('/')) + KVMD_EVENT_STREAM_PATH
+        self._lock = threading.Lock()
+        self._switch: Optional[dict] = None
+        self._connected = False
+        self._listeners: List[Callable[[], None]] = []
+    
+    def add_listener(self, listener: Callable[[], None]):
+        """Call listener() whenever the model changes or the connection drops"""
+        self._listeners.append(listener)
+    
+    @property
+    def connected(self) -> bool:
+        with self._lock:
+            return self._connected
+    
+    @property
+    def live(self) -> bool:
+        """Connected and holding the switch state"""
+        with self._lock:
+            return self._connected and self._switch is not None
+    
+    def state(self) -> Optional[dict]:
+        """Current state as a GET /api/switch response, None unless the stream is live"""
+        with self._lock:
+            if not self._connected or self._switch is None:
+                return None
+            return {"ok": True, "result": copy.deepcopy(self._switch)}
+    
+    def _notify(self):
+        for listener in self._listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error in kvmd event listener: {e}", flush=True)
+    
+    def handle_event(self, message: dict):
+        """Apply one event from the stream to the model"""
+        event = message.get('event')
+        if message.get('event_type') not in self.EVENT_TYPES or not isinstance(event, dict):
+            return
+        with self._lock:
+            previous = self._switch
+            self._switch = _merge_state(previous or {}, event)
+            changed = self._switch != previous
+        if changed:
+            self._notify()
+    
+    def _listen(self):
+        """Connect and apply events until the connection breaks"""
+        ws = WebSocketClient(self.url, timeout=PIKVM_TIMEOUTS['status'])
+        try:
+            ws.settimeout(KVMD_EVENT_STREAM_PING_INTERVAL)
+            with self._lock:
+                self._switch = None
+                self._connected = True
+            print(f"[kvmd events] Connected to {self.url}", flush=True)
+            while True:
+                try:
+                    message = ws.recv()
+                except socket.timeout:
+                    # A quiet switch is normal, a dead connection does not answer pings
+                    if ws.awaiting_pong:
+                        raise WebSocketError("kvmd stopped answering pings")
+                    ws.ping()
+                    continue
+                if message is None:
+                    raise WebSocketError("closed by kvmd")
+                try:
+                    self.handle_event(json.loads(message))
+                except (ValueError, AttributeError):
+                    continue
+        finally:
+            ws.close()
+    
+    def run(self):
+        """Connection loop, runs forever in its own thread"""
+        delay = KVMD_EVENT_STREAM_RETRY[0]
+        failing = False
+        while True:
+            try:
+                self._listen()
+            except (OSError, WebSocketError) as e:
+                was_connected = self.connected
+                with self._lock:
+                    self._connected = False
+                    self._switch = None
+                if was_connected:
+                    print(f"[kvmd events] Disconnected ({e}), polling /api/switch until it is back", flush=True)
+                    delay = KVMD_EVENT_STREAM_RETRY[0]
+                    self._notify()
+                elif not failing:
+                    print(f"[kvmd events] Unavailable ({e}), polling /api/switch instead", flush=True)
+                failing = not was_connected
+            time.sleep(delay)
+            delay = min(delay * 2, KVMD_EVENT_STREAM_RETRY[1])
 
 
-# ============ SCHEDULED ACTIONS EXECUTOR ============
+kvmd_events = KvmdEventStream()
+
 
-def execute_scheduled_action(schedule: dict):
-    """Execute a scheduled action via PiKVM API"""
-    port = schedule.get('port', 0)
-    action = schedule['action']
+# ============ STATUS POLLER ============
+
+def _led_array(status: dict, led: str) -> List[bool]:
+    """Extract an ATX LED array ('power' or 'hdd') from an /api/switch response"""
+    return [bool(v) for v in status.get('result', {}).get('atx', {}).get('leds', {}).get(led, [])]
+
+
+def _switch_summary(status: dict) -> dict:
+    """Extract the summary (active_port, synced) from an /api/switch response"""
+    result = status.get('result', {})
+    return result.get('summary') or result.get('state', {}).get('summary') or {}
+
+
+class StatusPoller:
+    """Single shared sampler of the switch state.
     
-    # Load config to determine if we have a switch
-    config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
-    has_switch = config.get('hardware', {}).get('hasSwitch', False)
+    Samples at the configured hddCheckInterval no matter how many
+    dashboards are open, and immediately whenever the kvmd event stream
+    reports a change. Samples come from the event stream's model while it
+    is live; otherwise kvmd's /api/switch is polled, backing off up to
+    STATUS_POLL_MAX_INTERVAL while every port is off (or kvmd is down) and
+    nothing changes. Every sample is handed
+    to the registered listeners; changes to the power and HDD LED arrays
+    are pushed to Server-Sent Events subscribers as per-port diffs.
+    """
     
-    try:
-        # Execute primary action
-        if action == 'keyboard':
-            # Execute keyboard shortcut
-            shortcut = schedule.get('keyboardShortcut', 'ctrl-alt-del')
-            execute_keyboard_shortcut(shortcut, port, has_switch)
-        else:
-            # Execute power action
-            if has_switch:
-                # Switch mode - include port parameter
-                if action == 'on':
-                    requests.post(f"{PIKVM_API_BASE}/api/switch/atx/power?port={port}&action=on", timeout=5)
-                elif action == 'off':
-                    requests.post(f"{PIKVM_API_BASE}/api/switch/atx/click?port={port}&button=power", timeout=5)
-                elif action == 'reset':
-                    requests.post(f"{PIKVM_API_BASE}/api/switch/atx/click?port={port}&button=reset", timeout=5)
-            else:
-                # Non-switch mode - no port parameter
-                if action == 'on':
-                    requests.post(f"{PIKVM_API_BASE}/api/atx/power?action=on", timeout=5)
-                elif action == 'off':
-                    requests.post(f"{PIKVM_API_BASE}/api/atx/click?button=power", timeout=5)
-                elif action == 'reset':
-                    requests.post(f"{PIKVM_API_BASE}/api/atx/click?button=reset", timeout=5)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._power: List[bool] = []
+        self._hdd: List[bool] = []
+        self._online = None
+        self._timestamp = None
+        self._listeners: List[Callable[[dict], None]] = []
+        self._subscribers = set()
+        self._wake = threading.Event()
+    
+    def wake(self):
+        """Take the next sample now instead of waiting for the interval"""
+        self._wake.set()
+    
+    def add_listener(self, listener: Callable[[dict], None]):
+        """Call listener(sample) after every poll"""
+        self._listeners.append(listener)
+    
+    def snapshot(self) -> dict:
+        """Latest known state of every port"""
+        with self._lock:
+            return {
+                "online": self._online,
+                "timestamp": self._timestamp,
+                "power": list(self._power),
+                "hdd": list(self._hdd)
+            }
+    
+    def subscribe(self, limit: Optional[int] = None) -> Optional[queue.Queue]:
+        """Register an event queue; it starts with a full snapshot.
         
-        # Log the primary action
-        action_type = "Recurring" if schedule.get('isRecurring') else "Scheduled"
-        action_desc = schedule.get('keyboardShortcut', action) if action == 'keyboard' else action
-        requests.post(f"http://localhost:5000/api/dashboard/actions", 
-                     json={
-                         "pcName": schedule['pcName'],
-                         "action": f"{action_type} {action_desc}",
-                         "method": "scheduled"
-                     }, timeout=5)
+        Returns None if `limit` subscribers are already registered.
+        """
+        subscriber = queue.Queue(maxsize=STATUS_SUBSCRIBER_QUEUE_SIZE)
+        subscriber.put(("snapshot", self.snapshot()))
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(subscriber)
+        # A new dashboard gets a fresh sample even while polling has backed off
+        self.wake()
+        return subscriber
+    
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+    
+    def publish(self, event: str, data: dict):
+        """Push an event to every subscriber"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # Slow client: drop its backlog and resync it from a snapshot
+                try:
+                    while True:
+                        subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(("snapshot", self.snapshot()))
+    
+    def poll_once(self) -> bool:
+        """Take one sample, notify listeners and push any changes.
         
-        print(f"Executed {action_type.lower()} action: {action_desc} on {schedule['pcName']}")
+        Returns whether the sample differed from the previous one.
+        """
+        status = kvmd_events.state()
+        if status is None:
+            status = get_pikvm_status()
+        now = time.time()
+        online = status is not None
         
-        # Execute follow-up actions if configured
-        if schedule.get('followUpActions') and len(schedule['followUpActions']) > 0:
-            threading.Thread(
-                target=execute_followup_chain,
-                args=(schedule,),
-                daemon=True
-            ).start()
+        with self._lock:
+            changes = {}
+            if online:
+                power = _led_array(status, 'power')
+                hdd = _led_array(status, 'hdd')
+                power_changes = {str(port): value for port, value in enumerate(power)
+                                 if port >= len(self._power) or self._power[port] != value}
+                hdd_changes = {str(port): value for port, value in enumerate(hdd)
+                               if port >= len(self._hdd) or self._hdd[port] != value}
+                if power_changes:
+                    changes['power'] = power_changes
+                if hdd_changes:
+                    changes['hdd'] = hdd_changes
+                self._power = power
+                self._hdd = hdd
+            if online != self._online:
+                changes['online'] = online
+            self._online = online
+            self._timestamp = now
+            sample = {"online": online, "timestamp": now, "power": list(self._power), "hdd": list(self._hdd)}
         
-        # Legacy: Schedule secondary action if configured (backwards compatibility)
-        elif schedule.get('hasSecondaryAction'):
-            threading.Thread(
-                target=execute_secondary_action,
-                args=(schedule,),
-                daemon=True
-            ).start()
+        for listener in self._listeners:
+            try:
+                listener(sample)
+            except Exception as e:
+                print(f"Error in status listener: {e}", flush=True)
         
-    except requests.RequestException as e:
-        print(f"Failed to execute scheduled action: {e}")
+        if changes:
+            changes['timestamp'] = now
+            self.publish("status", changes)
+        return bool(changes)
+    
+    def run(self):
+        """Poller loop, runs forever in its own thread"""
+        delay = 0.0
+        while True:
+            self._wake.clear()
+            changed = False
+            try:
+                changed = self.poll_once()
+            except Exception as e:
+                print(f"Error in status poller: {e}", flush=True)
+            
+            config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
+            interval = max(config.get('advanced', {}).get('hddCheckInterval', 1000), 250) / 1000
+            with self._lock:
+                # HDD activity of a powered-on PC is short-lived: the LED indicator
+                # and idle shutdown need every sample, so only back off while all are off
+                watching_hdd = bool(self._online) and any(self._power)
+            if kvmd_events.live or changed or watching_hdd:
+                # Samples from the event stream cost kvmd nothing
+                delay = interval
+            else:
+                delay = min(max(delay, interval) * 2, max(STATUS_POLL_MAX_INTERVAL, interval))
+            self._wake.wait(delay)
+
+
+status_poller = StatusPoller()
+kvmd_events.add_listener(status_poller.wake)
+# New action log entries are pushed to open dashboards as well
+event_bus.subscribe('action', lambda entry: status_poller.publish('action', entry))
+
+
+# ============ HID COMMAND QUEUE ============
+
+class SwitchSelectError(Exception):
+    """Raised when the switch does not confirm a port selection"""
+
+
+class HidCommandQueue:
+    """Serializes keyboard input and selects switch ports for it.
+    
+    HID input goes to whichever port the switch has active, so commands
+    are queued per port and sent in batches: the active port first, then
+    the others in the order they were first queued, each selected once
+    per batch. After selecting a port the queue waits for the switch
+    state to report it active (pushed by the kvmd event stream, or polled
+    from /api/switch while the stream is down) before typing, and fails
+    that port's commands if the switch does not confirm in time.
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: Dict[Optional[int], List[tuple]] = {}  # port -> [(keys, future)], first queued first
+        self._thread: Optional[threading.Thread] = None
+        self._state_changed = threading.Event()
+    
+    def submit(self, keys: str, port: Optional[int] = None) -> Future:
+        """Queue a key combination for port (None: whatever is active), returns a Future"""
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, daemon=True)
+                self._thread.start()
+            self._pending.setdefault(port, []).append((keys, future))
+            self._cond.notify()
+        return future
+    
+    def on_switch_state(self):
+        """kvmd event stream listener"""
+        self._state_changed.set()
+    
+    def _next_batch(self) -> List[tuple]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+        # Commands dispatched together (bulk actions, due schedules) arrive a few at a time
+        time.sleep(HID_BATCH_WINDOW)
+        with self._cond:
+            batch, self._pending = self._pending, {}
+        return list(batch.items())
+    
+    @staticmethod
+    def _fail(commands: List[tuple], error: Exception):
+        for _, future in commands:
+            try:
+                future.set_exception(error)
+            except InvalidStateError:
+                pass  # Cancelled by a caller that gave up, or already resolved
+    
+    def _select(self, port: int):
+        """Make port the active one and wait until the switch confirms it"""
+        selected = False
+        deadline = time.monotonic() + SWITCH_CONFIRM_TIMEOUT
+        while True:
+            # Clear before reading so a change in between is not missed
+            self._state_changed.clear()
+            status = kvmd_events.state() or get_pikvm_status()
+            summary = _switch_summary(status) if status else {}
+            if summary.get('active_port') == port and summary.get('synced', True) is not False:
+                return
+            if not selected:
+                pikvm_client.set_active_port(port)
+                selected = True
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SwitchSelectError(f"Switch did not select port {port} within {SWITCH_CONFIRM_TIMEOUT}s")
+            # The event stream wakes us on every change; while polling, look again shortly
+            self._state_changed.wait(remaining if kvmd_events.live else min(remaining, SWITCH_CONFIRM_POLL_INTERVAL))
+    
+    def _process(self, batch: List[tuple]):
+        status = kvmd_events.state() or get_pikvm_status()
+        active = _switch_summary(status).get('active_port') if status else None
+        # Stable sort: the active port needs no selection, the rest keep queue order
+        for port, commands in sorted(batch, key=lambda item: item[0] != active):
+            if all(future.cancelled() for _, future in commands):
+                continue
+            try:
+                if port is not None:
+                    self._select(port)
+            except Exception as e:
+                self._fail(commands, e)
+                continue
+            for keys, future in commands:
+                # Skip commands whose caller timed out; from here on they cannot be cancelled
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(pikvm_client.send_shortcut(keys))
+                except Exception as e:
+                    future.set_exception(e)
+    
+    def run(self):
+        """Worker loop, runs forever in its own thread once something is queued"""
+        while True:
+            batch = []
+            try:
+                batch = self._next_batch()
+                self._process(batch)
+            except Exception as e:
+                print(f"Error in HID command queue: {e!r}", flush=True)
+                for _, commands in batch:
+                    self._fail(commands, e)
+
 
+hid_queue = HidCommandQueue()
+kvmd_events.add_listener(hid_queue.on_switch_state)
 
-def execute_followup_chain(schedule: dict):
-    """Execute chain of follow-up actions with delays"""
+
+# ============ KEYBOARD API ============
+
+@app.route('/api/dashboard/hid/shortcut', methods=['POST'])
+def send_keyboard_shortcut():
+    """Send a keyboard shortcut to one PC through the HID command queue
+    
+    Body: {"port": 0, "keyboardShortcut": "ctrl-alt-del"}. On a switch the
+    port is selected (and confirmed) first.
+    """
+    data = request.get_json(silent=True) or {}
+    keys = KEYBOARD_SHORTCUTS.get(data.get('keyboardShortcut'))
+    if keys is None:
+        return jsonify({"success": False, "error": f"Unknown shortcut: {data.get('keyboardShortcut')}"}), 400
+    
+    config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
+    has_switch = config.get('hardware', {}).get('hasSwitch', False)
+    port = data.get('port')
+    if has_switch and not isinstance(port, int):
+        return jsonify({"success": False, "error": "Missing port"}), 400
+    
     try:
-        port = schedule.get('port', 0)
-        config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
-        has_switch = config.get('hardware', {}).get('hasSwitch', False)
+        future = hid_queue.submit(keys, port if has_switch else None)
+        try:
+            future.result(HID_COMMAND_TIMEOUT)
+        except FutureTimeoutError:
+            # Not sent yet: make sure it is not typed long after we answered
+            future.cancel()
+            raise TimeoutError(f"Keyboard command not sent within {HID_COMMAND_TIMEOUT}s")
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 502
+    return jsonify({"success": True})
+
+
+# ============ LIVE STATUS API ============
+
+@app.route('/api/dashboard/events', methods=['GET'])
+def status_events():
+    """Server-Sent Events stream of power/HDD LED changes and new action log entries"""
+    subscriber = status_poller.subscribe(limit=SSE_MAX_STREAMS)
+    if subscriber is None:
+        # Every stream holds a server thread; keep the rest for the API
+        return jsonify({"error": "Too many open event streams"}), 503, {'Retry-After': str(SSE_RETRY_AFTER)}
+    
+    def generate():
+        try:
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            status_poller.unsubscribe(subscriber)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ============ IDLE SHUTDOWN ============
+
+class IdleMonitor:
+    """Shuts down PCs whose HDD LED has been dark for too long.
+    
+    Driven by the shared status samples, so it works for every port with
+    idle shutdown enabled in preferences (idleEnabled/idleMinutes) whether
+    or not a dashboard is open. The last HDD activity of each port is kept
+    in a flat array; powered-off ports count as active. Shutdowns run on
+    their own thread so a slow kvmd call does not stall the status poller.
+    """
+    
+    def __init__(self, port_count: int = MAX_PORTS):
+        self._last_activity = [0.0] * port_count
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='idle-shutdown')
+    
+    def on_sample(self, sample: dict):
+        """Status poller listener"""
+        if not sample.get('online'):
+            return
         
-        for followup in schedule.get('followUpActions', []):
-            # Calculate delay in seconds
-            delay = followup.get('delay', 60)
-            unit = followup.get('delayUnit', 'seconds')
-            
-            if unit == 'minutes':
-                delay *= 60
-            elif unit == 'hours':
-                delay *= 3600
-            elif unit == 'days':
-                delay *= 86400
+        now = sample['timestamp']
+        power = sample['power']
+        hdd = sample['hdd']
+        prefs = load_json_file(PREFERENCES_FILE, DEFAULT_PREFERENCES)
+        enabled = prefs.get('idleEnabled', [])
+        minutes = prefs.get('idleMinutes', [])
+        
+        for port in range(min(len(power), len(self._last_activity))):
+            is_on = power[port]
+            hdd_active = port < len(hdd) and hdd[port]
             
-            print(f"Waiting {delay} seconds before executing follow-up action for {schedule['pcName']}")
-            time.sleep(delay)
+            if not is_on or hdd_active or not self._last_activity[port]:
+                self._last_activity[port] = now
+                continue
             
-            # Execute the follow-up action
-            action = followup.get('action')
+            if not (port < len(enabled) and enabled[port]):
+                continue
             
-            if action == 'keyboard':
-                shortcut = followup.get('keyboardShortcut', 'ctrl-alt-del')
-                execute_keyboard_shortcut(shortcut, port, has_switch)
-                action_desc = shortcut
-            else:
-                # Execute power action
-                if has_switch:
-                    if action == 'on':
-                        requests.post(f"{PIKVM_API_BASE}/api/switch/atx/power?port={port}&action=on", timeout=5)
-                    elif action == 'off':
-                        requests.post(f"{PIKVM_API_BASE}/api/switch/atx/click?port={port}&button=power", timeout=5)
-                    elif action == 'reset':
-                        requests.post(f"{PIKVM_API_BASE}/api/switch/atx/click?port={port}&button=reset", timeout=5)
-                else:
-                    if action == 'on':
-                        requests.post(f"{PIKVM_API_BASE}/api/atx/power?action=on", timeout=5)
-                    elif action == 'off':
-                        requests.post(f"{PIKVM_API_BASE}/api/atx/click?button=power", timeout=5)
-                    elif action == 'reset':
-                        requests.post(f"{PIKVM_API_BASE}/api/atx/click?button=reset", timeout=5)
-                action_desc = action
+            idle_minutes = minutes[port] if port < len(minutes) and minutes[port] else 30
+            if now - self._last_activity[port] >= idle_minutes * 60:
+                self._executor.submit(self._shutdown, port, idle_minutes)
+                # Reset timer, the PC may take a while to power off
+                self._last_activity[port] = now
+    
+    def _shutdown(self, port: int, idle_minutes: int):
+        config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
+        has_switch = config.get('hardware', {}).get('hasSwitch', False)
+        pc_name = next((pc.get('name') for pc in config.get('pcs', []) if pc.get('port') == port),
+                       f"PC {port + 1}")
+        
+        print(f"{pc_name} idle for {idle_minutes} minutes, shutting down...", flush=True)
+        try:
+            pikvm_client.power_action('off', port, has_switch)
+        except Exception as e:
+            # Runs on the executor, nobody else would see the error
+            print(f"Failed to shut down idle PC {pc_name}: {e}", flush=True)
+            return
+        record_action(pc_name, f"Auto-shutdown after {idle_minutes} min idle", 'auto-shutdown')
+
+
+idle_monitor = IdleMonitor()
+status_poller.add_listener(idle_monitor.on_sample)
+
+
+# ============ UPTIME TRACKING ============
+
+class UptimeTracker:
+    """Per-port uptime sessions maintained from the shared status samples.
+    
+    The state lives in memory and is only saved to uptime.json when a port
+    powers on or off, or every UPTIME_CHECKPOINT_INTERVAL seconds. Each
+    sample adds the time elapsed since the previous one to the port's
+    per-day and per-week totals, so the aggregates never need recomputing.
+    """
+    
+    def __init__(self, uptime_file: Path):
+        self.uptime_file = uptime_file
+        self._lock = threading.Lock()
+        self._ports: Optional[Dict[str, dict]] = None
+        self._last_checkpoint = time.time()
+        self._version = 0
+    
+    def _ensure_loaded(self):
+        """Load persisted sessions on first use (caller holds the lock)"""
+        if self._ports is None:
+            self._ports = load_json_file(self.uptime_file, {})
+    
+    @staticmethod
+    def _new_port() -> dict:
+        return {"totalUptime": 0, "bootTime": None, "lastCheck": None, "daily": {}, "weekly": {}}
+    
+    @staticmethod
+    def _add_to_aggregates(port_data: dict, start: float, end: float):
+        """Credit [start, end) to the per-day and per-week totals, split at midnight"""
+        daily = port_data.setdefault('daily', {})
+        weekly = port_data.setdefault('weekly', {})
+        while start < end:
+            day = datetime.fromtimestamp(start)
+            next_midnight = (day + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+            chunk_end = min(end, next_midnight.timestamp())
+            seconds = chunk_end - start
             
-            # Log the follow-up action
-            requests.post(f"http://localhost:5000/api/dashboard/actions", 
-                         json={
-                             "pcName": schedule['pcName'],
-                             "action": f"Follow-up {action_desc}",
-                             "method": "scheduled"
-                         }, timeout=5)
+            day_key = day.strftime('%Y-%m-%d')
+            iso_year, iso_week, _ = day.isocalendar()
+            week_key = f"{iso_year}-W{iso_week:02d}"
             
-            print(f"Executed follow-up action: {action_desc} on {schedule['pcName']}")
+            if day_key not in daily:
+                daily[day_key] = 0
+                # Drop the oldest days once the history is full
+                for old_key in sorted(daily)[:-UPTIME_DAILY_HISTORY]:
+                    del daily[old_key]
+            if week_key not in weekly:
+                weekly[week_key] = 0
+                for old_key in sorted(weekly)[:-UPTIME_WEEKLY_HISTORY]:
+                    del weekly[old_key]
+            daily[day_key] = daily.get(day_key, 0) + seconds
+            weekly[week_key] = weekly.get(week_key, 0) + seconds
+            start = chunk_end
+    
+    def on_sample(self, sample: dict):
+        """Status poller listener: advance every port's session"""
+        if not sample.get('online'):
+            # kvmd unreachable, we know nothing about the ports
+            return
+        
+        now = sample['timestamp']
+        changed = False
+        with self._lock:
+            self._ensure_loaded()
+            for port, is_on in enumerate(sample['power']):
+                port_data = self._ports.setdefault(str(port), self._new_port())
+                last_check = port_data.get('lastCheck')
+                
+                if is_on:
+                    if port_data.get('bootTime') is None:
+                        # PC just booted (was off, now on)
+                        port_data['bootTime'] = now
+                        changed = True
+                    elif last_check is not None and 0 < now - last_check <= UPTIME_MAX_SAMPLE_GAP:
+                        self._add_to_aggregates(port_data, last_check, now)
+                    port_data['lastCheck'] = now
+                else:
+                    if port_data.get('bootTime') is not None:
+                        # PC was on, now off - add session to total
+                        last_check = last_check or now
+                        port_data['totalUptime'] = port_data.get('totalUptime', 0) + last_check - port_data['bootTime']
+                        port_data['bootTime'] = None
+                        changed = True
+                    port_data['lastCheck'] = now
             
-    except Exception as e:
-        print(f"Failed to execute follow-up action: {e}")
+            if changed or any(sample['power']):
+                # Sessions or running totals moved, the report is different
+                self._version += 1
+            if changed or now - self._last_checkpoint >= UPTIME_CHECKPOINT_INTERVAL:
+                save_json_file(self.uptime_file, self._ports)
+                self._last_checkpoint = now
+    
+    @property
+    def version(self) -> int:
+        """Counter bumped whenever the report changes (for ETags)"""
+        return self._version
+    
+    def report(self, pc_count: int) -> Dict[str, dict]:
+        """Uptime statistics for ports 0..pc_count-1, with current session uptime"""
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            result = {}
+            for port in range(pc_count):
+                port_data = copy.deepcopy(self._ports.get(str(port), self._new_port()))
+                # Internal bookkeeping, and it would change the report on every sample
+                port_data.pop('lastCheck', None)
+                boot_time = port_data.get('bootTime')
+                port_data['currentUptime'] = int(now - boot_time) if boot_time is not None else 0
+                result[str(port)] = port_data
+            return result
+
+
+uptime_tracker = UptimeTracker(UPTIME_FILE)
+status_poller.add_listener(uptime_tracker.on_sample)
 
 
-def execute_keyboard_shortcut(shortcut: str, port: int, has_switch: bool):
-    """Execute a keyboard shortcut via PiKVM HID API"""
-    # Map shortcuts to PiKVM key sequences
-    shortcuts = {
-        'ctrl-alt-del': 'ControlLeft+AltLeft+Delete',
-        'ctrl-alt-esc': 'ControlLeft+AltLeft+Escape',
-        'alt-f4': 'AltLeft+F4',
-        'win': 'MetaLeft',
-        'win-r': 'MetaLeft+KeyR',
-        'win-l': 'MetaLeft+KeyL'
-    }
-    
-    key_sequence = shortcuts.get(shortcut, 'ControlLeft+AltLeft+Delete')
-    
-    # If switch mode, we may need to select the port first (depends on PiKVM setup)
-    # For now, we'll just send the keyboard command
-    requests.post(f"{PIKVM_API_BASE}/api/hid/print?limit=0&text={key_sequence}", timeout=5)
+# ============ UPTIME TRACKING API ============
+
+@app.route('/api/dashboard/uptime', methods=['GET'])
+def get_uptime():
+    """Get uptime statistics (with per-day and per-week totals) for all configured PCs"""
+    config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
+    pc_count = config.get('hardware', {}).get('pcCount', 2)
+    return versioned_json(f"uptime-{pc_count}-{uptime_tracker.version}",
+                          lambda: uptime_tracker.report(pc_count))
+
+
+# ============ DASHBOARD SYNC API ============
+
+# Documents sent by /bootstrap and /changes (named after their file stems,
+# which is how the state store records their revisions)
+SYNC_DOCUMENTS = {
+    "config": (CONFIG_FILE, DEFAULT_CONFIG),
+    "preferences": (PREFERENCES_FILE, DEFAULT_PREFERENCES),
+    "schedules": (SCHEDULES_FILE, {"schedules": []})
+}
 
 
-def execute_secondary_action(schedule: dict):
-    """Execute secondary action after delay"""
+def list_custom_images() -> List[str]:
+    """Image files in the upload folder (what the /dashboard-images/ listing shows)"""
     try:
-        # Calculate delay in seconds
-        delay = schedule.get('secondaryDelay', 60)
-        unit = schedule.get('secondaryDelayUnit', 'seconds')
-        
-        if unit == 'minutes':
-            delay *= 60
-        elif unit == 'hours':
-            delay *= 3600
-        elif unit == 'days':
-            delay *= 86400
+        return sorted(f.name for f in UPLOAD_FOLDER.iterdir() if f.is_file() and allowed_file(f.name))
+    except OSError:
+        return []
+
+
+def bootstrap_snapshot() -> dict:
+    """Everything the dashboard loads at startup, with the revision it reflects"""
+    # Read first: anything that changes while the snapshot is built is sent
+    # again by the next /changes, never missed
+    snapshot = {"epoch": SERVER_EPOCH, "revision": state_store.revision}
+    for name, (filepath, default) in SYNC_DOCUMENTS.items():
+        snapshot[name] = load_json_file(filepath, default)
+    snapshot["actions"] = {
+        "actions": action_log.query(),
+        "latestId": action_log.latest_id(),
+        "limit": action_log.limit
+    }
+    pc_count = snapshot["config"].get('hardware', {}).get('pcCount', 2)
+    snapshot["uptime"] = uptime_tracker.report(pc_count)
+    snapshot["images"] = list_custom_images()
+    return snapshot
+
+
+@app.route('/api/dashboard/bootstrap', methods=['GET'])
+def get_bootstrap():
+    """Config, preferences, schedules, action log, uptime and custom images in one response"""
+    return jsonify(bootstrap_snapshot())
+
+
+@app.route('/api/dashboard/changes', methods=['GET'])
+def get_changes():
+    """What changed since a revision returned by /bootstrap or /changes
+    
+    Query parameters: since (revision) and epoch (from the same response).
+    Returns {"epoch", "revision", "documents": {name: document}} with only
+    the changed documents, plus "actions" (new entries, newest first) when
+    the action log changed. If the service restarted since (another epoch)
+    the answer is a full bootstrap snapshot with "reset": true. Uptime is
+    derived from the clock and is still polled from /uptime.
+    """
+    since = request.args.get('since', type=int)
+    revision = state_store.revision
+    if since is None or since > revision or request.args.get('epoch') != SERVER_EPOCH:
+        return jsonify(dict(bootstrap_snapshot(), reset=True))
+    
+    changed = state_store.changed_since(since)
+    changes = {
+        "epoch": SERVER_EPOCH,
+        "revision": revision,
+        "documents": {
+            name: load_json_file(filepath, default)
+            for name, (filepath, default) in SYNC_DOCUMENTS.items()
+            if name in changed
+        }
+    }
+    if 'actions' in changed:
+        actions = action_log.changes_since(since)
+        if actions is not None:
+            changes["actions"] = actions
+    return jsonify(changes)
+
+
+# ============ SCHEDULED ACTIONS EXECUTOR ============
+
+@execution_duration.timed('schedule')
+def execute_scheduled_actions(schedules: List[dict]):
+    """Execute due scheduled actions (concurrently when several are due at once)"""
+    # Load config to determine if we have a switch
+    config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
+    has_switch = config.get('hardware', {}).get('hasSwitch', False)
+    
+    results = action_dispatcher.dispatch([
+        {
+            "port": schedule.get('port', 0),
+            "pcName": schedule['pcName'],
+            "action": schedule['action'],
+            "keyboardShortcut": schedule.get('keyboardShortcut', 'ctrl-alt-del')
+        }
+        for schedule in schedules
+    ], has_switch)
+    
+    for schedule, result in zip(schedules, results):
+        if not result['success']:
+            print(f"Failed to execute scheduled action: {result['error']}")
+            continue
         
-        print(f"Waiting {delay} seconds before executing secondary action for {schedule['pcName']}")
-        time.sleep(delay)
+        # Log the primary action
+        action = schedule['action']
+        action_type = "Recurring" if schedule.get('isRecurring') else "Scheduled"
+        action_desc = schedule.get('keyboardShortcut', action) if action == 'keyboard' else action
+        record_action(schedule['pcName'], f"{action_type} {action_desc}", 'scheduled')
         
-        # Execute secondary action
-        port = schedule.get('port', 0)
-        secondary_action = schedule.get('secondaryAction', 'on')
+        print(f"Executed {action_type.lower()} action: {action_desc} on {schedule['pcName']}")
         
+        # Queue follow-up actions (or the legacy secondary action) if configured.
+        # A malformed follow-up (e.g. saved before delays were validated) must
+        # not keep the other due schedules from being handled
+        try:
+            queue_followups(schedule)
+        except Exception as e:
+            print(f"Failed to queue follow-ups of {schedule['pcName']}: {e!r}", flush=True)
+
+
+def delay_to_seconds(delay, unit: str) -> float:
+    """Convert a follow-up delay in the given unit to seconds"""
+    if unit == 'minutes':
+        return delay * 60
+    elif unit == 'hours':
+        return delay * 3600
+    elif unit == 'days':
+        return delay * 86400
+    return delay
+
+
+def queue_followups(schedule: dict):
+    """Submit a schedule's follow-up chain to the follow-up dispatcher"""
+    steps = []
+    if schedule.get('followUpActions'):
+        for followup in schedule['followUpActions']:
+            steps.append({
+                "label": "Follow-up",
+                "delay": delay_to_seconds(followup.get('delay', 60), followup.get('delayUnit', 'seconds')),
+                "action": followup.get('action'),
+                "keyboardShortcut": followup.get('keyboardShortcut', 'ctrl-alt-del')
+            })
+    elif schedule.get('hasSecondaryAction'):
+        # Legacy: secondary action (backwards compatibility)
+        steps.append({
+            "label": "Secondary",
+            "delay": delay_to_seconds(schedule.get('secondaryDelay', 60), schedule.get('secondaryDelayUnit', 'seconds')),
+            "action": schedule.get('secondaryAction', 'on'),
+            "keyboardShortcut": schedule.get('secondaryKeyboardShortcut', 'ctrl-alt-del')
+        })
+    
+    if not steps:
+        return
+    
+    followup_dispatcher.submit({
+        "id": uuid.uuid4().hex,
+        "due": int((time.time() + steps[0]['delay']) * 1000),
+        "port": schedule.get('port', 0),
+        "pcName": schedule['pcName'],
+        "steps": steps
+    })
+
+
+@execution_duration.timed('followup')
+def execute_followup_step(job: dict):
+    """Execute the first step of a follow-up job and queue the rest of the chain"""
+    step = job['steps'][0]
+    
+    try:
         config = load_json_file(CONFIG_FILE, DEFAULT_CONFIG)
         has_switch = config.get('hardware', {}).get('hasSwitch', False)
         
-        if secondary_action == 'keyboard':
-            # Execute keyboard shortcut
-            shortcut = schedule.get('secondaryKeyboardShortcut', 'ctrl-alt-del')
-            execute_keyboard_shortcut(shortcut, port, has_switch)
-            action_desc = shortcut
-        else:
-            # Execute power action
-            if has_switch:
-                if secondary_action == 'on':
-                    requests.post(f"{PIKVM_API_BASE}/api/switch/atx/power?port={port}&action=on", timeout=5)
-                elif secondary_action == 'off':
-                    requests.post(f"{PIKVM_API_BASE}/api/switch/atx/click?port={port}&button=power", timeout=5)
-                elif secondary_action == 'reset':
-                    requests.post(f"{PIKVM_API_BASE}/api/switch/atx/click?port={port}&button=reset", timeout=5)
-            else:
-                if secondary_action == 'on':
-                    requests.post(f"{PIKVM_API_BASE}/api/atx/power?action=on", timeout=5)
-                elif secondary_action == 'off':
-                    requests.post(f"{PIKVM_API_BASE}/api/atx/click?button=power", timeout=5)
-                elif secondary_action == 'reset':
-                    requests.post(f"{PIKVM_API_BASE}/api/atx/click?button=reset", timeout=5)
-            action_desc = secondary_action
-        
-        # Log the secondary action
-        requests.post(f"http://localhost:5000/api/dashboard/actions", 
-                     json={
-                         "pcName": schedule['pcName'],
-                         "action": f"Secondary {action_desc}",
-                         "method": "scheduled"
-                     }, timeout=5)
-        
-        print(f"Executed secondary action: {action_desc} on {schedule['pcName']}")
+        action = step.get('action')
+        result = action_dispatcher.dispatch([{
+            "port": job.get('port', 0),
+            "pcName": job['pcName'],
+            "action": action,
+            "keyboardShortcut": step.get('keyboardShortcut', 'ctrl-alt-del')
+        }], has_switch)[0]
+        if not result['success']:
+            raise RuntimeError(result['error'])
+        action_desc = step.get('keyboardShortcut', 'ctrl-alt-del') if action == 'keyboard' else action
         
+        # Log the follow-up action
+        record_action(job['pcName'], f"{step.get('label', 'Follow-up')} {action_desc}", 'scheduled')
+        
+        print(f"Executed {step.get('label', 'Follow-up').lower()} action: {action_desc} on {job['pcName']}")
+    
     except Exception as e:
-        print(f"Failed to execute secondary action: {e}")
+        print(f"Failed to execute follow-up action: {e}")
+    
+    # A failed step does not break the chain, same as a failed primary action
+    remaining = job['steps'][1:]
+    if remaining:
+        followup_dispatcher.submit(dict(
+            job,
+            id=uuid.uuid4().hex,
+            due=int((time.time() + remaining[0]['delay']) * 1000),
+            steps=remaining
+        ))
+
+
+class FollowupDispatcher:
+    """Delay queue for follow-up steps.
+    
+    Jobs are kept in a min-heap keyed by their due time and persisted to
+    FOLLOWUPS_FILE so pending steps survive a service restart. A single
+    dispatcher thread sleeps until the earliest job is due and hands it to a
+    small worker pool that makes the PiKVM calls.
+    """
+    
+    def __init__(self, jobs_file: Path, max_workers: int = FOLLOWUP_WORKERS):
+        self.jobs_file = jobs_file
+        self._condition = threading.Condition()
+        self._heap = []
+        self._jobs: Dict[str, dict] = {}
+        self._loaded = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='followup')
+    
+    def _ensure_loaded(self):
+        """Restore jobs persisted by a previous run (caller holds the condition)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        for job in load_json_file(self.jobs_file, {"jobs": []}).get("jobs", []):
+            self._jobs[job['id']] = job
+            heapq.heappush(self._heap, (job['due'], job['id']))
+        if self._jobs:
+            print(f"[Follow-ups] Restored {len(self._jobs)} pending follow-up step(s)", flush=True)
+    
+    def _persist(self):
+        """Save pending jobs (caller holds the condition)"""
+        save_json_file(self.jobs_file, {"jobs": list(self._jobs.values())})
+    
+    def submit(self, job: dict):
+        """Queue a job to run at job['due'] (ms timestamp)"""
+        with self._condition:
+            self._ensure_loaded()
+            self._jobs[job['id']] = job
+            heapq.heappush(self._heap, (job['due'], job['id']))
+            self._persist()
+            self._condition.notify()
+        
+        delay = max(0, (job['due'] - time.time() * 1000) / 1000)
+        print(f"Queued {job['steps'][0].get('label', 'follow-up').lower()} action for {job['pcName']} in {delay:.0f} seconds")
+    
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._jobs)
+    
+    def run(self):
+        """Dispatcher loop, runs forever in its own thread"""
+        while True:
+            with self._condition:
+                self._ensure_loaded()
+                now = int(time.time() * 1000)
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, job_id = heapq.heappop(self._heap)
+                    job = self._jobs.pop(job_id, None)
+                    if job is not None:
+                        scheduler_lag.observe(max(0, now - job['due']) / 1000, 'followup')
+                        due.append(job)
+                
+                if due:
+                    self._persist()
+                else:
+                    timeout = SCHEDULER_MAX_SLEEP
+                    if self._heap:
+                        timeout = min(timeout, (self._heap[0][0] - now) / 1000)
+                    self._condition.wait(timeout)
+                    continue
+            
+            for job in due:
+                self._executor.submit(execute_followup_step, job)
+
+
+followup_dispatcher = FollowupDispatcher(FOLLOWUPS_FILE)
 
 
 def calculate_next_execution(schedule: dict) -> int:
@@ -828,174 +3597,252 @@ def calculate_next_execution(schedule: dict) -> int:
     if not schedule.get('isRecurring'):
         return schedule['time']
     
-    frequency = schedule.get('frequency', 'daily')
-    current_time = datetime.now()
-    
-    # Parse the original schedule time to get hour and minute
-    schedule_dt = datetime.fromtimestamp(schedule['time'] / 1000)
-    target_hour = schedule_dt.hour
-    target_minute = schedule_dt.minute
-    
-    # Start from today at the target time
-    next_exec = current_time.replace(hour=target_hour, minute=target_minute, second=0, microsecond=0)
-    
-    # If we've already passed today's time, move to tomorrow
-    if next_exec <= current_time:
-        next_exec += timedelta(days=1)
-    
-    if frequency == 'daily':
-        # Already set to next occurrence
-        pass
-    
-    elif frequency == 'weekly':
-        # Find next occurrence of any target day of week
-        days_of_week = schedule.get('daysOfWeek', [schedule.get('dayOfWeek', 0)])  # Support both formats
-        if not isinstance(days_of_week, list):
-            days_of_week = [days_of_week]
+    next_exec = recurrence_index.rule(schedule).next_after(datetime.now())
+    return int(next_exec.timestamp() * 1000)
+
+
+class ScheduleEngine:
+    """Runs schedules at their precomputed next-execution times.
+    
+    Pending fire times are kept in a min-heap of (timestamp_ms, schedule_id).
+    The engine thread sleeps until the earliest entry is due, or until
+    notify() reports that the schedule API changed schedules.json, in which
+    case the heap is rebuilt before sleeping again.
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._heap = []
+        self._stale = True
+    
+    def notify(self):
+        """Rebuild the heap from schedules.json and re-evaluate the next wake-up"""
+        with self._condition:
+            self._stale = True
+            self._condition.notify()
+    
+    def _rebuild(self):
+        """Recompute every schedule's next fire time (caller holds the condition)"""
+        schedule_data = load_json_file(SCHEDULES_FILE, {"schedules": []})
+        now = int(time.time() * 1000)
+        # Entries that came due while we were rebuilding must still fire;
+        # recomputing a recurring schedule now would skip to its next occurrence
+        overdue = {schedule_id: fire_ms for fire_ms, schedule_id in self._heap if fire_ms <= now}
         
-        # Find the nearest upcoming day from the list
-        min_days_ahead = 8  # Start with impossible value
-        for target_day in days_of_week:
-            days_ahead = target_day - next_exec.weekday()
-            if days_ahead <= 0:  # Target day already happened this week
-                days_ahead += 7
-            if days_ahead < min_days_ahead:
-                min_days_ahead = days_ahead
+        self._heap = []
+        for schedule in schedule_data.get("schedules", []):
+            if 'id' not in schedule:
+                continue
+            # A malformed schedule is skipped, it must not stop the others
+            try:
+                fire_ms = overdue.get(schedule['id'])
+                if fire_ms is None:
+                    fire_ms = int(calculate_next_execution(schedule))
+            except Exception as e:
+                print(f"[Schedule Checker] Skipping schedule {schedule['id']}: {e!r}", flush=True)
+                continue
+            self._heap.append((fire_ms, schedule['id']))
+        heapq.heapify(self._heap)
+        self._stale = False
         
-        next_exec += timedelta(days=min_days_ahead)
-    
-    elif frequency == 'biweekly':
-        # Find next occurrence of any target day, then ensure it's 2 weeks from last execution
-        days_of_week = schedule.get('daysOfWeek', [schedule.get('dayOfWeek', 0)])
-        if not isinstance(days_of_week, list):
-            days_of_week = [days_of_week]
+        if self._heap:
+            fire_ms, _ = self._heap[0]
+            print(f"[Schedule Checker] {len(self._heap)} schedule(s), next at {datetime.fromtimestamp(fire_ms/1000)}", flush=True)
+    
+    def _wait_for_due(self) -> List[tuple]:
+        """Block until at least one schedule is due, then pop all due entries"""
+        with self._condition:
+            while True:
+                if self._stale:
+                    self._rebuild()
+                
+                now = int(time.time() * 1000)
+                if self._heap and self._heap[0][0] <= now:
+                    due = []
+                    while self._heap and self._heap[0][0] <= now:
+                        due.append(heapq.heappop(self._heap))
+                    return due
+                
+                timeout = SCHEDULER_MAX_SLEEP
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0][0] - now) / 1000)
+                self._condition.wait(timeout)
+    
+    def _fire(self, due: List[tuple]):
+        """Execute due schedules and persist the resulting schedule changes"""
+        schedules = load_json_file(SCHEDULES_FILE, {"schedules": []}).get("schedules", [])
+        by_id = {schedule.get('id'): schedule for schedule in schedules}
+        completed = set()
+        rescheduled = []
         
-        # Find the nearest upcoming day from the list
-        min_days_ahead = 8
-        for target_day in days_of_week:
-            days_ahead = target_day - next_exec.weekday()
-            if days_ahead <= 0:
-                days_ahead += 7
-            if days_ahead < min_days_ahead:
-                min_days_ahead = days_ahead
-        
-        next_exec += timedelta(days=min_days_ahead)
-        
-        # If we have a last execution, ensure we're at least 14 days from it
-        if schedule.get('lastExecuted'):
-            last_exec_dt = datetime.fromtimestamp(schedule['lastExecuted'] / 1000)
-            while (next_exec - last_exec_dt).days < 14:
-                next_exec += timedelta(days=7)
-    
-    elif frequency == 'monthly':
-        # Same day of month, next month
-        if next_exec.month == 12:
-            next_exec = next_exec.replace(year=next_exec.year + 1, month=1)
-        else:
-            next_exec = next_exec.replace(month=next_exec.month + 1)
-    
-    elif frequency == 'quarterly':
-        # Add 3 months
-        new_month = next_exec.month + 3
-        new_year = next_exec.year
-        if new_month > 12:
-            new_month -= 12
-            new_year += 1
-        next_exec = next_exec.replace(year=new_year, month=new_month)
-    
-    elif frequency == 'annually':
-        # Same date, next year
-        next_exec = next_exec.replace(year=next_exec.year + 1)
-    
-    return int(next_exec.timestamp() * 1000)
+        # Schedules deleted after they were queued are skipped
+        due = [(fire_ms, schedule_id) for fire_ms, schedule_id in due if schedule_id in by_id]
+        now = time.time() * 1000
+        for fire_ms, schedule_id in due:
+            scheduler_lag.observe(max(0, now - fire_ms) / 1000, 'schedule')
+            print(f"[EXECUTING] {by_id[schedule_id]['pcName']} - {by_id[schedule_id]['action']}", flush=True)
+        try:
+            # Everything due in the same tick is sent to kvmd concurrently
+            execute_scheduled_actions([by_id[schedule_id] for _, schedule_id in due])
+        finally:
+            # Even if executing failed: a one-time schedule must not fire again
+            # and recurring ones must stay in the heap
+            fired = {schedule_id: fire_ms for fire_ms, schedule_id in due}
+            try:
+                # Re-read under the document lock: the API may have edited schedules
+                # while the actions ran
+                with state_store.edit(SCHEDULES_FILE, {"schedules": []}) as schedule_data:
+                    schedules = schedule_data.get("schedules", [])
+                    for schedule in schedules:
+                        fire_ms = fired.get(schedule.get('id'))
+                        if fire_ms is None:
+                            continue
+                        if schedule.get('isRecurring'):
+                            # Update last executed time and calculate next execution
+                            try:
+                                next_ms = int(calculate_next_execution(schedule))
+                            except Exception as e:
+                                print(f"[Schedule Checker] Cannot reschedule {schedule['id']}: {e!r}", flush=True)
+                                continue
+                            schedule['lastExecuted'] = fire_ms
+                            schedule['time'] = next_ms
+                            rescheduled.append((next_ms, schedule['id']))
+                            print(f"Recurring schedule updated: next execution at {datetime.fromtimestamp(next_ms/1000)}", flush=True)
+                        else:
+                            # Remove one-time schedules after execution
+                            completed.add(schedule['id'])
+                            print(f"One-time schedule completed and removed", flush=True)
+                    
+                    schedule_data["schedules"] = [s for s in schedules if s.get('id') not in completed]
+            finally:
+                with self._condition:
+                    for entry in rescheduled:
+                        heapq.heappush(self._heap, entry)
+    
+    def run(self):
+        """Engine loop, runs forever in the schedule checker thread"""
+        while True:
+            try:
+                self._fire(self._wait_for_due())
+            except Exception as e:
+                print(f"Error in schedule checker: {e}", flush=True)
+                import traceback
+                traceback.print_exc()
+                # Avoid a tight loop if something is persistently broken
+                time.sleep(1)
+
+
+schedule_engine = ScheduleEngine()
 
 
 def schedule_checker():
-    """Background thread to check and execute scheduled actions"""
+    """Background thread to execute scheduled actions when they are due"""
     print("="*50, flush=True)
     print("SCHEDULE CHECKER THREAD STARTED", flush=True)
     print("="*50, flush=True)
     
-    while True:
-        try:
-            schedule_data = load_json_file(SCHEDULES_FILE, {"schedules": []})
-            schedules = schedule_data.get("schedules", [])
-            
-            if len(schedules) > 0:
-                print(f"[Schedule Checker] Checking {len(schedules)} schedule(s)", flush=True)
-            
-            current_time = int(time.time() * 1000)
-            modified = False
-            
-            for schedule in schedules:
-                # Calculate current execution time (handles recurring schedules)
-                exec_time = calculate_next_execution(schedule)
-                
-                time_until = (exec_time - current_time) / 1000  # seconds
-                if time_until < 60:  # Log if within 1 minute
-                    print(f"[Schedule] {schedule['pcName']} - {schedule['action']} in {time_until:.0f}s (exec_time: {datetime.fromtimestamp(exec_time/1000)})", flush=True)
-                
-                # If it's time to execute
-                if exec_time <= current_time:
-                    print(f"[EXECUTING] {schedule['pcName']} - {schedule['action']}", flush=True)
-                    execute_scheduled_action(schedule)
-                    
-                    if schedule.get('isRecurring'):
-                        # Update last executed time and calculate next execution
-                        schedule['lastExecuted'] = current_time
-                        schedule['time'] = calculate_next_execution(schedule)
-                        modified = True
-                        print(f"Recurring schedule updated: next execution at {datetime.fromtimestamp(schedule['time']/1000)}", flush=True)
-                    else:
-                        # Remove one-time schedules after execution
-                        schedules.remove(schedule)
-                        modified = True
-                        print(f"One-time schedule completed and removed", flush=True)
-            
-            # Save if anything changed
-            if modified:
-                schedule_data["schedules"] = schedules
-                save_json_file(SCHEDULES_FILE, schedule_data)
-        
-        except Exception as e:
-            print(f"Error in schedule checker: {e}", flush=True)
-            import traceback
-            traceback.print_exc()
-        
-        time.sleep(5)  # Check every 5 seconds
+    schedule_engine.run()
 
 
-def uptime_tracker():
-    """Background thread to track uptime"""
-    while True:
-        try:
-            # Update uptime data
-            get_uptime()
-        except Exception as e:
-            print(f"Error in uptime tracker: {e}")
-        
-        time.sleep(30)  # Update every 30 seconds
+# ============ METRICS API ============
+
+pending_followups = metrics.register(Gauge(
+    'pikvm_dashboard_pending_followups', 'Follow-up steps waiting for their delay to elapse',
+    lambda: followup_dispatcher.pending_count()))
+kvmd_event_stream_live = metrics.register(Gauge(
+    'pikvm_dashboard_kvmd_event_stream_live', 'Whether switch state comes from the kvmd event stream (1) or from polling /api/switch (0)',
+    lambda: int(kvmd_events.live)))
+
+
+@app.route('/metrics', methods=['GET'])
+@app.route('/api/dashboard/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 # ============ MAIN ============
 
-if __name__ == '__main__':
-    print("="*60, flush=True)
-    print("PIKVM DASHBOARD SERVICE STARTING", flush=True)
-    print("="*60, flush=True)
+def start_background_threads():
+    """Start the scheduler, follow-up dispatcher, kvmd event stream and status poller threads"""
+    try:
+        icon_index.fingerprint_legacy()
+    except Exception as e:
+        print(f"Error fingerprinting icons: {e}", flush=True)
     
-    # Start background threads
     print("Starting schedule checker thread...", flush=True)
     schedule_thread = threading.Thread(target=schedule_checker, daemon=True)
     schedule_thread.start()
     
-    print("Starting uptime tracker thread...", flush=True)
-    uptime_thread = threading.Thread(target=uptime_tracker, daemon=True)
-    uptime_thread.start()
+    print("Starting follow-up dispatcher thread...", flush=True)
+    followup_thread = threading.Thread(target=followup_dispatcher.run, daemon=True)
+    followup_thread.start()
+    
+    if KVMD_EVENT_STREAM:
+        print("Starting kvmd event stream thread...", flush=True)
+        events_thread = threading.Thread(target=kvmd_events.run, daemon=True)
+        events_thread.start()
+    
+    print("Starting status poller thread (feeds uptime tracking and idle shutdown)...", flush=True)
+    status_thread = threading.Thread(target=status_poller.run, daemon=True)
+    status_thread.start()
+
+
+def shutdown_persistence():
+    """Write pending state and leave the filesystem read-only"""
+    state_store.flush()
+    writable_window.close()
+
+
+def run_production_server():
+    """Serve the API from one threaded gunicorn worker instead of the development server"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("gunicorn is not installed, falling back to the development server", flush=True)
+        start_background_threads()
+        host, _, port = SERVER_BIND.rpartition(':')
+        app.run(host=host or '0.0.0.0', port=int(port), debug=False, threaded=True)
+        return
+    
+    class DashboardServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', SERVER_BIND)
+            # One worker: documents are cached in, and the scheduler runs in, this one process
+            self.cfg.set('workers', 1)
+            self.cfg.set('worker_class', 'gthread')
+            # Each open event stream holds one thread, at most SSE_MAX_STREAMS of them
+            self.cfg.set('threads', SERVER_THREADS)
+            self.cfg.set('timeout', 120)
+            self.cfg.set('accesslog', None)
+            self.cfg.set('errorlog', '-')
+            # Threads do not survive fork, so start them in the worker
+            self.cfg.set('post_worker_init', lambda worker: start_background_threads())
+            self.cfg.set('worker_exit', lambda server, worker: shutdown_persistence())
+        
+        def load(self):
+            return app
+    
+    DashboardServer().run()
+
+
+if __name__ == '__main__':
+    print("="*60, flush=True)
+    print("PIKVM DASHBOARD SERVICE STARTING", flush=True)
+    print("="*60, flush=True)
     
     print(f"Data directory: {DATA_DIR}", flush=True)
     print("API endpoints available at http://localhost:5000/api/dashboard/", flush=True)
     print("="*60, flush=True)
     
-    # Run Flask app
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    if '--production' in sys.argv:
+        # Used by pikvm-dashboard.service
+        run_production_server()
+    else:
+        # systemd stops us with SIGTERM; exit normally so atexit flushes pending state
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        
+        start_background_threads()
+        
+        # Run Flask development server
+        app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+kvmd event stream tests: websocket framing, keepalive, reconnects and state merges
+Run with: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import base64
+import hashlib
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# The service creates its data directory on import, keep it out of /var/lib
+_data_dir = tempfile.mkdtemp(prefix="pikvm-dashboard-test-")
+os.environ.setdefault("PIKVM_DASHBOARD_DATA_DIR", _data_dir)
+os.environ.setdefault("PIKVM_DASHBOARD_UPLOAD_DIR", os.path.join(_data_dir, "dashboard-images"))
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / "benchmarks"))
+sys.path.insert(0, str(REPO_DIR))
+
+import pikvm_dashboard_service as service  # noqa: E402
+from fake_kvmd import WEBSOCKET_GUID, FakeKvmd, read_frame  # noqa: E402
+from pikvm_dashboard_service import KvmdEventStream, WebSocketClient, WebSocketError  # noqa: E402
+
+TIMEOUT = 5
+PING_INTERVAL = 0.1
+
+
+def raw_frame(opcode: int, payload: bytes = b'', fin: bool = True, mask: bytes = b'') -> bytes:
+    """Encode a server frame, optionally a fragment (fin=False) or masked"""
+    length = len(payload)
+    first = (0x80 if fin else 0) | opcode
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack('!BB', first, mask_bit | length)
+    elif length < 65536:
+        header = struct.pack('!BBH', first, mask_bit | 126, length)
+    else:
+        header = struct.pack('!BBQ', first, mask_bit | 127, length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return header + mask + payload
+
+
+def wait_until(predicate, timeout: float = TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class ScriptedServer:
+    """Websocket server for one connection that runs script(conn, rfile) after the handshake"""
+
+    def __init__(self, script):
+        self.script = script
+        self.received = []
+        self._listener = socket.create_server(('127.0.0.1', 0))
+        self.url = "ws://127.0.0.1:%d/api/ws" % self._listener.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        conn, _ = self._listener.accept()
+        with conn:
+            rfile = conn.makefile('rb')
+            key = ''
+            while True:
+                line = rfile.readline().decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                if name.lower() == 'sec-websocket-key':
+                    key = value.strip()
+            accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+            conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                          f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+            try:
+                self.script(conn, rfile)
+            except OSError:
+                pass
+
+    def read(self, rfile):
+        """Read one client frame and remember it"""
+        message = read_frame(rfile)
+        self.received.append(message)
+        return message
+
+    def close(self):
+        self._listener.close()
+        self._thread.join(TIMEOUT)
+
+
+class WebSocketClientTest(unittest.TestCase):
+    """Frame parsing of the stdlib websocket client"""
+
+    def connect(self, script) -> WebSocketClient:
+        server = ScriptedServer(script)
+        self.addCleanup(server.close)
+        self.server = server
+        client = WebSocketClient(server.url, timeout=TIMEOUT)
+        self.addCleanup(client.close)
+        return client
+
+    def test_text_and_extended_lengths(self):
+        medium, large = 'm' * 300, 'l' * 70000
+
+        def script(conn, rfile):
+            conn.sendall(raw_frame(0x1, b'hello') + raw_frame(0x1, medium.encode())
+                         + raw_frame(0x1, large.encode()))
+
+        client = self.connect(script)
+        self.assertEqual(client.recv(), 'hello')
+        self.assertEqual(client.recv(), medium)
+        self.assertEqual(client.recv(), large)
+
+    def test_frame_split_across_reads(self):
+        def script(conn, rfile):
+            data = raw_frame(0x1, b'{"event_type": "loop"}')
+            for i in range(len(data)):
+                conn.sendall(data[i:i + 1])
+                time.sleep(0.001)
+
+        client = self.connect(script)
+        self.assertEqual(client.recv(), '{"event_type": "loop"}')
+
+    def test_masked_frame(self):
+        def script(conn, rfile):
+            conn.sendall(raw_frame(0x1, b'masked text', mask=b'\x01\x02\x03\x04'))
+
+        client = self.connect(script)
+        self.assertEqual(client.recv(), 'masked text')
+
+    def test_fragmented_message_with_interleaved_ping(self):
+        def script(conn, rfile):
+            conn.sendall(raw_frame(0x1, b'one ', fin=False) + raw_frame(0x9, b'beat')
+                         + raw_frame(0x0, b'two ', fin=False) + raw_frame(0x0, b'three'))
+            self.server.read(rfile)
+
+        client = self.connect(script)
+        self.assertEqual(client.recv(), 'one two three')
+        self.server.close()
+        self.assertEqual(self.server.received, [(0xA, b'beat')])
+
+    def test_ping_is_answered_with_pong(self):
+        def script(conn, rfile):
+            conn.sendall(raw_frame(0x9, b'payload'))
+            self.server.read(rfile)
+            conn.sendall(raw_frame(0x1, b'after'))
+
+        client = self.connect(script)
+        self.assertEqual(client.recv(), 'after')
+        self.assertEqual(self.server.received, [(0xA, b'payload')])
+
+    def test_client_frames_are_masked(self):
+        def script(conn, rfile):
+            header = rfile.read(2)
+            self.server.received.append(header)
+            length = header[1] & 0x7F
+            rfile.read(4 + length)
+            conn.sendall(raw_frame(0x1, b'ok'))
+
+        client = self.connect(script)
+        client.send('hi')
+        self.assertEqual(client.recv(), 'ok')
+        self.assertTrue(self.server.received[0][1] & 0x80)
+
+    def test_close_frame_ends_stream(self):
+        def script(conn, rfile):
+            conn.sendall(raw_frame(0x1, b'last') + raw_frame(0x8))
+
+        client = self.connect(script)
+        self.assertEqual(client.recv(), 'last')
+        self.assertIsNone(client.recv())
+
+    def test_dropped_connection_raises(self):
+        def script(conn, rfile):
+            conn.sendall(raw_frame(0x1, b'partial', fin=False))
+
+        client = self.connect(script)
+        with self.assertRaises(WebSocketError):
+            client.recv()
+
+    def test_oversized_frame_is_refused(self):
+        def script(conn, rfile):
+            conn.sendall(struct.pack('!BBQ', 0x81, 127, service.KVMD_EVENT_STREAM_MAX_MESSAGE + 1))
+
+        client = self.connect(script)
+        with self.assertRaises(WebSocketError):
+            client.recv()
+
+    def test_timeout_keeps_buffered_data(self):
+        data = raw_frame(0x1, b'slow message')
+
+        def script(conn, rfile):
+            conn.sendall(data[:5])
+            time.sleep(0.3)
+            conn.sendall(data[5:])
+
+        client = self.connect(script)
+        client.settimeout(0.1)
+        with self.assertRaises(socket.timeout):
+            client.recv()
+        client.settimeout(TIMEOUT)
+        self.assertEqual(client.recv(), 'slow message')
+
+
+class PingTimeoutTest(unittest.TestCase):
+    """A silent connection is pinged, then dropped when the ping goes unanswered"""
+
+    def test_unanswered_ping_drops_connection(self):
+        silent = threading.Event()
+
+        def script(conn, rfile):
+            server.read(rfile)
+            silent.wait(TIMEOUT)
+
+        server = ScriptedServer(script)
+        self.addCleanup(server.close)
+        self.addCleanup(silent.set)
+        stream = KvmdEventStream()
+        stream.url = server.url
+        with mock.patch.object(service, 'KVMD_EVENT_STREAM_PING_INTERVAL', PING_INTERVAL):
+            started = time.monotonic()
+            with self.assertRaisesRegex(WebSocketError, "pings"):
+                stream._listen()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(server.received[0][0], 0x9)
+
+
+class KvmdEventStreamTest(unittest.TestCase):
+    """The event stream against the fake kvmd's /api/ws"""
+
+    def setUp(self):
+        patcher = mock.patch.object(service, 'KVMD_EVENT_STREAM_PING_INTERVAL', PING_INTERVAL)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake = FakeKvmd(port_count=4, flicker_interval=0).start()
+        self.stream = KvmdEventStream(self.fake.url)
+        self.notified = threading.Event()
+        self.stream.add_listener(self.notified.set)
+        self.errors = []
+        self.thread = threading.Thread(target=self._listen, daemon=True)
+        self.thread.start()
+        self.assertTrue(wait_until(lambda: self.stream.live))
+
+    def _listen(self):
+        try:
+            self.stream._listen()
+        except (OSError, WebSocketError) as e:
+            self.errors.append(e)
+
+    def tearDown(self):
+        self.fake.stop()
+        self.thread.join(TIMEOUT)
+
+    def result(self) -> dict:
+        return self.stream.state()['result']
+
+    def test_full_state_on_connect(self):
+        result = self.result()
+        self.assertEqual(len(result['model']['ports']), 4)
+        self.assertEqual(result['atx']['leds']['power'], [True, False, True, False])
+        self.assertEqual(service._switch_summary(self.stream.state())['active_port'], 0)
+
+    def test_partial_event_is_merged(self):
+        self.notified.clear()
+        self.fake.handle_command('/api/switch/atx/power', {'port': ['1'], 'action': ['on']})
+        self.assertTrue(self.notified.wait(TIMEOUT))
+        self.assertTrue(wait_until(lambda: self.result()['atx']['leds']['power'][1]))
+        # The partial event carries no model, the one from the full state stays
+        self.assertEqual(len(self.result()['model']['ports']), 4)
+
+        self.fake.handle_command('/api/switch/set_active', {'port': ['2']})
+        self.assertTrue(wait_until(lambda: service._switch_summary(self.stream.state()).get('active_port') == 2))
+        self.assertEqual(self.result()['atx']['leds']['power'], [True, True, True, False])
+
+    def test_answered_pings_keep_connection(self):
+        # A quiet switch: only keepalive pings and kvmd's pongs go over the wire
+        time.sleep(PING_INTERVAL * 6)
+        self.assertTrue(self.stream.live)
+        self.assertEqual(self.errors, [])
+
+    def test_close_from_kvmd(self):
+        self.fake.stop()
+        self.thread.join(TIMEOUT)
+        self.assertFalse(self.thread.is_alive())
+        self.assertRegex(str(self.errors[0]), "closed by kvmd")
+
+
+class MergeTest(unittest.TestCase):
+    """Full and partial switch_state events applied to the model"""
+
+    def setUp(self):
+        self.stream = KvmdEventStream('http://127.0.0.1:1')
+        self.stream._connected = True
+
+    def test_partial_update_keeps_other_keys(self):
+        self.stream.handle_event({"event_type": "switch_state", "event": {
+            "model": {"ports": [{}, {}]},
+            "atx": {"leds": {"power": [True, False], "hdd": [False, False]}}}})
+        self.stream.handle_event({"event_type": "switch_state", "event": {
+            "atx": {"leds": {"hdd": [True, False]}}}})
+        result = self.stream.state()['result']
+        self.assertEqual(result['atx']['leds'], {"power": [True, False], "hdd": [True, False]})
+        self.assertEqual(result['model'], {"ports": [{}, {}]})
+
+    def test_full_update_replaces_values(self):
+        self.stream.handle_event({"event_type": "switch", "event": {"atx": {"leds": {"power": [True]}}}})
+        self.stream.handle_event({"event_type": "switch", "event": {"atx": {"leds": {"power": [False, True]}}}})
+        self.assertEqual(self.stream.state()['result']['atx']['leds']['power'], [False, True])
+
+    def test_other_events_ignored(self):
+        notified = []
+        self.stream.add_listener(lambda: notified.append(True))
+        self.stream.handle_event({"event_type": "loop", "event": {}})
+        self.stream.handle_event({"event_type": "switch_state", "event": "bogus"})
+        self.assertIsNone(self.stream.state())
+        self.assertEqual(notified, [])
+
+    def test_unchanged_event_does_not_notify(self):
+        notified = []
+        self.stream.add_listener(lambda: notified.append(True))
+        event = {"event_type": "switch_state", "event": {"atx": {"leds": {"power": [True]}}}}
+        self.stream.handle_event(event)
+        self.stream.handle_event(event)
+        self.assertEqual(len(notified), 1)
+
+
+class ReconnectBackoffTest(unittest.TestCase):
+    """run() retries with exponential backoff, reset after a working connection"""
+
+    class Stop(Exception):
+        pass
+
+    def run_stream(self, outcomes) -> list:
+        """Run the connection loop over outcomes (True: connects then drops), returns the sleeps"""
+        stream = KvmdEventStream('http://127.0.0.1:1')
+        outcomes = iter(outcomes)
+        delays = []
+
+        def listen():
+            if next(outcomes):
+                with stream._lock:
+                    stream._connected = True
+                    stream._switch = {}
+            raise WebSocketError("gone")
+
+        def sleep(delay):
+            delays.append(delay)
+            if len(delays) == self.rounds:
+                raise self.Stop()
+
+        stream._listen = listen
+        with mock.patch.object(service.time, 'sleep', sleep), self.assertRaises(self.Stop):
+            stream.run()
+        self.assertFalse(stream.connected)
+        return delays
+
+    def test_backoff_doubles_up_to_maximum(self):
+        self.rounds = 9
+        first, maximum = service.KVMD_EVENT_STREAM_RETRY
+        delays = self.run_stream([False] * self.rounds)
+        self.assertEqual(delays[:3], [first, first * 2, first * 4])
+        self.assertEqual(delays[-1], maximum)
+        self.assertTrue(all(b == min(a * 2, maximum) for a, b in zip(delays, delays[1:])))
+
+    def test_backoff_resets_after_connection(self):
+        self.rounds = 5
+        first = service.KVMD_EVENT_STREAM_RETRY[0]
+        delays = self.run_stream([False, False, False, True, False])
+        self.assertEqual(delays, [first, first * 2, first * 4, first, first * 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
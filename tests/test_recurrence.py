@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Recurrence rule tests
+Run with: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# The service creates its data directory on import, keep it out of /var/lib
+_data_dir = tempfile.mkdtemp(prefix="pikvm-dashboard-test-")
+os.environ.setdefault("PIKVM_DASHBOARD_DATA_DIR", _data_dir)
+os.environ.setdefault("PIKVM_DASHBOARD_UPLOAD_DIR", os.path.join(_data_dir, "dashboard-images"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pikvm_dashboard_service import RecurrenceRule  # noqa: E402
+
+
+def schedule_at(anchor: datetime, frequency: str, **fields) -> dict:
+    return dict({"id": 1, "time": int(anchor.timestamp() * 1000), "isRecurring": True,
+                 "frequency": frequency}, **fields)
+
+
+class FutureAnchorTest(unittest.TestCase):
+    """A recurring schedule never runs before its start date"""
+
+    def setUp(self):
+        today = datetime.now().replace(second=0, microsecond=0)
+        self.now = today
+        self.anchor = (today + timedelta(days=3)).replace(hour=2, minute=3)
+
+    def test_daily_next_after(self):
+        rule = RecurrenceRule(schedule_at(self.anchor, 'daily'))
+        self.assertEqual(rule.next_after(self.now), self.anchor)
+
+    def test_monthly_next_after(self):
+        anchor = self.anchor + timedelta(days=40)
+        rule = RecurrenceRule(schedule_at(anchor, 'monthly'))
+        self.assertEqual(rule.next_after(self.now), anchor)
+
+    def test_weekly_next_after(self):
+        # Only the anchor's own weekday, so the first run is the anchor itself
+        rule = RecurrenceRule(schedule_at(self.anchor, 'weekly', daysOfWeek=[self.anchor.weekday()]))
+        self.assertEqual(rule.next_after(self.now), self.anchor)
+
+    def test_occurrences_start_at_anchor(self):
+        rule = RecurrenceRule(schedule_at(self.anchor, 'daily'))
+        occurrences = rule.occurrences(self.now - timedelta(days=1), self.anchor + timedelta(days=2))
+        self.assertEqual(occurrences, [self.anchor, self.anchor + timedelta(days=1)])
+
+    def test_past_anchor_still_recurs(self):
+        anchor = (self.now - timedelta(days=10)).replace(hour=2, minute=3)
+        rule = RecurrenceRule(schedule_at(anchor, 'daily'))
+        next_run = rule.next_after(self.now)
+        self.assertGreater(next_run, self.now)
+        self.assertLessEqual(next_run - self.now, timedelta(days=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
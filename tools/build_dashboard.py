@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+PiKVM Dashboard build step
+
+Splits the single-file pikvm-dashboard.html into minified, cacheable assets:
+
+- the inline <style> becomes app.<hash>.css
+- the inline <script> becomes app.<hash>.js
+- script sections between `// @lazy <name>` and `// @end-lazy` become
+  <name>.<hash>.js. The main bundle gets a stub for every function the
+  section declares; the first call loads the module, whose declarations
+  replace the stubs, and is then forwarded to the real function.
+- the credential constants (EMBEDDED_*) stay inline, because install.sh
+  injects and reads them in the HTML
+
+The unbuilt HTML keeps working as it is (the markers are plain comments), so
+the build is optional. Only the standard library is used, so it runs on the
+PiKVM itself.
+
+Usage:
+    python3 tools/build_dashboard.py pikvm-dashboard.html --assets-dir /usr/share/kvmd/web/dashboard-assets
+"""
+
+import argparse
+import gzip
+import hashlib
+import re
+import sys
+from pathlib import Path
+
+DEFAULT_URL_PREFIX = "/dashboard-assets"
+# Asset names written by this script, anything else in the assets dir is left alone
+ASSET_NAME = re.compile(r'^[a-z0-9-]+\.[0-9a-f]{12}\.(js|css)(\.gz)?$')
+LAZY_START = re.compile(r'^\s*// @lazy ([a-z0-9-]+)\s*$')
+LAZY_END = re.compile(r'^\s*// @end-lazy\s*$')
+INLINE_CONSTANT = re.compile(r'^\s*const EMBEDDED_\w+ = .*;\s*$')
+
+
+class BuildError(Exception):
+    pass
+
+
+# ============ JAVASCRIPT MINIFIER ============
+#
+# A conservative minifier: it drops comments and collapses whitespace but
+# never renames or rewrites code. Newlines are kept wherever automatic
+# semicolon insertion could depend on them.
+
+WORD_CHAR = re.compile(r'[A-Za-z0-9_$\u0080-￿]')
+PUNCTUATORS = sorted([
+    '>>>=', '...', '===', '!==', '**=', '<<=', '>>=', '>>>', '&&=', '||=', '??=',
+    '=>', '==', '!=', '<=', '>=', '&&', '||', '??', '?.', '++', '--', '+=', '-=', '*=',
+    '/=', '%=', '&=', '|=', '^=', '**', '<<', '>>',
+], key=len, reverse=True)
+REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                  'throw', 'case', 'do', 'else', 'yield', 'await'}
+# A newline after these (or before those) can never end a statement
+NO_ASI_AFTER = set('{([,;:=+-*/%&|^!~?<>.') | set(PUNCTUATORS) - {'++', '--'}
+NO_ASI_BEFORE = set(')]},;.')
+
+
+class Token:
+    __slots__ = ('kind', 'text', 'space_before', 'newline_before')
+
+    def __init__(self, kind: str, text: str, space_before: bool, newline_before: bool):
+        self.kind = kind  # word, number, string, template, regex, punct
+        self.text = text
+        self.space_before = space_before
+        self.newline_before = newline_before
+
+
+def _regex_allowed(previous) -> bool:
+    """Whether a '/' after this token starts a regular expression literal"""
+    if previous is None:
+        return True
+    if previous.kind == 'word':
+        return previous.text in REGEX_KEYWORDS
+    if previous.kind in ('number', 'string', 'template', 'regex'):
+        return False
+    return previous.text not in (')', ']')
+
+
+def tokenize(src: str, pos: int = 0, stop_at_brace: bool = False) -> tuple:
+    """Tokenize JavaScript from pos, returns (tokens, end position)
+
+    With stop_at_brace the scan ends at the '}' closing a template
+    literal substitution.
+    """
+    tokens = []
+    depth = 0
+    space = newline = False
+    length = len(src)
+
+    def add(kind, text):
+        nonlocal space, newline
+        tokens.append(Token(kind, text, space, newline))
+        space = newline = False
+
+    while pos < length:
+        char = src[pos]
+
+        if char in ' \t\r\n\f\v ﻿':
+            space = True
+            newline = newline or char == '\n'
+            pos += 1
+
+        elif src.startswith('//', pos):
+            end = src.find('\n', pos)
+            pos = length if end == -1 else end
+
+        elif src.startswith('/*', pos):
+            end = src.find('*/', pos + 2)
+            if end == -1:
+                raise BuildError("Unterminated comment")
+            newline = newline or '\n' in src[pos:end]
+            space = True
+            pos = end + 2
+
+        elif char in '\'"':
+            end = pos + 1
+            while end < length and src[end] != char:
+                if src[end] == '\\':
+                    end += 1
+                elif src[end] == '\n':
+                    raise BuildError(f"Unterminated string at offset {pos}")
+                end += 1
+            add('string', src[pos:end + 1])
+            pos = end + 1
+
+        elif char == '`':
+            parts = ['`']
+            end = pos + 1
+            while True:
+                if end >= length:
+                    raise BuildError(f"Unterminated template literal at offset {pos}")
+                if src[end] == '\\':
+                    parts.append(src[end:end + 2])
+                    end += 2
+                elif src[end] == '`':
+                    parts.append('`')
+                    end += 1
+                    break
+                elif src.startswith('${', end):
+                    inner, end = tokenize(src, end + 2, stop_at_brace=True)
+                    parts.append('${' + render(inner) + '}')
+                    end += 1
+                else:
+                    parts.append(src[end])
+                    end += 1
+            add('template', ''.join(parts))
+            pos = end
+
+        elif char == '/' and _regex_allowed(tokens[-1] if tokens else None):
+            end = pos + 1
+            in_class = False
+            while True:
+                if end >= length or src[end] == '\n':
+                    raise BuildError(f"Unterminated regular expression at offset {pos}")
+                if src[end] == '\\':
+                    end += 2
+                    continue
+                if src[end] == '[':
+                    in_class = True
+                elif src[end] == ']':
+                    in_class = False
+                elif src[end] == '/' and not in_class:
+                    break
+                end += 1
+            end += 1
+            while end < length and WORD_CHAR.match(src[end]):
+                end += 1  # flags
+            add('regex', src[pos:end])
+            pos = end
+
+        elif char.isdigit() or (char == '.' and pos + 1 < length and src[pos + 1].isdigit()):
+            match = re.compile(r'0[xXbBoO][0-9a-fA-F_]+n?|(\d[\d_]*)?\.?\d*([eE][+-]?\d+)?n?').match(src, pos)
+            add('number', match.group(0))
+            pos = match.end()
+
+        elif WORD_CHAR.match(char):
+            end = pos
+            while end < length and WORD_CHAR.match(src[end]):
+                end += 1
+            add('word', src[pos:end])
+            pos = end
+
+        else:
+            if stop_at_brace:
+                if char == '{':
+                    depth += 1
+                elif char == '}':
+                    if depth == 0:
+                        return tokens, pos
+                    depth -= 1
+            for punctuator in PUNCTUATORS:
+                if src.startswith(punctuator, pos):
+                    add('punct', punctuator)
+                    pos += len(punctuator)
+                    break
+            else:
+                add('punct', char)
+                pos += 1
+
+    if stop_at_brace:
+        raise BuildError("Unterminated template substitution")
+    return tokens, pos
+
+
+def render(tokens) -> str:
+    """Join tokens with the least whitespace that keeps the meaning"""
+    out = []
+    previous = None
+    for token in tokens:
+        if previous is not None and token.space_before:
+            if token.newline_before and previous.text not in NO_ASI_AFTER and token.text[0] not in NO_ASI_BEFORE:
+                out.append('\n')
+            elif (WORD_CHAR.match(previous.text[-1]) and WORD_CHAR.match(token.text[0])) \
+                    or (previous.text[-1] in '+-/' and token.text[0] == previous.text[-1]) \
+                    or (previous.kind == 'number' and token.text[0] == '.'):
+                out.append(' ')
+            elif token.newline_before and previous.text in ('++', '--'):
+                out.append('\n')
+        out.append(token.text)
+        previous = token
+    return ''.join(out)
+
+
+def minify_js(src: str) -> str:
+    tokens, _ = tokenize(src)
+    return render(tokens) + '\n'
+
+
+def top_level_declarations(src: str) -> tuple:
+    """Names of the functions and variables a script declares at the top level"""
+    tokens, _ = tokenize(src)
+    functions, variables = [], []
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token.kind == 'punct' and token.text in '{([':
+            depth += 1
+        elif token.kind == 'punct' and token.text in '})]':
+            depth -= 1
+        elif depth == 0 and token.kind == 'word' and i + 1 < len(tokens):
+            following = tokens[i + 1]
+            if token.text == 'function' and following.kind == 'word':
+                functions.append(following.text)
+            elif token.text in ('let', 'const', 'var'):
+                if following.kind != 'word':
+                    raise BuildError(f"Destructuring at the top level of a lazy module is not supported: {token.text} {following.text}")
+                variables.append(following.text)
+    return functions, variables
+
+
+def identifiers(src: str) -> set:
+    """Identifiers a script refers to (property names after '.' excluded)"""
+    tokens, _ = tokenize(src)
+    names = set()
+    for i, token in enumerate(tokens):
+        if token.kind == 'word' and not (i > 0 and tokens[i - 1].text in ('.', '?.')):
+            names.add(token.text)
+    return names
+
+
+# ============ CSS MINIFIER ============
+
+def minify_css(src: str) -> str:
+    out = []
+    pos = 0
+    length = len(src)
+    while pos < length:
+        char = src[pos]
+        if src.startswith('/*', pos):
+            end = src.find('*/', pos + 2)
+            pos = length if end == -1 else end + 2
+        elif char in '\'"':
+            end = pos + 1
+            while end < length and src[end] != char:
+                end += 2 if src[end] == '\\' else 1
+            out.append(src[pos:end + 1])
+            pos = end + 1
+        elif char.isspace():
+            while pos < length and src[pos].isspace():
+                pos += 1
+            out.append(' ')
+        else:
+            out.append(char)
+            pos += 1
+    css = ''.join(out)
+    # Whitespace around structural characters carries no meaning (but it does
+    # around + and - in calc(), so those are left alone)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    css = css.replace(';}', '}')
+    return css.strip() + '\n'
+
+
+# ============ BUILD ============
+
+def split_lazy_sections(script: str) -> tuple:
+    """Separate `// @lazy name` ... `// @end-lazy` sections, returns (main, {name: source})"""
+    main_lines, modules = [], {}
+    current = None
+    for line_number, line in enumerate(script.split('\n'), start=1):
+        start = LAZY_START.match(line)
+        if start:
+            if current is not None:
+                raise BuildError(f"Line {line_number}: @lazy {start.group(1)} inside @lazy {current}")
+            current = start.group(1)
+            modules.setdefault(current, [])
+            continue
+        if LAZY_END.match(line):
+            if current is None:
+                raise BuildError(f"Line {line_number}: @end-lazy without @lazy")
+            current = None
+            continue
+        (modules[current] if current is not None else main_lines).append(line)
+    if current is not None:
+        raise BuildError(f"@lazy {current} is not closed")
+    return '\n'.join(main_lines), {name: '\n'.join(lines) for name, lines in modules.items()}
+
+
+def module_loader(urls: dict, stubs: dict) -> str:
+    """Loader and forwarding stubs prepended to the main bundle"""
+    entries = ',\n'.join(f'    "{name}": "{url}"' for name, url in sorted(urls.items()))
+    lines = [
+        "// Generated by tools/build_dashboard.py",
+        "const DASHBOARD_MODULES = {",
+        entries,
+        "};",
+        "const dashboardModuleLoads = {};",
+        "function loadDashboardModule(name) {",
+        "    if (!dashboardModuleLoads[name]) {",
+        "        dashboardModuleLoads[name] = new Promise((resolve, reject) => {",
+        "            const script = document.createElement('script');",
+        "            script.src = DASHBOARD_MODULES[name];",
+        "            script.onload = resolve;",
+        "            script.onerror = () => {",
+        "                delete dashboardModuleLoads[name];",
+        "                reject(new Error(`Failed to load dashboard module ${name}`));",
+        "            };",
+        "            document.head.appendChild(script);",
+        "        });",
+        "    }",
+        "    return dashboardModuleLoads[name];",
+        "}",
+    ]
+    for function, module in sorted(stubs.items()):
+        # The module's own declaration replaces this one once it has run
+        lines.append(f"function {function}(...args) {{ return loadDashboardModule('{module}').then(() => window.{function}(...args)); }}")
+    return '\n'.join(lines) + '\n'
+
+
+def content_name(base: str, content: str, extension: str) -> str:
+    return f"{base}.{hashlib.sha256(content.encode()).hexdigest()[:12]}.{extension}"
+
+
+def build(html: str, url_prefix: str = DEFAULT_URL_PREFIX) -> tuple:
+    """Returns (new html, {asset filename: content})"""
+    styles = list(re.finditer(r'<style>(.*?)</style>', html, re.S))
+    scripts = list(re.finditer(r'<script>(.*?)</script>', html, re.S))
+    if len(styles) != 1 or len(scripts) != 1:
+        raise BuildError(f"Expected one inline <style> and one inline <script>, found {len(styles)} and {len(scripts)}")
+
+    script = scripts[0].group(1)
+    inline_lines = [line.strip() for line in script.split('\n') if INLINE_CONSTANT.match(line)]
+    script = '\n'.join(line for line in script.split('\n') if not INLINE_CONSTANT.match(line))
+
+    main_script, lazy_sources = split_lazy_sections(script)
+    main_names = identifiers(main_script)
+    main_functions, main_variables = top_level_declarations(main_script)
+
+    assets, urls, stubs = {}, {}, {}
+    for name, source in lazy_sources.items():
+        functions, variables = top_level_declarations(source)
+        for variable in variables:
+            # The main bundle runs before the module exists
+            if variable in main_names:
+                raise BuildError(f"Lazy module {name} declares {variable}, which the main script uses")
+        for function in functions:
+            if function in main_functions or function in stubs:
+                raise BuildError(f"{function} is declared more than once")
+            stubs[function] = name
+        minified = minify_js(source)
+        filename = content_name(name, minified, 'js')
+        assets[filename] = minified
+        urls[name] = f"{url_prefix}/{filename}"
+
+    main_js = minify_js(module_loader(urls, stubs) + main_script)
+    main_name = content_name('app', main_js, 'js')
+    assets[main_name] = main_js
+
+    css = minify_css(styles[0].group(1))
+    css_name = content_name('app', css, 'css')
+    assets[css_name] = css
+
+    head_links = [f'<link rel="stylesheet" href="{url_prefix}/{css_name}">']
+    # Fetched into the cache at low priority, parsed only when first used
+    head_links += [f'<link rel="prefetch" href="{url}">' for _, url in sorted(urls.items())]
+
+    script_tags = ''
+    if inline_lines:
+        script_tags += '<script>\n        ' + '\n        '.join(inline_lines) + '\n    </script>\n    '
+    script_tags += f'<script src="{url_prefix}/{main_name}"></script>'
+
+    html = html[:scripts[0].start()] + script_tags + html[scripts[0].end():]
+    html = html[:styles[0].start()] + '\n    '.join(head_links) + html[styles[0].end():]
+    return html, assets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split and minify pikvm-dashboard.html")
+    parser.add_argument('html', type=Path, help="Dashboard HTML to build (rewritten in place unless --output is given)")
+    parser.add_argument('--assets-dir', type=Path, required=True, help="Directory for the generated assets")
+    parser.add_argument('--url-prefix', default=DEFAULT_URL_PREFIX, help="URL the assets directory is served at")
+    parser.add_argument('--output', type=Path, help="Write the HTML here instead")
+    args = parser.parse_args()
+
+    source = args.html.read_text(encoding='utf-8')
+    try:
+        html, assets = build(source, args.url_prefix.rstrip('/'))
+    except BuildError as e:
+        print(f"Build failed: {e}", file=sys.stderr)
+        return 1
+
+    args.assets_dir.mkdir(parents=True, exist_ok=True)
+    for filename, content in assets.items():
+        data = content.encode('utf-8')
+        (args.assets_dir / filename).write_bytes(data)
+        # Precompressed copy for nginx gzip_static
+        (args.assets_dir / f"{filename}.gz").write_bytes(gzip.compress(data, compresslevel=9))
+
+    # Assets of previous builds
+    for f in args.assets_dir.iterdir():
+        if ASSET_NAME.match(f.name) and f.name.removesuffix('.gz') not in assets:
+            f.unlink()
+
+    (args.output or args.html).write_text(html, encoding='utf-8')
+
+    total = sum(len(content.encode('utf-8')) for content in assets.values())
+    print(f"Built {len(assets)} assets: {len(source.encode('utf-8'))} bytes of HTML -> "
+          f"{len(html.encode('utf-8'))} bytes of HTML + {total} bytes of assets")
+    for filename in sorted(assets):
+        print(f"  {filename} ({len(assets[filename].encode('utf-8'))} bytes)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())